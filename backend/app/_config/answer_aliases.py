@@ -0,0 +1,111 @@
+"""
+猜词答案别名表
+同一组内的词语视为同一个答案（跨语言与常见同义词），以关卡词库（levels.json）为基础
+"""
+
+# 每组第一个词为中文关卡词，其余为英文关卡词与常见说法
+ANSWER_ALIAS_GROUPS = [
+    # 新手入门
+    ["苹果", "apple"],
+    ["香蕉", "banana"],
+    ["太阳", "sun", "日头"],
+    ["月亮", "moon", "月球"],
+    ["星星", "star", "星"],
+    ["房子", "house", "房屋", "屋子", "home"],
+    ["树", "tree", "树木"],
+    ["花", "flower", "花朵"],
+    ["猫", "cat", "猫咪", "kitten", "小猫"],
+    ["狗", "dog", "小狗", "puppy", "狗狗"],
+    # 动物
+    ["大象", "elephant"],
+    ["长颈鹿", "giraffe"],
+    ["狮子", "lion"],
+    ["老虎", "tiger"],
+    ["熊猫", "panda", "大熊猫"],
+    ["兔子", "rabbit", "bunny", "兔"],
+    ["猴子", "monkey"],
+    ["企鹅", "penguin"],
+    ["海豚", "dolphin"],
+    ["蝴蝶", "butterfly"],
+    # 交通工具
+    ["汽车", "car", "小汽车", "轿车", "automobile"],
+    ["自行车", "bicycle", "bike", "单车", "脚踏车"],
+    ["火车", "train", "列车"],
+    ["飞机", "airplane", "plane", "aeroplane", "aircraft"],
+    ["轮船", "ship", "船", "boat"],
+    ["摩托车", "motorcycle", "motorbike", "机车"],
+    # 运动
+    ["足球", "soccer", "football"],
+    ["篮球", "basketball"],
+    ["乒乓球", "table tennis", "ping pong", "ping-pong"],
+    ["羽毛球", "badminton"],
+    ["网球", "tennis"],
+    ["游泳", "swimming", "swim"],
+    ["跑步", "running", "run", "jogging"],
+    ["跳绳", "jump rope", "skipping rope"],
+    ["滑冰", "ice skating", "skating", "溜冰"],
+    ["跳高", "high jump"],
+    # 中国美食
+    ["饺子", "dumpling", "水饺"],
+    ["包子", "bun", "baozi"],
+    ["馒头", "mantou", "steamed bun"],
+    ["烧饼", "sesame cake"],
+    ["月饼", "mooncake", "moon cake"],
+    ["粽子", "zongzi", "rice dumpling"],
+    ["汤圆", "tangyuan", "元宵"],
+    ["春卷", "spring roll"],
+    ["煎饼", "pancake", "jianbing"],
+    ["面条", "noodle", "noodles", "面"],
+    ["米饭", "rice", "饭"],
+    # 服饰
+    ["T恤", "t-shirt", "tee", "t恤衫", "短袖"],
+    ["裙子", "skirt", "dress"],
+    ["裤子", "pants", "trousers"],
+    ["毛衣", "sweater", "jumper"],
+    ["背心", "vest", "tank top"],
+    ["围巾", "scarf"],
+    ["帽子", "hat", "cap"],
+    ["鞋子", "shoes", "shoe", "鞋"],
+    ["袜子", "socks", "sock"],
+    ["手套", "gloves", "glove"],
+    ["领带", "tie", "necktie"],
+    ["腰带", "belt", "皮带"],
+    ["眼镜", "glasses", "spectacles", "eyeglasses"],
+    # 自然
+    ["山脉", "mountain", "山", "mountains"],
+    ["河流", "river", "河"],
+    ["湖泊", "lake", "湖"],
+    ["瀑布", "waterfall"],
+    ["森林", "forest", "树林"],
+    ["沙漠", "desert"],
+    ["海洋", "ocean", "大海", "海", "sea"],
+    ["草原", "grassland", "prairie"],
+    ["雪山", "snow mountain"],
+    ["峡谷", "canyon"],
+    # 职业
+    ["医生", "doctor", "大夫"],
+    ["老师", "teacher", "教师"],
+    ["警察", "police", "police officer", "policeman"],
+    ["厨师", "chef", "cook"],
+    ["司机", "driver"],
+    ["护士", "nurse"],
+    ["消防员", "firefighter", "fireman"],
+    ["记者", "journalist", "reporter"],
+    ["律师", "lawyer", "attorney"],
+    ["工程师", "engineer"],
+    # 情绪
+    ["开心", "happy", "高兴", "快乐"],
+    ["悲伤", "sad", "难过", "伤心"],
+    ["生气", "angry", "愤怒"],
+    ["惊讶", "surprised", "吃惊"],
+    ["害怕", "scared", "恐惧", "afraid"],
+    ["害羞", "shy"],
+    ["骄傲", "proud", "自豪"],
+    ["失望", "disappointed"],
+    ["兴奋", "excited"],
+    ["平静", "calm", "冷静"],
+]
+
+# 匹配前从候选答案中去掉的量词前缀与语气后缀（中文）和冠词（英文）
+ANSWER_PREFIXES = ['一个', '一只', '一朵', '一条', '一张', '一辆', '一座', '一本', '一支', 'a ', 'an ', 'the ']
+ANSWER_SUFFIXES = ['的', '了', '着', '过', '们', '子', '儿', '头', '手']
@@ -0,0 +1,16 @@
+"""
+接口限流策略
+令牌桶参数：(每秒补充的令牌数, 桶容量)；会话与客户端 IP 各一个桶，请求需要同时通过两者
+"""
+
+# 策略名 -> {"session": (rate, burst), "ip": (rate, burst)}
+RATE_LIMIT_POLICIES = {
+    # 猜词：边画边猜约每秒一次，允许短时连续提交
+    "guess": {"session": (1.0, 10), "ip": (3.0, 30)},
+    # 文生图 + 分解，单次成本高
+    "sketch_generate": {"session": (0.1, 3), "ip": (0.3, 6)},
+    # 纯本地计算的图片分解
+    "sketch_decompose": {"session": (0.5, 5), "ip": (1.0, 10)},
+    # 测试连接可能触发一次文生图
+    "test_connection": {"session": (0.05, 3), "ip": (0.1, 5)},
+}
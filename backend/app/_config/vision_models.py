@@ -0,0 +1,21 @@
+"""
+视觉模型图片输入规格
+按模型名称关键字匹配 (patch 边长, 推荐最长边)，预处理时把图片缩放到 patch 的整数倍
+"""
+
+# 关键字（小写子串）-> (patch, max_side)
+VISION_MODEL_PROFILES = {
+    "qwen": (28, 448),    # Qwen-VL 系列：14px patch + 2x2 合并
+    "ernie": (28, 560),   # ERNIE-VL
+    "gpt-4": (32, 512),   # OpenAI 低精度模式固定 512x512
+    "gpt-5": (32, 512),
+    "llava": (14, 336),   # CLIP ViT-L/14-336
+    "minicpm": (14, 448),
+    "glm": (14, 448),
+}
+
+# 本地 llama-server 通常不返回真实模型名，默认按 Qwen-VL GGUF 处理
+LOCAL_LLAMA_PROFILE = (28, 448)
+
+# 未匹配到任何关键字时使用
+DEFAULT_PROFILE = (28, 512)
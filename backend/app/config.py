@@ -17,11 +17,106 @@ class Config:
     MODEL_NAME: str = os.getenv("MODEL_NAME", "ernie-4.5-vl-28b-a3b")
     MODEL_URL: str = os.getenv("MODEL_URL", "https://aistudio.baidu.com/llm/lmapi/v3")
 
+    # === 两级猜词级联配置 ===
+    GUESS_CASCADE_ENABLED: bool = os.getenv("GUESS_CASCADE_ENABLED", "false").lower() == "true"  # 服务器端猜词是否先走本地小模型
+    GUESS_CASCADE_URL: str = os.getenv("GUESS_CASCADE_URL", "http://127.0.0.1:8080/v1")  # 第一级模型地址（默认本地 llama-server）
+    GUESS_CASCADE_KEY: Optional[str] = os.getenv("GUESS_CASCADE_KEY")
+    GUESS_CASCADE_MODEL: str = os.getenv("GUESS_CASCADE_MODEL", "Qwen3VL-2B-Instruct")
+    GUESS_CASCADE_MIN_CONFIDENCE: float = float(os.getenv("GUESS_CASCADE_MIN_CONFIDENCE", "0.7"))  # 无目标词时接受第一级结果的最低置信度
+
+    # === 上游熔断与超时配置 ===
+    CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))  # 连续失败多少次后熔断
+    CIRCUIT_RECOVERY_SECONDS: float = float(os.getenv("CIRCUIT_RECOVERY_SECONDS", "30"))  # 熔断后多久进入半开探测
+    UPSTREAM_TIMEOUT_MULTIPLIER: float = float(os.getenv("UPSTREAM_TIMEOUT_MULTIPLIER", "3"))  # 超时 = p99 延迟 * 倍数
+    UPSTREAM_TIMEOUT_MIN_SECONDS: float = float(os.getenv("UPSTREAM_TIMEOUT_MIN_SECONDS", "5"))  # 自适应超时下限
+    UPSTREAM_TIMEOUT_GUESS_SECONDS: float = float(os.getenv("UPSTREAM_TIMEOUT_GUESS_SECONDS", "60"))  # 猜词调用超时上限
+    UPSTREAM_TIMEOUT_SKETCH_SECONDS: float = float(os.getenv("UPSTREAM_TIMEOUT_SKETCH_SECONDS", "300"))  # 文生图调用超时上限
+
+    # === 多提供方路由配置 ===
+    # 额外的猜词提供方（JSON 数组），例如 [{"name": "local", "url": "http://127.0.0.1:8080/v1", "model": "qwen3-vl"}]
+    GUESS_PROVIDERS: Optional[str] = os.getenv("GUESS_PROVIDERS")
+    GUESS_ROUTER_EWMA_ALPHA: float = float(os.getenv("GUESS_ROUTER_EWMA_ALPHA", "0.2"))  # 延迟/错误率 EWMA 平滑系数
+    GUESS_HEDGE_ENABLED: bool = os.getenv("GUESS_HEDGE_ENABLED", "true").lower() == "true"  # 是否发送对冲请求
+    GUESS_HEDGE_DELAY_MS: float = float(os.getenv("GUESS_HEDGE_DELAY_MS", "3000"))  # 样本不足时的对冲等待时间（毫秒）
+    GUESS_HEDGE_MIN_DELAY_MS: float = float(os.getenv("GUESS_HEDGE_MIN_DELAY_MS", "200"))  # 对冲等待时间下限（毫秒）
+
+    # === 本地 llama-server 调度配置 ===
+    LLAMA_BATCH_WINDOW_MS: float = float(os.getenv("LLAMA_BATCH_WINDOW_MS", "5"))  # 请求收集窗口（毫秒）
+    LLAMA_SERVER_SLOTS: int = int(os.getenv("LLAMA_SERVER_SLOTS", "0"))  # 并行槽位数，0 表示从 /props 自动获取
+    LLAMA_QUEUE_MAX_DEPTH: int = int(os.getenv("LLAMA_QUEUE_MAX_DEPTH", "64"))  # 每个端点最多排队的请求数
+    LLAMA_CACHE_PROMPT: bool = os.getenv("LLAMA_CACHE_PROMPT", "true").lower() == "true"  # 请求时携带 cache_prompt，复用相同前缀的 KV 缓存
+    LLAMA_SLOT_AFFINITY: bool = os.getenv("LLAMA_SLOT_AFFINITY", "true").lower() == "true"  # 按会话优先复用上次的空闲 id_slot，提高前缀缓存命中率
+
+    # === 图片上传配置 ===
+    IMAGE_UPLOAD_MAX_BYTES: int = int(os.getenv("IMAGE_UPLOAD_MAX_BYTES", str(8 * 1024 * 1024)))  # 二进制上传接口允许的最大图片字节数
+
+    # === 准入控制配置 ===
+    ADMISSION_MAX_CONCURRENCY: int = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "8"))  # 每个上游端点的最大并发调用数
+    ADMISSION_MAX_QUEUE: int = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))  # 每个上游端点的最大排队数，排满时返回 429
+    ADMISSION_MAX_WAIT_SECONDS: float = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "30"))  # 排队最长等待时间（秒）
+    ADMISSION_ENDPOINT_LIMITS: str = os.getenv("ADMISSION_ENDPOINT_LIMITS", "")  # 按端点覆盖并发上限，格式 "url=并发数,url=并发数"
+
+    # === 限流配置 ===
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"  # 按会话和 IP 的令牌桶限流，策略见 _config/rate_limits.py
+    RATE_LIMIT_MAX_KEYS: int = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))  # 内存中最多保留的令牌桶数量
+    RATE_LIMIT_IDLE_SECONDS: float = float(os.getenv("RATE_LIMIT_IDLE_SECONDS", "600"))  # 空闲多久的令牌桶被淘汰
+    RATE_LIMIT_TRUST_FORWARDED: bool = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"  # 部署在反向代理后时按 X-Forwarded-For 识别客户端 IP
+    RATE_LIMIT_TRUSTED_PROXIES: int = int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "1"))  # 可信反向代理层数，取 X-Forwarded-For 从右数第 N 个地址
+
+    # === 请求截止时间配置 ===
+    DEADLINE_GUESS_SECONDS: float = float(os.getenv("DEADLINE_GUESS_SECONDS", "60"))  # 猜词请求的默认截止时间（秒）
+    DEADLINE_SKETCH_SECONDS: float = float(os.getenv("DEADLINE_SKETCH_SECONDS", "300"))  # 简笔画生成的默认截止时间（秒），本地 sd-server 可能需要数分钟
+    DEADLINE_DECOMPOSE_SECONDS: float = float(os.getenv("DEADLINE_DECOMPOSE_SECONDS", "60"))  # 图片分解的默认截止时间（秒）
+    DEADLINE_MAX_SECONDS: float = float(os.getenv("DEADLINE_MAX_SECONDS", "600"))  # 客户端通过 X-Request-Timeout 可请求的最长时间（秒）
+
+    # === 幂等键配置 ===
+    IDEMPOTENCY_TTL_SECONDS: float = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))  # Idempotency-Key 结果保存时间（秒）
+    IDEMPOTENCY_MAX_ENTRIES: int = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "1000"))  # 最多保存的结果条数
+    IDEMPOTENCY_MAX_BYTES: int = int(os.getenv("IDEMPOTENCY_MAX_BYTES", str(64 * 1024 * 1024)))  # 保存结果的总字节数上限
+
+    # === 简笔画分解缓存配置 ===
+    DECOMPOSE_CACHE_ENABLED: bool = os.getenv("DECOMPOSE_CACHE_ENABLED", "true").lower() == "true"  # 是否缓存分解结果（按像素与参数哈希）
+    DECOMPOSE_CACHE_MAX_BYTES: int = int(os.getenv("DECOMPOSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # 内存层总字节数上限（LRU 淘汰）
+    DECOMPOSE_CACHE_DIR: str = os.getenv("DECOMPOSE_CACHE_DIR", "")  # 磁盘层目录，为空时不启用
+    DECOMPOSE_CACHE_DISK_MAX_BYTES: int = int(os.getenv("DECOMPOSE_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024)))  # 磁盘层总字节数上限
+
+    # === 笔画输入配置 ===
+    STROKE_MAX_POINTS: int = int(os.getenv("STROKE_MAX_POINTS", "20000"))  # 单次请求允许的笔画点数上限
+    STROKE_MAX_CANVAS_SIDE: int = int(os.getenv("STROKE_MAX_CANVAS_SIDE", "4096"))  # 服务端绘制画板的最大边长
+    STROKE_MAX_WIDTH: float = float(os.getenv("STROKE_MAX_WIDTH", "200"))  # 单笔线宽上限
+
+    # === 边画边猜配置 ===
+    LIVE_GUESS_DEBOUNCE_MS: float = float(os.getenv("LIVE_GUESS_DEBOUNCE_MS", "700"))  # 停笔多久后发起猜测（毫秒）
+    LIVE_GUESS_MIN_DIFF: float = float(os.getenv("LIVE_GUESS_MIN_DIFF", "0.005"))  # 与上次猜测帧相比变化像素比例低于该值时跳过
+
+    # === 猜词图片预处理配置 ===
+    GUESS_IMAGE_PREPROCESS: bool = os.getenv("GUESS_IMAGE_PREPROCESS", "true").lower() == "true"  # 是否在上传前裁剪缩放画布
+    GUESS_IMAGE_MODE: str = os.getenv("GUESS_IMAGE_MODE", "gray")  # 上传图片模式: gray、binary 或 color
+    GUESS_IMAGE_MARGIN_RATIO: float = float(os.getenv("GUESS_IMAGE_MARGIN_RATIO", "0.08"))  # 笔迹包围盒四周留白比例
+
+    # === 猜词结构化输出配置 ===
+    GUESS_STRUCTURED_OUTPUT: bool = os.getenv("GUESS_STRUCTURED_OUTPUT", "true").lower() == "true"  # 服务器端/本地模型用 JSON Schema 或 GBNF 约束输出
+    GUESS_MAX_TOKENS: int = int(os.getenv("GUESS_MAX_TOKENS", "160"))  # 结构化模式下的最大生成 token 数
+
+    # === 猜词缓存配置 ===
+    GUESS_CACHE_ENABLED: bool = os.getenv("GUESS_CACHE_ENABLED", "true").lower() == "true"  # 是否启用猜词结果缓存
+    GUESS_CACHE_MAX_ENTRIES: int = int(os.getenv("GUESS_CACHE_MAX_ENTRIES", "1024"))  # 最多缓存条目数（LRU 淘汰）
+    GUESS_CACHE_TTL_SECONDS: float = float(os.getenv("GUESS_CACHE_TTL_SECONDS", "600"))  # 缓存有效期（秒）
+    GUESS_CACHE_HAMMING_THRESHOLD: int = int(os.getenv("GUESS_CACHE_HAMMING_THRESHOLD", "3"))  # 感知哈希允许的最大汉明距离，0 表示仅精确匹配
+
     # === Text2Image 模型配置 ===
     TEXT2IMAGE_MODEL_URL: str = os.getenv("TEXT2IMAGE_MODEL_URL", "https://aistudio.baidu.com/llm/lmapi/v3")
     TEXT2IMAGE_MODEL_KEY: Optional[str] = os.getenv("TEXT2IMAGE_MODEL_KEY")
     TEXT2IMAGE_MODEL_NAME: str = os.getenv("TEXT2IMAGE_MODEL_NAME", "Stable-Diffusion-XL")
 
+    # === 模型客户端连接池配置 ===
+    OPENAI_POOL_MAX_CLIENTS: int = int(os.getenv("OPENAI_POOL_MAX_CLIENTS", "32"))  # 最多缓存的客户端数量（LRU 淘汰）
+    OPENAI_POOL_MAX_CONNECTIONS: int = int(os.getenv("OPENAI_POOL_MAX_CONNECTIONS", "100"))  # 每个客户端最大连接数
+    OPENAI_POOL_MAX_KEEPALIVE: int = int(os.getenv("OPENAI_POOL_MAX_KEEPALIVE", "20"))  # 每个客户端保持的空闲连接数
+    OPENAI_POOL_KEEPALIVE_EXPIRY: float = float(os.getenv("OPENAI_POOL_KEEPALIVE_EXPIRY", "30"))  # 空闲连接保持时间（秒）
+    OPENAI_POOL_IDLE_TTL_SECONDS: float = float(os.getenv("OPENAI_POOL_IDLE_TTL_SECONDS", "600"))  # 客户端空闲多久后淘汰
+    OPENAI_HTTP2: bool = os.getenv("OPENAI_HTTP2", "false").lower() == "true"  # 是否启用 HTTP/2（需安装 h2）
+
     # === 简笔画配置 ===
     SKETCH_MAX_STEPS: int = int(os.getenv("SKETCH_MAX_STEPS", "20"))  # 笔画最大步数
     SKETCH_SORT_METHOD: str = os.getenv("SKETCH_SORT_METHOD", "area")  # 笔画排序方法: area 或 position
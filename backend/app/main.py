@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
@@ -11,8 +13,17 @@ from .routes import (
     health_router,
     admin_router,
 )
+from .services.client_pool import client_pool
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # 关闭连接池中的所有客户端，释放 keep-alive 连接
+    await client_pool.aclose()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # CORS 中间件配置 - 必须在所有路由之前添加
 app.add_middleware(
@@ -1,2 +1,21 @@
 from typing import Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
+
+from ..config import config
+
+
+class Stroke(BaseModel):
+    """画板的一笔：点序列为 [[x, y], ...] 或扁平的 [x0, y0, x1, y1, ...]"""
+    points: list[list[float]] | list[float]
+    width: float = Field(default=4, gt=0, le=config.STROKE_MAX_WIDTH)
+    erase: bool = False
+
+    @field_validator("points")
+    @classmethod
+    def check_points(cls, points):
+        if points and isinstance(points[0], list):
+            if any(len(point) != 2 for point in points):
+                raise ValueError("each point must be [x, y]")
+        elif len(points) % 2:
+            raise ValueError("flat points must have an even length")
+        return points
@@ -1,5 +1,21 @@
 from fastapi import APIRouter, BackgroundTasks, Request, HTTPException
 import time, os
+from ..services.admission import admission_control
+from ..services.ai import llama_scheduler
+from ..services.cascade import cascade_stats
+from ..services.deadline import deadline_stats
+from ..services.decompose_cache import decompose_cache
+from ..services.live_guess import live_guess_stats
+from ..services.prompt_cache import prompt_cache_stats
+from ..services.structured_output import provider_support
+from ..services.client_pool import client_pool
+from ..services.guess_cache import guess_cache
+from ..services.idempotency import idempotency_store
+from ..services.image_preprocess import preprocess_stats
+from ..services.provider_router import guess_router
+from ..services.rate_limit import rate_limiter
+from ..services.resilience import upstream_breakers
+from ..services.single_flight import guess_flight, sketch_flight
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -31,4 +47,32 @@ async def shutdown(background_tasks: BackgroundTasks, wait_seconds: float = 1.0,
     # 添加后台任务
     background_tasks.add_task(_delayed_shutdown, wait_seconds)
 
-    return {"status": "shutting_down", "wait_seconds": wait_seconds}
\ No newline at end of file
+    return {"status": "shutting_down", "wait_seconds": wait_seconds}
+
+
+@router.get("/metrics")
+async def metrics():
+    """
+    运行时指标：模型客户端连接池、猜词缓存、图片预处理、请求合并、本地模型调度、提供方路由、级联、前缀缓存、边画边猜、准入排队、限流、截止时间、幂等键、分解缓存、熔断器等
+    """
+    return {
+        "openai_client_pool": client_pool.stats(),
+        "guess_cache": guess_cache.stats(),
+        "image_preprocess": preprocess_stats.stats(),
+        "llama_scheduler": llama_scheduler.stats(),
+        "guess_router": guess_router.stats(),
+        "guess_cascade": cascade_stats.stats(),
+        "structured_output": provider_support.stats(),
+        "prompt_cache": prompt_cache_stats.stats(),
+        "live_guess": live_guess_stats.stats(),
+        "admission": admission_control.stats(),
+        "rate_limit": rate_limiter.stats(),
+        "deadlines": deadline_stats.stats(),
+        "idempotency": idempotency_store.stats(),
+        "decompose_cache": decompose_cache.stats(),
+        "circuit_breakers": upstream_breakers.stats(),
+        "single_flight": {
+            "guess": guess_flight.stats(),
+            "sketch": sketch_flight.stats(),
+        },
+    }
@@ -1,10 +1,20 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, WebSocket
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from ..services.ai import guess_drawing
-from ..shared import get_user_by_session
-from ..database import SessionLocal, User, UserSession
+from ..models.schemas import Stroke
+from ..services.admission import AdmissionRejected, admission_priority
+from ..services.ai import guess_drawing_async, stream_guess_drawing
+from ..services.client_pool import client_pool
+from ..services.image_utils import decode_base64_image
+from ..services.live_guess import LiveGuessSession
+from ..services.rate_limit import RateLimited, rate_limiter
+from ..services.stroke_raster import strokes_bbox
+from ..shared import (
+    get_user_by_session, deduct_user_call, has_idempotency_key, idempotent, iterate_within_deadline, rate_limit, read_upload,
+    run_with_deadline, stream_response, stroke_drawing,
+)
 from ..config import config
-import openai
+import json
 import os
 
 router = APIRouter(prefix="/ai", tags=["ai"])
@@ -18,7 +28,10 @@ class ModelConfig(BaseModel):
 
 
 class GuessRequest(BaseModel):
-    image: str
+    image: str | None = None  # PNG data URL；与 strokes 二选一
+    strokes: list[Stroke] | None = None  # 矢量笔画，由服务端按模型分辨率绘制
+    canvas_width: int | None = None
+    canvas_height: int | None = None
     clue: str | None = None
     hint: str | None = None  # legacy payload key
     target: str | None = None  # 绘制目标，用于判断是否猜中
@@ -33,20 +46,17 @@ class TestConnectionRequest(BaseModel):
     model: str
     model_type: str = "vision"  # "vision" 或 "image"
 
-@router.post("/guess")
-@router.post("/recognize")
-async def guess(req: GuessRequest):
-    """Call AI vision-language model to guess drawing content."""
-    
+async def _resolve_guess_config(req: GuessRequest):
+    """根据会话和调用偏好选择模型配置，返回 (config, provider, is_server_call, priority)"""
     # 新增：判断会话有效性和服务点
     user = None
     session_id = getattr(req, 'session_id', None)  # 如果前端传递了session_id
     if session_id:
-        user = get_user_by_session(session_id)
+        # 数据库查询放到线程池，避免阻塞事件循环
+        user = await run_in_threadpool(get_user_by_session, session_id)
     calls_remaining = getattr(user, "calls_remaining", 0) if user else 0
     session_valid = user is not None
-    # 提取线索信息
-    clue = req.clue or req.hint
+    is_admin = bool(getattr(user, "is_admin", False))
 
     # 准备配置
     config_custom = req.config.dict(exclude_none=True) if req.config else {}
@@ -58,130 +68,286 @@ async def guess(req: GuessRequest):
 
     # 根据调用偏好和条件选择配置
     call_preference = (req.call_preference or "server").lower()
-    is_server_call = False
-    
+
     if call_preference == "server" and session_valid and calls_remaining > 0:
         # 倾向服务器且条件满足，使用服务器配置
-        config_to_use = config_server
-        provider = "server"
-        is_server_call = True
         print(f"🔍 使用服务器端AI配置")
-    else:
-        # 其他情况使用自定义配置
-        config_to_use = config_custom
-        provider = "custom"
-        reason = []
-        if call_preference != "server":
-            reason.append(f"调用偏好为 '{call_preference}'")
-        if not session_valid:
-            reason.append("会话无效")
-        if calls_remaining <= 0:
-            reason.append(f"剩余调用次数为 {calls_remaining}")
-        reason_str = ", ".join(reason)
-        print(f"🔍 使用自定义AI配置 (原因: {reason_str})")
-
-    # 统一调用AI服务
-    result = guess_drawing(req.image, clue, config_to_use, req.target, provider, req.language)
-    
-    # 如果是服务器端调用且成功，扣除点数
-    if is_server_call and result.get("success") and result.get("provider") == "server":
-        # 扣除用户点数
-        db = SessionLocal()
-        try:
-            # 在当前数据库会话中重新获取用户对象
-            session_record = db.query(UserSession).filter(UserSession.session_id == session_id).first()
-            if session_record:
-                user_in_db = db.query(User).filter(User.id == session_record.user_id).first()
-                if user_in_db:
-                    user_in_db.calls_remaining -= 1
-                    db.commit()
-                    print(f"🔹 用户 {user_in_db.username} 服务器调用成功，剩余点数: {user_in_db.calls_remaining}")
-                else:
-                    print(f"❌ 无法找到用户记录")
-            else:
-                print(f"❌ 无法找到会话记录")
-        except Exception as e:
-            db.rollback()
-            print(f"❌ 扣除点数失败: {e}")
-        finally:
-            db.close()
+        return config_server, "server", True, admission_priority(is_admin, True)
+
+    # 其他情况使用自定义配置
+    reason = []
+    if call_preference != "server":
+        reason.append(f"调用偏好为 '{call_preference}'")
+    if not session_valid:
+        reason.append("会话无效")
+    if calls_remaining <= 0:
+        reason.append(f"剩余调用次数为 {calls_remaining}")
+    reason_str = ", ".join(reason)
+    print(f"🔍 使用自定义AI配置 (原因: {reason_str})")
+    return config_custom, "custom", False, admission_priority(is_admin, False)
+
+
+async def _charge_guess(req: GuessRequest, result: dict, is_server_call: bool) -> None:
+    # 如果是服务器端调用且成功，扣除点数；命中缓存时没有真正调用上游，不扣费
+    if is_server_call and result.get("cached"):
+        print(f"ℹ️ 命中猜词缓存，未扣费")
+    elif is_server_call and result.get("success") and result.get("provider") == "server":
+        await run_in_threadpool(deduct_user_call, req.session_id)
     elif is_server_call:
         print(f"ℹ️ 未扣费: success={result.get('success')}, provider={result.get('provider')}")
     else:
         print(f"ℹ️ 自定义AI调用完成，无需扣费")
-    
+
+
+def _guess_succeeded(result: dict) -> bool:
+    # 上游错误不保存，客户端带同一个幂等键重试时重新调用
+    return bool(result.get("success"))
+
+
+def _request_image(req: GuessRequest):
+    """优先使用矢量笔画，其次是 data URL"""
+    if req.strokes is not None:
+        drawing = stroke_drawing(req.strokes, req.canvas_width, req.canvas_height)
+        # 空画板不调用模型，也不扣费
+        if strokes_bbox(drawing.strokes) is None:
+            raise HTTPException(status_code=400, detail="Strokes contain no ink")
+        return drawing
+    if req.image:
+        return req.image
+    raise HTTPException(status_code=400, detail="Either image or strokes is required")
+
+
+async def _run_guess(req: GuessRequest, image, request: Request | None = None) -> dict:
+    """HTTP 请求传入 request 时受截止时间约束，客户端断开即取消上游调用"""
+    config_to_use, provider, is_server_call, priority = await _resolve_guess_config(req)
+    # 提取线索信息
+    clue = req.clue or req.hint
+
+    # 统一调用AI服务（异步，不阻塞事件循环）；上游排队已满时快速返回 429
+    call = lambda: guess_drawing_async(
+        image, clue, config_to_use, req.target, provider, req.language,
+        session_id=req.session_id, priority=priority,
+    )
+    try:
+        if request is not None:
+            # 带幂等键时客户端断开不取消，重试可以直接重放结果
+            result = await run_with_deadline(
+                request, "guess", call, cancel_on_disconnect=not has_idempotency_key(request)
+            )
+        else:
+            result = await call()
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    await _charge_guess(req, result, is_server_call)
     return result
 
 
-@router.post("/test-connection")
+@router.post("/guess", dependencies=[Depends(rate_limit("guess"))])
+@router.post("/recognize", dependencies=[Depends(rate_limit("guess"))])
+async def guess(req: GuessRequest, request: Request):
+    """Call AI vision-language model to guess drawing content.
+
+    Accepts either a rendered `image` data URL or the board's vector `strokes`.
+    `X-Request-Timeout` (seconds) shortens the default deadline. With an
+    `Idempotency-Key` header a retried request replays the first successful result
+    instead of calling the model and charging again.
+    """
+    image = _request_image(req)
+    return await idempotent(
+        request, "guess", await request.body(), lambda: _run_guess(req, image, request), _guess_succeeded
+    )
+
+
+@router.post("/guess/raw", dependencies=[Depends(rate_limit("guess"))])
+async def guess_raw(
+    request: Request,
+    clue: str | None = None,
+    target: str | None = None,
+    call_preference: str | None = None,
+    session_id: str | None = None,
+    language: str | None = None,
+    model_url: str | None = None,
+    model_name: str | None = None,
+    model_prompt: str | None = None,
+    x_model_key: str | None = Header(None),
+):
+    """Binary variant of `/ai/guess`.
+
+    The body is the raw image (`application/octet-stream`, PNG/JPEG/WebP) and the
+    other fields are query parameters; a custom model key goes in `X-Model-Key`
+    so it never appears in URLs or access logs.
+    """
+    image = await read_upload(request)
+    custom = {"url": model_url, "key": x_model_key, "model": model_name, "prompt": model_prompt}
+    req = GuessRequest(
+        clue=clue,
+        target=target,
+        config=ModelConfig(**custom) if any(custom.values()) else None,
+        call_preference=call_preference,
+        session_id=session_id,
+        language=language,
+    )
+    payload = request.url.query.encode("utf-8") + b"\n" + bytes(image)
+    return await idempotent(request, "guess", payload, lambda: _run_guess(req, image, request), _guess_succeeded)
+
+
+@router.post("/guess/stream", dependencies=[Depends(rate_limit("guess"))])
+async def guess_stream(req: GuessRequest, request: Request):
+    """Stream the guess over Server-Sent Events.
+
+    Emits `best_guess`, `alternative` and `reason` events as soon as each field is
+    complete, followed by a final `result` event with the full `/ai/guess` payload
+    and `done`. The `X-Request-Timeout` deadline applies and a disconnect cancels the
+    upstream call; a timeout is reported as an `error` event with status 504.
+    """
+    image = _request_image(req)
+    config_to_use, provider, is_server_call, priority = await _resolve_guess_config(req)
+    clue = req.clue or req.hint
+
+    async def events(deadline):
+        guesses = stream_guess_drawing(
+            image, clue, config_to_use, req.target, provider, req.language, priority=priority
+        )
+        async for event, payload in iterate_within_deadline(guesses, deadline, "guess"):
+            if event == "result":
+                await _charge_guess(req, payload, is_server_call)
+            yield event, payload
+
+    return stream_response(request, "guess", "sse", events, "AI猜词失败")
+
+
+@router.websocket("/guess/live")
+async def guess_live(websocket: WebSocket):
+    """Guess while the player draws.
+
+    Client messages (JSON text frames unless noted):
+    - `{"type": "config", ...}` with the `GuessRequest` fields except `image`
+    - `{"type": "snapshot", "image": "<data URL>"}` or a binary frame with the raw image
+    - `{"type": "strokes", "strokes": [{"points": [[x, y], ...], "width": 4}], "width": W, "height": H, "clear": false}`
+    - `{"type": "clear"}`
+
+    Frames are debounced; a model call is only made when the canvas changed enough
+    since the last guessed frame, and a newer guess cancels the one still in flight.
+    Server messages: `guess` (the `/ai/guess` payload plus `frame`), `skipped`,
+    `cancelled` and `error`.
+    """
+    await websocket.accept()
+    settings = {"req": GuessRequest(image="")}
+
+    async def run_guess(image: bytes) -> dict:
+        try:
+            if config.RATE_LIMIT_ENABLED:
+                client_host = websocket.client.host if websocket.client else None
+                rate_limiter.check("guess", settings["req"].session_id, client_host)
+            return await _run_guess(settings["req"], image)
+        except RateLimited as e:
+            return {"success": False, "error": str(e), "retry_after": e.retry_after}
+        except HTTPException as e:
+            return {"success": False, "error": e.detail, "retry_after": (e.headers or {}).get("Retry-After")}
+
+    session = LiveGuessSession(run_guess, websocket.send_json)
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                if len(message["bytes"]) > config.IMAGE_UPLOAD_MAX_BYTES:
+                    await session.send({"type": "error", "error": "图片超过大小限制"})
+                    continue
+                session.push_snapshot(message["bytes"])
+                continue
+
+            try:
+                data = json.loads(message.get("text") or "{}")
+                kind = data.pop("type", None)
+                if kind == "config":
+                    settings["req"] = GuessRequest(image="", **data)
+                elif kind == "snapshot":
+                    session.push_snapshot(decode_base64_image(data["image"]))
+                elif kind == "strokes":
+                    # 与 HTTP 接口相同的点数与画板尺寸上限，超限时拒绝本条消息
+                    drawing = stroke_drawing(data.get("strokes") or [], data.get("width"), data.get("height"))
+                    session.push_strokes(drawing.strokes, drawing.width, drawing.height, bool(data.get("clear")))
+                elif kind == "clear":
+                    session.clear()
+                else:
+                    await session.send({"type": "error", "error": f"未知消息类型: {kind}"})
+            except HTTPException as e:
+                await session.send({"type": "error", "error": e.detail})
+            except Exception as e:
+                await session.send({"type": "error", "error": f"消息格式错误: {e}"})
+    finally:
+        await session.close()
+
+
+@router.post("/test-connection", dependencies=[Depends(rate_limit("test_connection"))])
 async def test_ai_connection(req: TestConnectionRequest):
     """Test AI service connection with provided configuration."""
     try:
         
-        # 创建 OpenAI 客户端
-        client = openai.OpenAI(
-            api_key=req.key,
-            base_url=req.url
-        )
+        # 从连接池租用异步 OpenAI 客户端，避免阻塞事件循环
+        async with client_pool.client(req.url, req.key) as client:
         
-        if req.model_type == "image":
-            # 测试文生图模型
-            print(f"🖼️ 测试文生图模型连接: {req.model}")
-            response = client.images.generate(
-                model=req.model,
-                prompt="A simple test image of a blue circle",
-                response_format="b64_json"
-            )
+            if req.model_type == "image":
+                # 测试文生图模型
+                print(f"🖼️ 测试文生图模型连接: {req.model}")
+                response = await client.images.generate(
+                    model=req.model,
+                    prompt="A simple test image of a blue circle",
+                    response_format="b64_json"
+                )
             
-            # 检查响应
-            if response.data and len(response.data) > 0:
-                b64_data = response.data[0].b64_json
-                if b64_data:
-                    return {
-                        "success": True,
-                        "message": "文生图模型连接正常！成功生成测试图像",
-                        "image_data": b64_data
-                    }
+                # 检查响应
+                if response.data and len(response.data) > 0:
+                    b64_data = response.data[0].b64_json
+                    if b64_data:
+                        return {
+                            "success": True,
+                            "message": "文生图模型连接正常！成功生成测试图像",
+                            "image_data": b64_data
+                        }
+                    else:
+                        return {
+                            "success": False,
+                            "message": "连接成功但未获取到图像数据"
+                        }
                 else:
                     return {
                         "success": False,
-                        "message": "连接成功但未获取到图像数据"
+                        "message": "连接成功但响应格式异常"
                     }
             else:
-                return {
-                    "success": False,
-                    "message": "连接成功但响应格式异常"
-                }
-        else:
-            # 测试视觉模型（原有逻辑）
-            print(f"👁️ 测试视觉模型连接: {req.model}")
-            response = client.chat.completions.create(
-                model=req.model,
-                messages=[
-                    {"role": "user", "content": "Hello!"}
-                ],
-                max_tokens=50,
-                temperature=0.1
-            )
+                # 测试视觉模型（原有逻辑）
+                print(f"👁️ 测试视觉模型连接: {req.model}")
+                response = await client.chat.completions.create(
+                    model=req.model,
+                    messages=[
+                        {"role": "user", "content": "Hello!"}
+                    ],
+                    max_tokens=50,
+                    temperature=0.1
+                )
             
-            # 检查响应
-            if response.choices and len(response.choices) > 0:
-                reply = response.choices[0].message.content
-                if reply and reply.strip():
-                    return {
-                        "success": True,
-                        "message": f"视觉模型连接正常！回复: \"{reply.strip()}\""
-                    }
+                # 检查响应
+                if response.choices and len(response.choices) > 0:
+                    reply = response.choices[0].message.content
+                    if reply and reply.strip():
+                        return {
+                            "success": True,
+                            "message": f"视觉模型连接正常！回复: \"{reply.strip()}\""
+                        }
+                    else:
+                        return {
+                            "success": False,
+                            "message": "连接成功但未收到有效回复"
+                        }
                 else:
                     return {
                         "success": False,
-                        "message": "连接成功但未收到有效回复"
+                        "message": "连接成功但响应格式异常"
                     }
-            else:
-                return {
-                    "success": False,
-                    "message": "连接成功但响应格式异常"
-                }
             
     except Exception as e:
         error_msg = str(e)
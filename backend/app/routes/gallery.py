@@ -1,16 +1,24 @@
 import os
 import base64
 from datetime import datetime
-from fastapi import APIRouter, HTTPException, Header, Depends
+from fastapi import APIRouter, HTTPException, Header, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from ..database import Gallery, User, get_db
-from ..shared import get_user_by_session
+from ..models.schemas import Stroke
+from ..config import config
+from ..services.image_utils import sniff_image_mime
+from ..services.stroke_raster import render_png
+from ..shared import get_user_by_session, read_upload, stroke_drawing
 
 router = APIRouter(prefix="/gallery", tags=["gallery"])
 
 class SaveGalleryRequest(BaseModel):
-    image: str  # base64 encoded image
+    image: str | None = None  # base64 encoded image
+    strokes: list[Stroke] | None = None  # 或者传矢量笔画，由服务端按画板尺寸绘制
+    canvas_width: int | None = None
+    canvas_height: int | None = None
     name: str = "佚名"
 
 @router.post("/save")
@@ -18,10 +26,14 @@ async def save_to_gallery(request: SaveGalleryRequest, session_id: str = Header(
     import traceback
     print("[DEBUG] /gallery/save called")
     print(f"[DEBUG] Request: name={request.name}, session_id={session_id}")
-    user = None
-    if session_id:
-        user = get_user_by_session(session_id)
-        print(f"[DEBUG] User from session: {user}")
+
+    if request.strokes is not None:
+        drawing = stroke_drawing(request.strokes, request.canvas_width, request.canvas_height)
+        image_data = await run_in_threadpool(render_png, drawing, config.STROKE_MAX_CANVAS_SIDE)
+        print(f"[DEBUG] Rendered {len(drawing.strokes)} strokes, image data length: {len(image_data)}")
+        return _save_image(image_data, 'image/png', request.name, session_id, db)
+    if not request.image:
+        raise HTTPException(status_code=400, detail="Either image or strokes is required")
 
     # Decode image data
     try:
@@ -32,13 +44,42 @@ async def save_to_gallery(request: SaveGalleryRequest, session_id: str = Header(
         traceback.print_exc()
         raise HTTPException(status_code=400, detail=f"Invalid image data: {str(e)}")
 
+    return _save_image(image_data, 'image/png', request.name, session_id, db)
+
+
+@router.post("/save/raw")
+async def save_to_gallery_raw(
+    request: Request,
+    name: str = "佚名",
+    session_id: str = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Binary variant of /gallery/save: the body is the raw image, the name is a query parameter."""
+    print(f"[DEBUG] /gallery/save/raw called: name={name}, session_id={session_id}")
+    image_data = await read_upload(request)
+    mime_type = sniff_image_mime(image_data)
+    if mime_type is None:
+        raise HTTPException(status_code=400, detail="Invalid image data: unsupported format")
+    print(f"[DEBUG] Image data length: {len(image_data)}, mime={mime_type}")
+
+    return _save_image(image_data, mime_type, name, session_id, db)
+
+
+def _save_image(image_data: bytes, mime_type: str, name: str, session_id: str, db: Session):
+    import traceback
+    user = None
+    if session_id:
+        user = get_user_by_session(session_id)
+        print(f"[DEBUG] User from session: {user}")
+
     # Generate filename and timestamp
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{timestamp}.png"
+    extension = mime_type.split('/')[-1].replace('jpeg', 'jpg')
+    filename = f"{timestamp}.{extension}"
     print(f"[DEBUG] Generated filename: {filename}")
 
     # Get username: use provided name, or user's real name if logged in and no name provided
-    username = request.name or "佚名"  # Ensure we have a name
+    username = name or "佚名"  # Ensure we have a name
     user_id = None
     if user:
         user_id = user.id
@@ -53,7 +94,7 @@ async def save_to_gallery(request: SaveGalleryRequest, session_id: str = Header(
             timestamp=timestamp,
             likes=0,
             image_data=image_data,
-            image_mime_type='image/png'
+            image_mime_type=mime_type
         )
         db.add(gallery_item)
         print("[DEBUG] Gallery item added to session")
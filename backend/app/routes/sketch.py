@@ -1,16 +1,28 @@
 """
 简笔画生成和分解路由
 """
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel, Field
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, model_validator
 from typing import Optional
-from app.services.sketch_service import sketch_service
+from app.services.sketch_service import DecomposeOptions, check_output_format, sketch_service
+from app.services.image_utils import decode_base64_image
+from app.services.single_flight import sketch_flight, make_flight_key
+from app.services.admission import AdmissionRejected, admission_control, admission_priority
+from app.services.resilience import CircuitOpenError
 from app.config import config
-from app.shared import get_user_by_session
-from app.database import SessionLocal, User, UserSession
+from app.shared import (
+    get_user_by_session, deduct_user_call, has_idempotency_key, idempotent, iterate_in_thread, rate_limit, read_upload,
+    run_with_deadline, run_within_deadline, stream_response,
+)
 
 router = APIRouter(prefix="/sketch", tags=["sketch"])
 
+OUTPUT_FORMAT_PATTERN = "^(png|polyline|svg|delta|grid)$"
+CODEC_PATTERN = "^(png|webp)$"
+STREAM_FORMAT_PATTERN = "^(ndjson|sse)$"
+
 
 class ModelConfig(BaseModel):
     url: str | None = None
@@ -26,6 +38,16 @@ class GenerateSketchRequest(BaseModel):
     session_id: str | None = Field(None, description="用户会话ID，可选")
     config: ModelConfig | None = None
     call_preference: str | None = None  # 调用偏好: 'custom' 或 'server'
+    output_format: str = Field(default="png", pattern=OUTPUT_FORMAT_PATTERN, description="步骤输出格式: png、polyline、svg、delta 或 grid（仅分割模式）")
+    tolerance: float = Field(default=1.0, ge=0, le=20, description="折线简化容差（像素），仅 polyline/svg 有效")
+    codec: str = Field(default="png", pattern=CODEC_PATTERN, description="图块编码: png 或 webp，仅 delta 与 grid 有效")
+    level: int = Field(default=6, ge=0, le=9, description="PNG 压缩级别，仅 delta 与 grid 有效")
+    seed: int | None = Field(None, ge=0, le=2**32 - 1, description="分割模式揭示顺序的随机种子，可选")
+
+    @model_validator(mode="after")
+    def check_format_matches_sort_method(self):
+        check_output_format(self.sort_method, self.output_format)
+        return self
 
 
 class DecomposeImageRequest(BaseModel):
@@ -34,12 +56,35 @@ class DecomposeImageRequest(BaseModel):
     max_steps: int = Field(default=config.SKETCH_MAX_STEPS, description="最大步数", ge=1, le=50)
     sort_method: str = Field(default=config.SKETCH_SORT_METHOD, description="排序方法: area 或 position")
     session_id: str | None = Field(None, description="用户会话ID，可选")
+    output_format: str = Field(default="png", pattern=OUTPUT_FORMAT_PATTERN, description="步骤输出格式: png、polyline、svg、delta 或 grid（仅分割模式）")
+    tolerance: float = Field(default=1.0, ge=0, le=20, description="折线简化容差（像素），仅 polyline/svg 有效")
+    codec: str = Field(default="png", pattern=CODEC_PATTERN, description="图块编码: png 或 webp，仅 delta 与 grid 有效")
+    level: int = Field(default=6, ge=0, le=9, description="PNG 压缩级别，仅 delta 与 grid 有效")
+    seed: int | None = Field(None, ge=0, le=2**32 - 1, description="分割模式揭示顺序的随机种子，可选")
+
+    @model_validator(mode="after")
+    def check_format_matches_sort_method(self):
+        check_output_format(self.sort_method, self.output_format)
+        return self
+
 
+def _decompose_options(request) -> DecomposeOptions:
+    return DecomposeOptions(
+        output_format=request.output_format,
+        tolerance=request.tolerance,
+        codec=request.codec,
+        level=request.level,
+        seed=request.seed,
+    )
 
-@router.post("/generate")
-async def generate_sketch(request: GenerateSketchRequest):
+
+@router.post("/generate", dependencies=[Depends(rate_limit("sketch_generate"))])
+async def generate_sketch(request: GenerateSketchRequest, http_request: Request):
     """
     生成简笔画并分解为步骤
+
+    客户端断开或超过截止时间（X-Request-Timeout 或 DEADLINE_SKETCH_SECONDS）时取消生成与分解；
+    带 Idempotency-Key 请求头的重试直接重放首次成功的结果，不重复生成和扣费
     
     Args:
         request: 包含提示词和参数的请求
@@ -47,76 +92,106 @@ async def generate_sketch(request: GenerateSketchRequest):
     Returns:
         包含完整简笔画和步骤列表的响应
     """
+    return await idempotent(
+        http_request, "sketch_generate", await http_request.body(), lambda: _generate_sketch(request, http_request)
+    )
+
+
+async def _resolve_sketch_config(request: GenerateSketchRequest):
+    """按调用偏好和剩余点数选择文生图配置，返回 (用户, 配置, provider, 是否服务器调用, 排队优先级)"""
+    # 获取用户信息（如果有session_id）
+    user = None
+    calls_remaining = 0
+    if request.session_id:
+        user = await run_in_threadpool(get_user_by_session, request.session_id)
+        if user:
+            calls_remaining = getattr(user, "calls_remaining", 0)
+    
+    # 准备配置
+    config_custom = request.config.dict(exclude_none=True) if request.config else {}
+    config_server = {
+        'key': config.TEXT2IMAGE_MODEL_KEY,
+        'model': config.TEXT2IMAGE_MODEL_NAME,
+        'url': config.TEXT2IMAGE_MODEL_URL
+    }
+    
+    # 根据调用偏好选择配置
+    call_preference = (request.call_preference or "custom").lower()
+    is_server_call = False
+    
+    print(f"📊 调用偏好: {call_preference}, 用户: {user}, 剩余点数: {calls_remaining}")
+    print(f"📊 自定义配置: {config_custom}")
+    
+    if call_preference == "server" and user and calls_remaining > 0:
+        config_to_use = config_server
+        provider = "server"
+        is_server_call = True
+        print(f"🎨 使用服务器端文生图配置")
+    else:
+        config_to_use = config_custom
+        provider = "custom"
+        reason = []
+        if call_preference != "server":
+            reason.append(f"调用偏好为 '{call_preference}'")
+        if not user:
+            reason.append("未登录")
+        elif calls_remaining <= 0:
+            reason.append(f"剩余点数 {calls_remaining}")
+        print(f"🎨 使用自定义文生图配置 (原因: {', '.join(reason)})")
+    
+    priority = admission_priority(bool(getattr(user, "is_admin", False)), is_server_call)
+    return user, config_to_use, provider, is_server_call, priority
+
+
+async def _step_events(events, deadline):
+    """在线程中推进 iter_decomposition，给每一步加上序号"""
+    index = 0
+    async for event, payload in iterate_in_thread(events, deadline):
+        if event == "step":
+            payload = {"index": index, "step": payload}
+            index += 1
+        yield event, payload
+
+
+async def _generate_sketch(request: GenerateSketchRequest, http_request: Request):
     try:
-        # 获取用户信息（如果有session_id）
-        user = None
-        calls_remaining = 0
-        if request.session_id:
-            user = get_user_by_session(request.session_id)
-            if user:
-                calls_remaining = getattr(user, "calls_remaining", 0)
-        
-        # 准备配置
-        config_custom = request.config.dict(exclude_none=True) if request.config else {}
-        config_server = {
-            'key': config.TEXT2IMAGE_MODEL_KEY,
-            'model': config.TEXT2IMAGE_MODEL_NAME,
-            'url': config.TEXT2IMAGE_MODEL_URL
-        }
-        
-        # 根据调用偏好选择配置
-        call_preference = (request.call_preference or "custom").lower()
-        is_server_call = False
-        
-        print(f"📊 调用偏好: {call_preference}, 用户: {user}, 剩余点数: {calls_remaining}")
-        print(f"📊 自定义配置: {config_custom}")
-        
-        if call_preference == "server" and user and calls_remaining > 0:
-            config_to_use = config_server
-            provider = "server"
-            is_server_call = True
-            print(f"🎨 使用服务器端文生图配置")
-        else:
-            config_to_use = config_custom
-            provider = "custom"
-            reason = []
-            if call_preference != "server":
-                reason.append(f"调用偏好为 '{call_preference}'")
-            if not user:
-                reason.append("未登录")
-            elif calls_remaining <= 0:
-                reason.append(f"剩余点数 {calls_remaining}")
-            print(f"🎨 使用自定义文生图配置 (原因: {', '.join(reason)})")
-        
-        # 生成并分解简笔画
-        result = sketch_service.generate_and_decompose(
-            prompt=request.prompt,
-            max_steps=request.max_steps,
-            sort_method=request.sort_method,
-            config=config_to_use
+        user, config_to_use, provider, is_server_call, priority = await _resolve_sketch_config(request)
+
+        # 生成并分解简笔画；相同提示词和参数的并发请求共享同一次上游调用，
+        # 真正调用上游的请求按端点并发上限和优先级排队；带幂等键时客户端断开不取消
+        flight_key = make_flight_key(
+            request.prompt,
+            request.max_steps,
+            request.sort_method,
+            request.output_format,
+            request.tolerance,
+            request.codec,
+            request.level,
+            request.seed,
+            config_to_use.get('url'),
+            config_to_use.get('model'),
+            config_to_use.get('key'),
         )
+        result, coalesced = await run_with_deadline(http_request, "sketch", lambda: sketch_flight.run(
+            flight_key,
+            lambda: admission_control.run(
+                config_to_use.get('url'),
+                priority,
+                lambda: sketch_service.generate_and_decompose_async(
+                    prompt=request.prompt,
+                    max_steps=request.max_steps,
+                    sort_method=request.sort_method,
+                    config=config_to_use,
+                    options=_decompose_options(request),
+                ),
+            ),
+        ), cancel_on_disconnect=not has_idempotency_key(http_request))
+        if coalesced:
+            print(f"🎨 与进行中的相同请求合并，共享生成结果")
         
-        # 如果是服务器端调用且成功，扣除点数
+        # 如果是服务器端调用且成功，扣除点数（合并的请求同样按调用者扣费）
         if is_server_call and user and request.session_id:
-            # 扣除用户点数
-            db = SessionLocal()
-            try:
-                session_record = db.query(UserSession).filter(UserSession.session_id == request.session_id).first()
-                if session_record:
-                    user_in_db = db.query(User).filter(User.id == session_record.user_id).first()
-                    if user_in_db:
-                        user_in_db.calls_remaining -= 1
-                        db.commit()
-                        print(f"🎨 用户 {user_in_db.username} 生成简笔画成功，剩余点数: {user_in_db.calls_remaining}")
-                    else:
-                        print("❌ 无法找到用户记录")
-                else:
-                    print("❌ 无法找到会话记录")
-            except Exception as e:
-                db.rollback()
-                print(f"❌ 扣除点数失败: {e}")
-            finally:
-                db.close()
+            await run_in_threadpool(deduct_user_call, request.session_id)
         else:
             print(f"🎨 自定义文生图调用完成，无需扣费")
         
@@ -127,14 +202,62 @@ async def generate_sketch(request: GenerateSketchRequest):
         }
     except HTTPException:
         raise
+    except AdmissionRejected as e:
+        # 排队已满，快速拒绝
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except CircuitOpenError as e:
+        # 上游熔断中，快速失败并告知客户端重试时间
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"生成简笔画失败: {str(e)}")
 
 
-@router.post("/decompose")
-async def decompose_image(request: DecomposeImageRequest):
+@router.post("/generate/stream", dependencies=[Depends(rate_limit("sketch_generate"))])
+async def generate_sketch_stream(
+    request: GenerateSketchRequest,
+    http_request: Request,
+    stream_format: str = Query(default="ndjson", pattern=STREAM_FORMAT_PATTERN, description="ndjson 或 sse"),
+):
+    """
+    流式版本的 /sketch/generate
+
+    生成完成后先发送 meta 事件（final_sketch、total_steps 等，与 /sketch/generate 的 data 字段相同，
+    另带 provider），之后每渲染完一步发送一个 step 事件 {"index", "step"}，最后发送 done；
+    出错时发送 error 事件。服务器调用在图片生成成功后、发送 meta 之前扣费
+    """
+    user, config_to_use, provider, is_server_call, priority = await _resolve_sketch_config(request)
+
+    async def events(deadline):
+        image_data = await run_within_deadline(deadline, "sketch", lambda: admission_control.run(
+            config_to_use.get('url'),
+            priority,
+            lambda: sketch_service.generate_image_async(request.prompt, config_to_use),
+        ))
+        # 图片生成成功即扣费：meta 事件已包含完整简笔画，之后断开也不能免费获得结果
+        if is_server_call and user and request.session_id:
+            await run_in_threadpool(deduct_user_call, request.session_id)
+        image_array = await asyncio.to_thread(sketch_service.decode_image, image_data)
+        steps = sketch_service.iter_decomposition(
+            image_array, request.max_steps, request.sort_method, _decompose_options(request), cache=False
+        )
+        async for event, payload in _step_events(steps, deadline):
+            if event == "meta":
+                payload = {**payload, "provider": provider}
+            yield event, payload
+
+    return stream_response(http_request, "sketch", stream_format, events, "生成简笔画失败")
+
+
+@router.post("/decompose", dependencies=[Depends(rate_limit("sketch_decompose"))])
+async def decompose_image(request: DecomposeImageRequest, http_request: Request):
     """
     分解已有图片为简笔画步骤
+
+    output_format 为 polyline/svg 时每一步返回简化后的闭合折线（扁平坐标）或 SVG path，
+    同时给出画布 width/height 与 stroke_width，由客户端按步绘制；delta 时每一步只返回改动区域的
+    1 位 PNG 或无损 WebP 图块及其偏移（codec/level 可选）；grid 仅用于分割模式（split），只返回
+    一张原图、网格行列数与揭示顺序 order（seed 可复现），由客户端依次揭示；分割模式搭配
+    polyline/svg/delta 返回 422；默认 png 与旧版一致
     
     Args:
         request: 包含图片和参数的请求
@@ -143,15 +266,81 @@ async def decompose_image(request: DecomposeImageRequest):
         包含完整简笔画和步骤列表的响应
     """
     try:
-        result = sketch_service.decompose_existing_image(
+        # 分解在线程中执行，超过截止时间或客户端断开时在下一个检查点停止
+        result = await run_with_deadline(http_request, "decompose", lambda: run_in_threadpool(
+            sketch_service.decompose_existing_image,
             image_base64=request.image,
             max_steps=request.max_steps,
-            sort_method=request.sort_method
-        )
+            sort_method=request.sort_method,
+            options=_decompose_options(request),
+        ))
         
         return {
             "success": True,
             "data": result
         }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"分解图片失败: {str(e)}")
+
+
+@router.post("/decompose/stream", dependencies=[Depends(rate_limit("sketch_decompose"))])
+async def decompose_image_stream(
+    request: DecomposeImageRequest,
+    http_request: Request,
+    stream_format: str = Query(default="ndjson", pattern=STREAM_FORMAT_PATTERN, description="ndjson 或 sse"),
+):
+    """
+    流式版本的 /sketch/decompose：先发送 meta 事件，再每渲染完一步发送一个 step 事件，最后发送 done
+
+    NDJSON 每行为 {"event": ..., "data": ...}；SSE 使用同名的 event 字段
+    """
+    async def events(deadline):
+        image_array = await asyncio.to_thread(
+            lambda: sketch_service.decode_image(decode_base64_image(request.image))
+        )
+        steps = sketch_service.iter_decomposition(
+            image_array, request.max_steps, request.sort_method, _decompose_options(request)
+        )
+        async for item in _step_events(steps, deadline):
+            yield item
+
+    return stream_response(http_request, "decompose", stream_format, events, "分解图片失败")
+
+
+@router.post("/decompose/raw", dependencies=[Depends(rate_limit("sketch_decompose"))])
+async def decompose_image_raw(
+    request: Request,
+    max_steps: int = Query(default=config.SKETCH_MAX_STEPS, ge=1, le=50, description="最大步数"),
+    sort_method: str = Query(default=config.SKETCH_SORT_METHOD, description="排序方法: area 或 position"),
+    session_id: Optional[str] = Query(None, description="用户会话ID，可选"),
+    output_format: str = Query(default="png", pattern=OUTPUT_FORMAT_PATTERN, description="步骤输出格式: png、polyline、svg、delta 或 grid（仅分割模式）"),
+    tolerance: float = Query(default=1.0, ge=0, le=20, description="折线简化容差（像素），仅 polyline/svg 有效"),
+    codec: str = Query(default="png", pattern=CODEC_PATTERN, description="图块编码: png 或 webp，仅 delta 与 grid 有效"),
+    level: int = Query(default=6, ge=0, le=9, description="PNG 压缩级别，仅 delta 与 grid 有效"),
+    seed: Optional[int] = Query(None, ge=0, le=2**32 - 1, description="分割模式揭示顺序的随机种子，可选"),
+):
+    """
+    二进制上传版本的 /sketch/decompose
+
+    请求体为原始图片（application/octet-stream），参数通过查询字符串传递，返回格式与 JSON 版本一致
+    """
+    try:
+        check_output_format(sort_method, output_format)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    image_data = await read_upload(request)
+    try:
+        result = await run_with_deadline(request, "decompose", lambda: run_in_threadpool(
+            sketch_service.decompose_image_bytes, image_data, max_steps, sort_method,
+            DecomposeOptions(output_format=output_format, tolerance=tolerance, codec=codec, level=level, seed=seed),
+        ))
+        return {
+            "success": True,
+            "data": result
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"分解图片失败: {str(e)}")
@@ -0,0 +1,229 @@
+"""
+上游调用准入控制
+每个上游端点限制并发数，超出的请求按优先级（管理员 > 服务器付费 > 自定义）排队；
+队列有上限，排满时快速拒绝并给出建议的重试时间，排队深度与等待时间供扩缩容参考
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+
+from ..config import config
+
+T = TypeVar("T")
+
+# 数值越小优先级越高
+PRIORITIES: Dict[str, int] = {"admin": 0, "server": 1, "custom": 2}
+
+# 计算等待时间分位数保留的样本数
+WAIT_SAMPLES = 256
+# 自定义端点由用户提供，超过该数量时清理空闲端点的统计
+MAX_TRACKED_ENDPOINTS = 256
+
+
+def admission_priority(is_admin: bool, is_server_call: bool) -> str:
+    if is_admin:
+        return "admin"
+    return "server" if is_server_call else "custom"
+
+
+def _parse_endpoint_limits(raw: str) -> Dict[str, int]:
+    """解析 "url=并发数,url=并发数" 形式的按端点并发上限"""
+    limits: Dict[str, int] = {}
+    for item in (raw or "").split(","):
+        url, sep, limit = item.strip().rpartition("=")
+        if sep and url and limit.strip().isdigit():
+            limits[url.strip().rstrip("/")] = max(1, int(limit))
+    return limits
+
+
+class AdmissionRejected(Exception):
+    """排队已满、排队超时或被更高优先级的请求挤出"""
+
+    def __init__(self, endpoint: str, retry_after: float, reason: str):
+        self.endpoint = endpoint
+        self.reason = reason
+        self.retry_after = max(1, int(retry_after + 0.999))
+        super().__init__(f"上游模型繁忙（{reason}），请 {self.retry_after} 秒后重试")
+
+
+@dataclass(order=True)
+class _Waiter:
+    rank: int
+    seq: int
+    priority: str = field(compare=False)
+    future: "asyncio.Future[None]" = field(compare=False)
+    enqueued_at: float = field(compare=False, default_factory=time.monotonic)
+
+
+@dataclass
+class _EndpointGate:
+    limit: int
+    running: int = 0
+    waiters: List[_Waiter] = field(default_factory=list)
+    admitted: int = 0
+    rejected: int = 0
+    shed: int = 0
+    timed_out: int = 0
+    wait_total_ms: float = 0.0
+    wait_max_ms: float = 0.0
+    waits_ms: Deque[float] = field(default_factory=lambda: deque(maxlen=WAIT_SAMPLES))
+    # 单次调用耗时的指数滑动平均，用于估算 Retry-After
+    service_ema_s: Optional[float] = None
+
+    def record_admit(self, waited_ms: float) -> None:
+        self.admitted += 1
+        self.wait_total_ms += waited_ms
+        self.wait_max_ms = max(self.wait_max_ms, waited_ms)
+        self.waits_ms.append(waited_ms)
+
+    def record_service(self, seconds: float) -> None:
+        self.service_ema_s = seconds if self.service_ema_s is None else 0.8 * self.service_ema_s + 0.2 * seconds
+
+    def retry_after(self) -> float:
+        # 排在前面的请求按当前并发度消化完所需的大致时间
+        service = self.service_ema_s if self.service_ema_s is not None else 1.0
+        return min(60.0, service * (len(self.waiters) + 1) / self.limit)
+
+    def remove(self, waiter: _Waiter) -> None:
+        try:
+            self.waiters.remove(waiter)
+        except ValueError:
+            return
+        heapq.heapify(self.waiters)
+
+
+class AdmissionController:
+    """按上游端点的并发限制器，带有界的优先级等待队列"""
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        max_queue: int = 32,
+        max_wait_seconds: float = 30.0,
+        endpoint_limits: Optional[Dict[str, int]] = None,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait_seconds
+        self.endpoint_limits = endpoint_limits or {}
+        self._gates: Dict[str, _EndpointGate] = {}
+        self._seq = itertools.count()
+
+    @staticmethod
+    def _key(endpoint: Optional[str]) -> str:
+        return (endpoint or "default").rstrip("/")
+
+    def _gate(self, key: str) -> _EndpointGate:
+        gate = self._gates.get(key)
+        if gate is None:
+            if len(self._gates) >= MAX_TRACKED_ENDPOINTS:
+                for idle in [k for k, g in self._gates.items() if not g.running and not g.waiters]:
+                    del self._gates[idle]
+            gate = self._gates[key] = _EndpointGate(limit=self.endpoint_limits.get(key, self.max_concurrency))
+        return gate
+
+    async def acquire(self, endpoint: Optional[str], priority: str = "custom") -> None:
+        key = self._key(endpoint)
+        gate = self._gate(key)
+        rank = PRIORITIES.get(priority, PRIORITIES["custom"])
+        if gate.running < gate.limit and not gate.waiters:
+            gate.running += 1
+            gate.record_admit(0.0)
+            return
+
+        if len(gate.waiters) >= self.max_queue:
+            worst = max(gate.waiters) if gate.waiters else None
+            if worst is None or worst.rank <= rank:
+                gate.rejected += 1
+                raise AdmissionRejected(key, gate.retry_after(), "队列已满")
+            # 队列已满但新请求优先级更高：挤出优先级最低、最晚到达的等待者
+            gate.remove(worst)
+            gate.shed += 1
+            worst.future.set_exception(AdmissionRejected(key, gate.retry_after(), "被更高优先级请求挤出"))
+
+        waiter = _Waiter(rank, next(self._seq), priority, asyncio.get_running_loop().create_future())
+        heapq.heappush(gate.waiters, waiter)
+        try:
+            await asyncio.wait_for(waiter.future, self.max_wait)
+        except asyncio.TimeoutError:
+            gate.remove(waiter)
+            gate.timed_out += 1
+            raise AdmissionRejected(key, gate.retry_after(), "排队超时") from None
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                # 已获准入但调用者随即取消，把名额交给下一个
+                self.release(endpoint)
+            else:
+                gate.remove(waiter)
+            raise
+
+    def release(self, endpoint: Optional[str], service_seconds: Optional[float] = None) -> None:
+        gate = self._gate(self._key(endpoint))
+        gate.running -= 1
+        if service_seconds is not None:
+            gate.record_service(service_seconds)
+        while gate.waiters and gate.running < gate.limit:
+            waiter = heapq.heappop(gate.waiters)
+            if waiter.future.done():
+                continue
+            gate.running += 1
+            gate.record_admit((time.monotonic() - waiter.enqueued_at) * 1000)
+            waiter.future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, endpoint: Optional[str], priority: str = "custom") -> AsyncIterator[None]:
+        await self.acquire(endpoint, priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(endpoint, time.monotonic() - started)
+
+    async def run(self, endpoint: Optional[str], priority: str, factory: Callable[[], Awaitable[T]]) -> T:
+        async with self.slot(endpoint, priority):
+            return await factory()
+
+    def stats(self) -> Dict[str, Any]:
+        endpoints = {}
+        for key, gate in self._gates.items():
+            waits = sorted(gate.waits_ms)
+            queued = {name: 0 for name in PRIORITIES}
+            for waiter in gate.waiters:
+                queued[waiter.priority] = queued.get(waiter.priority, 0) + 1
+            endpoints[key] = {
+                "limit": gate.limit,
+                "running": gate.running,
+                "queued": len(gate.waiters),
+                "queued_by_priority": queued,
+                "admitted": gate.admitted,
+                "rejected": gate.rejected,
+                "shed": gate.shed,
+                "timed_out": gate.timed_out,
+                "avg_wait_ms": round(gate.wait_total_ms / gate.admitted, 2) if gate.admitted else 0.0,
+                "p95_wait_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 2) if waits else 0.0,
+                "max_wait_ms": round(gate.wait_max_ms, 2),
+                "avg_service_ms": round(gate.service_ema_s * 1000, 2) if gate.service_ema_s is not None else None,
+                "retry_after": round(gate.retry_after(), 2),
+            }
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "max_wait_seconds": self.max_wait,
+            "queue_depth": sum(len(gate.waiters) for gate in self._gates.values()),
+            "running": sum(gate.running for gate in self._gates.values()),
+            "endpoints": endpoints,
+        }
+
+
+# 全局实例
+admission_control = AdmissionController(
+    max_concurrency=config.ADMISSION_MAX_CONCURRENCY,
+    max_queue=config.ADMISSION_MAX_QUEUE,
+    max_wait_seconds=config.ADMISSION_MAX_WAIT_SECONDS,
+    endpoint_limits=_parse_endpoint_limits(config.ADMISSION_ENDPOINT_LIMITS),
+)
@@ -1,11 +1,45 @@
+import asyncio
+import contextlib
+import functools
 import json
 import os
 import re
-from collections.abc import Sequence
-from typing import Any, Dict, List, Optional
+import time
+from collections import OrderedDict, deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Sequence
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple, Union
+
+import httpx
+from openai import BadRequestError
 
-from openai import OpenAI
 from ..config import config
+from .admission import AdmissionRejected, admission_control
+from .answer_matcher import match_answer
+from .cascade import CONFIDENCE_INSTRUCTION, cascade_enabled, cascade_endpoint, cascade_stats, should_escalate
+from .client_pool import client_pool
+from .guess_cache import guess_cache, perceptual_hash
+from .image_preprocess import PreprocessedImage, preprocess_guess_image, preprocess_guess_strokes
+from .image_utils import BytesLike
+from .prompt_cache import prompt_cache_stats, prompt_eval_report, session_slot
+from .provider_router import ProviderEndpoint, guess_router
+from .deadline import DeadlineExceeded
+from .resilience import CircuitOpenError, guarded_call
+from .single_flight import guess_flight, make_flight_key
+from .stroke_raster import StrokeDrawing
+from .structured_output import (
+    STRUCTURED_FORMAT_INSTRUCTIONS,
+    has_format_constraint,
+    names_format_constraint,
+    parse_structured,
+    provider_support,
+    structured_enabled,
+    structured_request_kwargs,
+    without_format_constraint,
+)
+
+# 猜词输入：data URL、二进制图片或矢量笔画
+GuessImage = Union[str, BytesLike, StrokeDrawing]
 
 FORMAT_INSTRUCTIONS = (
     "请仅输出一个 JSON 代码块，严格按照如下格式返回：\n"
@@ -23,8 +57,20 @@ DEFAULT_PROMPT = (
     "你是一位能够理解绘画的助手，请根据提供的图像推测其所表达的词语或短语，并生成答案。\n"
 )
 
+# 没有线索时的用户消息；系统提示词保持不变，便于上游复用前缀缓存
+DEFAULT_USER_PROMPT = "请猜出这幅画表达的词语或短语。"
+
 JSON_BLOCK_PATTERN = re.compile(r"```json\s*(.*?)\s*```", re.IGNORECASE | re.DOTALL)
 
+# 流式解析用：匹配一个已经闭合的 JSON 字符串字面量
+_JSON_STRING = r'"((?:[^"\\]|\\.)*)"'
+STREAM_FIELD_PATTERNS = {
+    "best_guess": re.compile(r'"best_guess"\s*:\s*' + _JSON_STRING),
+    "reason": re.compile(r'"reason"\s*:\s*' + _JSON_STRING),
+}
+STREAM_ALTERNATIVES_START = re.compile(r'"alternatives"\s*:\s*\[')
+STREAM_ARRAY_ITEM = re.compile(r'\s*' + _JSON_STRING + r'\s*([,\]])?')
+
 def _is_local_llama_server(url: str) -> bool:
     """Check if the URL points to a local llama-server instance."""
     if not url:
@@ -33,91 +79,391 @@ def _is_local_llama_server(url: str) -> bool:
     return "127.0.0.1" in url_lower or "localhost" in url_lower
 
 def _is_guess_correct(guess: Optional[str], target: Optional[str]) -> bool:
-    """Check if the AI guess matches the target word."""
+    """Check if the AI guess matches the target word (aliases and width/case variants included)."""
     if not guess or not target:
         return False
-    
-    # Normalize both strings for comparison
-    guess_normalized = guess.strip().lower()
-    target_normalized = target.strip().lower()
-    
-    # Exact match
-    if guess_normalized == target_normalized:
-        return True
-    
-    # Check if target is contained in guess (e.g., target="苹果", guess="一个苹果")
-    # This allows AI to be more descriptive while still being correct
-    if target_normalized in guess_normalized:
-        return True
-    
-    # Handle common variations for Chinese words
-    # Remove common prefixes/suffixes and check again
-    common_prefixes = ['一个', '一只', '一朵', '一条', '一张', '一辆', '一座', '一本', '一支']
-    common_suffixes = ['的', '了', '着', '过', '们', '子', '儿', '头', '手']
-    
-    for prefix in common_prefixes:
-        if guess_normalized.startswith(prefix) and guess_normalized[len(prefix):].strip() == target_normalized:
-            return True
-    
-    for suffix in common_suffixes:
-        if guess_normalized.endswith(suffix) and guess_normalized[:-len(suffix)].strip() == target_normalized:
-            return True
-    
-    return False
-
-
-def _call_openai_model(
+    return match_answer(target, [guess]) is not None
+
+
+def _build_messages(
+    image: str,
+    prompt: str,
+    detail: str = "high",
+    system_prompt: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    # 构造消息：固定的系统提示词在前，随请求变化的线索和图片放在最后
+    messages: List[Dict[str, Any]] = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    return messages + [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": prompt
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image,
+                        "detail": detail
+                    }
+                }
+            ]
+        }
+    ]
+
+
+def _completion_kwargs(
+    base_url: str,
+    structured: bool,
+    slot: Optional[int] = None,
+    require_confidence: bool = False,
+) -> Dict[str, Any]:
+    is_local = _is_local_llama_server(base_url)
+    kwargs = structured_request_kwargs(base_url, is_local, require_confidence) if structured else {}
+    if is_local and config.LLAMA_CACHE_PROMPT:
+        # 让 llama-server 复用与上一次请求相同的前缀 KV 缓存；固定槽位后同一会话命中率更高
+        extra_body = {**kwargs.get("extra_body", {}), "cache_prompt": True}
+        if slot is not None:
+            extra_body["id_slot"] = slot
+        kwargs["extra_body"] = extra_body
+    return kwargs
+
+
+async def _create_with_format_fallback(
+    create: Callable[..., Awaitable[Any]],
+    base_url: str,
+    request: Dict[str, Any],
+    kwargs: Dict[str, Any],
+) -> Any:
+    """Call `create`; when the upstream rejects the format constraint, retry without it.
+
+    The endpoint is only marked unsupported when the retry succeeds or the error
+    names the constraint.
+    """
+    try:
+        return await create(**request, **kwargs)
+    except BadRequestError as exc:
+        if not has_format_constraint(kwargs):
+            raise
+        try:
+            result = await create(**request, **without_format_constraint(kwargs))
+        except BadRequestError:
+            # 去掉约束仍然失败，多半是上下文过长、图片或模型名等其他问题
+            if names_format_constraint(exc):
+                provider_support.mark_unsupported(base_url)
+            raise
+        provider_support.mark_unsupported(base_url)
+        return result
+
+
+def _record_prompt_eval(response: Any) -> Optional[Dict[str, Any]]:
+    report = prompt_eval_report(response)
+    prompt_cache_stats.record(report)
+    if report and report["saved_ms"]:
+        print(f"♻️ 前缀缓存复用 {report['cached_tokens']} tokens，节省约 {report['saved_ms']}ms")
+    return report
+
+
+def _completion_to_result(completion: Any) -> Dict[str, Any]:
+    # 提取响应内容
+    if completion.choices and len(completion.choices) > 0:
+        content = completion.choices[0].message.content
+        result: Dict[str, Any] = {"result": content}
+        report = _record_prompt_eval(completion)
+        if report is not None:
+            result["prompt_cache"] = report
+        return result
+    raise Exception("API返回空响应")
+
+
+async def _call_openai_model_async(
     image: str,
     prompt: str,
     base_url: str,
     api_key: str,
     model_name: Optional[str] = None,
+    detail: str = "high",
+    structured: bool = False,
+    system_prompt: Optional[str] = None,
+    slot: Optional[int] = None,
+    require_confidence: bool = False,
 ) -> Dict[str, Any]:
-    client = OpenAI(
-        api_key=api_key,
-        base_url=base_url,
-    )
+    """Call the model through the pooled AsyncOpenAI client.
+
+    `slot` pins the request to a llama-server slot so its prompt cache is reused;
+    `require_confidence` makes `confidence` a required field of the structured output.
+    """
+    kwargs = _completion_kwargs(base_url, structured, slot, require_confidence)
 
     try:
-        # 构造消息，包含文本提示和图片
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": image,
-                            "detail": "high"
-                        }
-                    }
-                ]
-            }
-        ]
-
-        completion = client.chat.completions.create(
-            model=model_name or config.MODEL_NAME,
-            messages=messages,
-            stream=False,  # 不使用流式响应
-        )
+        async with client_pool.client(base_url, api_key) as client:
+            with guarded_call(base_url, "guess") as timeout:
+                request = {
+                    "model": model_name or config.MODEL_NAME,
+                    "messages": _build_messages(image, prompt, detail, system_prompt),
+                    "stream": False,
+                    "timeout": timeout,
+                }
+                completion = await _create_with_format_fallback(
+                    client.chat.completions.create, base_url, request, kwargs
+                )
+        return _completion_to_result(completion)
 
-        # 提取响应内容
-        if completion.choices and len(completion.choices) > 0:
-            content = completion.choices[0].message.content
-            return {"result": content}
-        else:
-            raise Exception("API返回空响应")
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        raise Exception(f"调用OpenAI兼容模型失败: {str(e)}")
 
+
+async def _stream_openai_model_async(
+    image: str,
+    prompt: str,
+    base_url: str,
+    api_key: str,
+    model_name: Optional[str] = None,
+    detail: str = "high",
+    structured: bool = False,
+    system_prompt: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """Yield completion text deltas as the model produces them."""
+    kwargs = _completion_kwargs(base_url, structured)
+
+    try:
+        async with client_pool.client(base_url, api_key) as client:
+            with guarded_call(base_url, "guess") as timeout:
+                request = {
+                    "model": model_name or config.MODEL_NAME,
+                    "messages": _build_messages(image, prompt, detail, system_prompt),
+                    "stream": True,
+                    "timeout": timeout,
+                }
+                stream = await _create_with_format_fallback(
+                    client.chat.completions.create, base_url, request, kwargs
+                )
+                async for chunk in stream:
+                    if not chunk.choices:
+                        # llama-server 在最后一个 chunk 中附带 timings，OpenAI 附带 usage
+                        _record_prompt_eval(chunk)
+                        continue
+                    delta = chunk.choices[0].delta
+                    if delta is not None and delta.content:
+                        yield delta.content
+
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
     except Exception as e:
         raise Exception(f"调用OpenAI兼容模型失败: {str(e)}")
 
 
-def _build_instruction(clue: Optional[str], custom_prompt: Optional[str], language: Optional[str] = None) -> str:
-    language = language or 'zh' # 默认中文
+class SchedulerQueueFull(Exception):
+    """Raised when a local llama-server queue is at its configured depth."""
+
+
+# 记录会话上次使用的槽位，超过该数量时丢弃最久未用的会话
+SLOT_AFFINITY_MAX_SESSIONS = 4096
+
+
+@dataclass
+class _ScheduledJob:
+    factory: Callable[[Optional[int]], Awaitable[Any]]
+    future: "asyncio.Future[Any]"
+    session_key: Optional[str] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class _EndpointQueue:
+    slots: int
+    semaphore: asyncio.Semaphore
+    sessions: "OrderedDict[str, Deque[_ScheduledJob]]" = field(default_factory=OrderedDict)
+    depth: int = 0
+    running: int = 0
+    dispatched: int = 0
+    rejected: int = 0
+    wait_total_ms: float = 0.0
+    wait_max_ms: float = 0.0
+    dispatcher: Optional["asyncio.Task[None]"] = None
+    busy_slots: Set[int] = field(default_factory=set)
+    last_slot: "OrderedDict[str, int]" = field(default_factory=OrderedDict)
+    slot_misses: int = 0
+
+    def claim_slot(self, session_key: Optional[str]) -> Optional[int]:
+        """
+        为即将执行的请求选择空闲槽位：优先沿用该会话上次的槽位（其 KV 缓存仍在），
+        否则取任意空闲槽位；持有信号量时必有空闲槽位
+        """
+        if self.slots <= 1:
+            return None
+        preferred = self.last_slot.get(session_key) if session_key else None
+        if preferred is None:
+            preferred = session_slot(session_key, self.slots)
+        if preferred is not None and preferred not in self.busy_slots:
+            slot = preferred
+        else:
+            slot = next(index for index in range(self.slots) if index not in self.busy_slots)
+            if preferred is not None:
+                self.slot_misses += 1
+        self.busy_slots.add(slot)
+        if session_key:
+            self.last_slot[session_key] = slot
+            self.last_slot.move_to_end(session_key)
+            while len(self.last_slot) > SLOT_AFFINITY_MAX_SESSIONS:
+                self.last_slot.popitem(last=False)
+        return slot
+
+    def pop_fair(self) -> _ScheduledJob:
+        # 按会话轮转出队，避免单个会话的突发请求占满所有槽位
+        session_key, jobs = next(iter(self.sessions.items()))
+        job = jobs.popleft()
+        del self.sessions[session_key]
+        if jobs:
+            self.sessions[session_key] = jobs
+        self.depth -= 1
+        return job
+
+
+class LlamaBatchScheduler:
+    """Micro-batching dispatcher for guesses sent to a local llama-server.
+
+    Requests for the same endpoint are collected for a short window and then
+    dispatched concurrently up to the server's parallel slot count. Waiting jobs
+    are taken round-robin across sessions, the queue depth is bounded and
+    queue-wait times are recorded. With slot affinity each job is handed a free
+    `id_slot`, preferring the one its session used last, so two sessions never
+    contend for the same slot.
+    """
+
+    def __init__(
+        self,
+        window_ms: float = 5.0,
+        slots: int = 0,
+        max_queue_depth: int = 64,
+        slot_affinity: bool = True,
+    ):
+        self.window = max(0.0, window_ms) / 1000.0
+        self.configured_slots = slots
+        self.max_queue_depth = max(1, max_queue_depth)
+        self.slot_affinity = slot_affinity
+        self._queues: Dict[str, _EndpointQueue] = {}
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    async def _detect_slots(base_url: str) -> int:
+        """Read `total_slots` from llama-server's /props, falling back to one slot."""
+        root = re.sub(r"/v1/?$", "", base_url.rstrip("/"))
+        try:
+            async with httpx.AsyncClient(timeout=2.0) as client:
+                response = await client.get(f"{root}/props")
+                slots = int(response.json().get("total_slots") or 1)
+        except Exception:
+            slots = 1
+        print(f"🦙 llama-server {root} 并行槽位: {slots}")
+        return max(1, slots)
+
+    async def _get_queue(self, base_url: str) -> _EndpointQueue:
+        key = base_url.rstrip("/")
+        queue = self._queues.get(key)
+        if queue is None:
+            async with self._lock:
+                queue = self._queues.get(key)
+                if queue is None:
+                    slots = self.configured_slots or await self._detect_slots(key)
+                    queue = _EndpointQueue(slots=slots, semaphore=asyncio.Semaphore(slots))
+                    self._queues[key] = queue
+        return queue
+
+    async def submit(
+        self,
+        base_url: str,
+        session_key: Optional[str],
+        factory: Callable[[Optional[int]], Awaitable[Any]],
+    ) -> Any:
+        """`factory` receives the assigned llama-server slot, or None to let the server choose."""
+        queue = await self._get_queue(base_url)
+        if queue.depth >= self.max_queue_depth:
+            queue.rejected += 1
+            raise SchedulerQueueFull(f"本地模型队列已满（{queue.depth}/{self.max_queue_depth}），请稍后重试")
+
+        job = _ScheduledJob(
+            factory=factory, future=asyncio.get_running_loop().create_future(), session_key=session_key
+        )
+        queue.sessions.setdefault(session_key or "anonymous", deque()).append(job)
+        queue.depth += 1
+        if queue.dispatcher is None or queue.dispatcher.done():
+            queue.dispatcher = asyncio.create_task(self._dispatch(queue))
+        return await job.future
+
+    async def _dispatch(self, queue: _EndpointQueue) -> None:
+        while queue.depth:
+            # 收集窗口：让同一突发内的请求一起进入调度
+            await asyncio.sleep(self.window)
+            while queue.depth:
+                await queue.semaphore.acquire()
+                job = queue.pop_fair()
+                if job.future.done():
+                    # 调用者已取消
+                    queue.semaphore.release()
+                    continue
+                waited_ms = (time.monotonic() - job.enqueued_at) * 1000
+                queue.wait_total_ms += waited_ms
+                queue.wait_max_ms = max(queue.wait_max_ms, waited_ms)
+                queue.dispatched += 1
+                queue.running += 1
+                slot = queue.claim_slot(job.session_key) if self.slot_affinity else None
+                task = asyncio.create_task(self._run(queue, job, slot))
+                # 调用者取消等待时，同时取消正在执行的上游请求，释放槽位
+                job.future.add_done_callback(lambda future, task=task: future.cancelled() and task.cancel())
+
+    @staticmethod
+    async def _run(queue: _EndpointQueue, job: _ScheduledJob, slot: Optional[int]) -> None:
+        try:
+            result = await job.factory(slot)
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as exc:
+            if not job.future.done():
+                job.future.set_exception(exc)
+        finally:
+            queue.running -= 1
+            queue.busy_slots.discard(slot)
+            queue.semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": self.window * 1000,
+            "max_queue_depth": self.max_queue_depth,
+            "endpoints": {
+                base_url: {
+                    "slots": queue.slots,
+                    "queued": queue.depth,
+                    "running": queue.running,
+                    "sessions_waiting": len(queue.sessions),
+                    "dispatched": queue.dispatched,
+                    "rejected": queue.rejected,
+                    "slot_misses": queue.slot_misses,
+                    "avg_wait_ms": round(queue.wait_total_ms / queue.dispatched, 2) if queue.dispatched else 0.0,
+                    "max_wait_ms": round(queue.wait_max_ms, 2),
+                }
+                for base_url, queue in self._queues.items()
+            },
+        }
+
+
+# 全局调度器，仅用于本地 llama-server
+llama_scheduler = LlamaBatchScheduler(
+    window_ms=config.LLAMA_BATCH_WINDOW_MS,
+    slots=config.LLAMA_SERVER_SLOTS,
+    max_queue_depth=config.LLAMA_QUEUE_MAX_DEPTH,
+    slot_affinity=config.LLAMA_SLOT_AFFINITY,
+)
+
+
+@functools.lru_cache(maxsize=256)
+def _build_system_prompt(language: str, custom_prompt: str, structured: bool) -> str:
+    """与线索无关的固定前缀，按 (语言, 自定义提示词, 输出模式) 缓存，保证每次发送的文本逐字节一致"""
     LANGUAGE_PROMPT = f"当前界面语言是{language}。返回的json中，key需要保持不变，但value需要使用{language}回答。\n"
 
     sections: List[str] = []
@@ -125,15 +471,26 @@ def _build_instruction(clue: Optional[str], custom_prompt: Optional[str], langua
 
     sections.append(LANGUAGE_PROMPT)
 
-    if custom_prompt and custom_prompt.strip():
-        sections.append(custom_prompt.strip())
-    if clue:
-        sections.append(f"猜词的参考线索：{clue}")
-    sections.append(FORMAT_INSTRUCTIONS)
+    if custom_prompt:
+        sections.append(custom_prompt)
+    sections.append(STRUCTURED_FORMAT_INSTRUCTIONS if structured else FORMAT_INSTRUCTIONS)
 
     return "\n\n".join(section for section in sections if section)
 
 
+def _build_instruction(
+    clue: Optional[str],
+    custom_prompt: Optional[str],
+    language: Optional[str] = None,
+    structured: bool = False,
+) -> Tuple[str, str]:
+    """Return `(system_prompt, user_prompt)`; only the user part varies with the clue."""
+    language = language or 'zh' # 默认中文
+    system_prompt = _build_system_prompt(language, (custom_prompt or "").strip(), structured)
+    user_prompt = f"猜词的参考线索：{clue}" if clue else DEFAULT_USER_PROMPT
+    return system_prompt, user_prompt
+
+
 def _sanitize_config(config: Optional[Dict[str, Optional[str]]]) -> Dict[str, str]:
     sanitized: Dict[str, str] = {}
     if not config:
@@ -142,6 +499,9 @@ def _sanitize_config(config: Optional[Dict[str, Optional[str]]]) -> Dict[str, st
         if isinstance(value, str):
             sanitized[key] = value.strip()
     return sanitized
+
+
+def _normalize_candidate_text(text: str) -> List[str]:
     cleaned = text.replace("\r", "\n").replace("，", ",").replace("。", "\n")
     segments: List[str] = []
     for part in cleaned.split("\n"):
@@ -265,8 +625,8 @@ def _coerce_json_guess(payload: Dict[str, Any]) -> Dict[str, Any]:
         best_guess = combined[0]
         combined = combined[1:]
 
+    # confidence is only requested from the first cascade tier
     confidence = _parse_float(payload.get("confidence") or payload.get("score") or payload.get("probability"))
-    # Note: confidence is no longer used in the output format
     reason = payload.get("reason") or payload.get("explanation") or payload.get("analysis")
 
     seen_lower = set()
@@ -288,10 +648,16 @@ def _coerce_json_guess(payload: Dict[str, Any]) -> Dict[str, Any]:
         "best_guess": best_guess,
         "alternatives": unique_alternatives,
         "reason": reason,
+        "confidence": confidence,
     }
 
 
 def _extract_guesses(data: Dict[str, Any]) -> Dict[str, Any]:
+    # 结构化输出模式下结果就是一个 JSON 对象，一次解析即可
+    direct = parse_structured(data.get("result"))
+    if direct is not None and (direct.get("best_guess") or direct.get("alternatives")):
+        return _coerce_json_guess(direct)
+
     structured = _extract_json_payload(data)
     if isinstance(structured, list):
         for item in structured:
@@ -352,30 +718,103 @@ def _extract_guesses(data: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-def guess_drawing(
-    image: str,
-    clue: Optional[str] = None,
-    config: Optional[Dict[str, Optional[str]]] = None,
-    target: Optional[str] = None,
-    provider: str = "server",
-    language: Optional[str] = None,
-) -> Dict[str, Any]:
-    """AI model calling interface based on provided config and provider.
+def _decode_json_string(raw: str) -> str:
+    try:
+        return json.loads(f'"{raw}"')
+    except json.JSONDecodeError:
+        return raw
 
-    This function calls the AI service specified by the provider parameter using the config.
-    - provider: "custom" for custom model, "server" for server-side AI
+
+class IncrementalGuessParser:
+    """Parse the guess JSON block while it is still being streamed.
+
+    `feed` returns the events that became complete with the new text:
+    `("best_guess", str)`, `("alternative", str)` and `("reason", str)`.
+    Each field is reported once, as soon as its closing quote arrives.
     """
 
-    sanitized_config = _sanitize_config(config)
-    prompt = _build_instruction(clue, sanitized_config.get("prompt"), language)
+    def __init__(self) -> None:
+        self.text = ""
+        self.best_guess: Optional[str] = None
+        self.alternatives: List[str] = []
+        self.reason: Optional[str] = None
+        self._alternatives_closed = False
+
+    def _visible_text(self) -> Optional[str]:
+        # 推理模型先输出 <think> ... </think>，思考过程中的内容不参与解析
+        if "<think>" in self.text and "</think>" not in self.text:
+            return None
+        if "</think>" in self.text:
+            return self.text.rsplit("</think>", 1)[-1]
+        return self.text
+
+    def feed(self, delta: str) -> List[Tuple[str, str]]:
+        self.text += delta
+        text = self._visible_text()
+        if text is None:
+            return []
 
+        events: List[Tuple[str, str]] = []
+        if self.best_guess is None:
+            match = STREAM_FIELD_PATTERNS["best_guess"].search(text)
+            if match:
+                self.best_guess = _decode_json_string(match.group(1)).strip()
+                events.append(("best_guess", self.best_guess))
+
+        if not self._alternatives_closed:
+            start = STREAM_ALTERNATIVES_START.search(text)
+            if start:
+                position = start.end()
+                items: List[str] = []
+                while True:
+                    item = STREAM_ARRAY_ITEM.match(text, position)
+                    if not item:
+                        # 空数组或尚未完整到达的元素
+                        self._alternatives_closed = text[position:].lstrip().startswith("]")
+                        break
+                    items.append(_decode_json_string(item.group(1)).strip())
+                    position = item.end()
+                    if item.group(2) == "]":
+                        self._alternatives_closed = True
+                        break
+                    if item.group(2) is None:
+                        # 右引号已到但分隔符未到，下一次再确认
+                        items.pop()
+                        break
+                for alternative in items[len(self.alternatives):]:
+                    self.alternatives.append(alternative)
+                    if alternative:
+                        events.append(("alternative", alternative))
+
+        if self.reason is None:
+            match = STREAM_FIELD_PATTERNS["reason"].search(text)
+            if match:
+                self.reason = _decode_json_string(match.group(1))
+                events.append(("reason", self.reason))
+
+        return events
+
+
+def _prepare_guess(
+    clue: Optional[str],
+    config: Optional[Dict[str, Optional[str]]],
+    target: Optional[str],
+    provider: str,
+    language: Optional[str],
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Resolve prompt and endpoint settings.
+
+    Returns `(call_params, None)` when the model can be called, or `(None, failure)`
+    with the response to send back when the configuration is incomplete.
+    """
+    sanitized_config = _sanitize_config(config)
     base_url = sanitized_config.get("url")
     api_key = sanitized_config.get("key")
     model_name = sanitized_config.get("model")
     print(f"🔧 准备调用AI模型，提供者: {provider}, base_url: {base_url}, api_key: {api_key}, model_name: {model_name}")
 
     if not base_url:
-        return {
+        return None, {
             "success": False,
             "configured": False,
             "best_guess": None,
@@ -387,51 +826,332 @@ def guess_drawing(
             "provider": provider,
         }
 
-    try:
-        # Check if this is a local llama-server
-        is_local_llama = _is_local_llama_server(base_url)
-        
-        if is_local_llama:
-            print(f"🦙 检测到本地 llama-server: {base_url}")
-            # 本地服务不需要 API Key，使用占位符
-            api_key = "local"
-        
-        if not api_key:
-            return {
-                "success": False,
-                "configured": False,
-                "best_guess": None,
-                "alternatives": [],
-                "reason": "请先在AI配置页面设置API Key",
-                "matched": False,
-                "target": target,
-                "raw": {"reason": "Missing API Key"},
-                "provider": provider,
-            }
-        
-        data = _call_openai_model(image, prompt, base_url, api_key, model_name)
-        parsed = _extract_guesses(data)
-        best_guess = parsed.get("best_guess")
-        return {
-            "success": True,
-            "configured": True,
-            "best_guess": best_guess,
-            "alternatives": parsed.get("alternatives", []),
-            "reason": parsed.get("reason"),
-            "matched": _is_guess_correct(best_guess, target),
-            "target": target,
-            "raw": data,
-            "provider": provider,
-        }
-    except Exception as exc:
-        return {
+    # Check if this is a local llama-server
+    is_local_llama = _is_local_llama_server(base_url)
+    structured = structured_enabled(provider, is_local_llama)
+    system_prompt, prompt = _build_instruction(clue, sanitized_config.get("prompt"), language, structured)
+
+    if is_local_llama:
+        print(f"🦙 检测到本地 llama-server: {base_url}")
+        # 本地服务不需要 API Key，使用占位符
+        api_key = "local"
+
+    if not api_key:
+        return None, {
             "success": False,
-            "configured": True,
+            "configured": False,
             "best_guess": None,
             "alternatives": [],
-            "error": str(exc),
-            "reason": None,
+            "reason": "请先在AI配置页面设置API Key",
             "matched": False,
             "target": target,
+            "raw": {"reason": "Missing API Key"},
             "provider": provider,
         }
+
+    return {
+        "prompt": prompt,
+        "system_prompt": system_prompt,
+        "base_url": base_url,
+        "api_key": api_key,
+        "model_name": model_name,
+        "structured": structured,
+    }, None
+
+
+def _guess_success(
+    data: Dict[str, Any],
+    target: Optional[str],
+    provider: str,
+    cached: bool = False,
+    prepared: Optional[PreprocessedImage] = None,
+    coalesced: bool = False,
+) -> Dict[str, Any]:
+    parsed = _extract_guesses(data)
+    best_guess = parsed.get("best_guess")
+    alternatives = parsed.get("alternatives", [])
+    # 一次扫描最佳答案和全部备选；matched 仍只看最佳答案，match 说明命中的是哪个候选
+    match = match_answer(target, [best_guess, *alternatives])
+    return {
+        "success": True,
+        "configured": True,
+        "best_guess": best_guess,
+        "alternatives": alternatives,
+        "reason": parsed.get("reason"),
+        "confidence": parsed.get("confidence"),
+        "matched": match is not None and match.index == 0,
+        "match": match.to_dict() if match else None,
+        "target": target,
+        "raw": data,
+        "provider": provider,
+        "cached": cached,
+        "coalesced": coalesced,
+        "preprocess": prepared.report() if prepared else None,
+    }
+
+
+def _prepare_model_input(
+    image: GuessImage,
+    params: Dict[str, Any],
+    provider: str = "server",
+) -> Tuple[PreprocessedImage, str, Optional[int]]:
+    """Decode the canvas once, preprocess it for the target model and hash it for the cache.
+
+    Stroke input is rasterized straight at the model's resolution instead of being decoded.
+    Returns `(prepared, cache_context, image_hash)`; the hash is `None` when the image
+    could not be decoded or the cache is disabled.
+    """
+    preprocess = preprocess_guess_strokes if isinstance(image, StrokeDrawing) else preprocess_guess_image
+    prepared = preprocess(
+        image,
+        params["model_name"] or config.MODEL_NAME,
+        _is_local_llama_server(params["base_url"]),
+    )
+    cache_context = guess_cache.context_key(
+        f"{params['system_prompt']}\n\n{params['prompt']}", params["model_name"], params["base_url"],
+        params["api_key"] if provider == "custom" else None,
+    )
+    image_hash = None
+    if guess_cache.enabled and prepared.gray is not None:
+        image_hash = perceptual_hash(prepared.gray)
+    return prepared, cache_context, image_hash
+
+
+async def _dispatch_model_call(
+    prepared: PreprocessedImage,
+    prompt: str,
+    base_url: str,
+    api_key: str,
+    model_name: Optional[str],
+    session_id: Optional[str],
+    structured: bool = False,
+    system_prompt: Optional[str] = None,
+    require_confidence: bool = False,
+    priority: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Call one endpoint; local llama-server calls are queued through `llama_scheduler`.
+
+    With a `priority` the call is admitted through `admission_control` for this endpoint.
+    """
+    def call_model(slot: Optional[int] = None) -> Awaitable[Dict[str, Any]]:
+        return _call_openai_model_async(
+            prepared.image, prompt, base_url, api_key, model_name, prepared.detail, structured, system_prompt, slot,
+            require_confidence,
+        )
+
+    def dispatch() -> Awaitable[Dict[str, Any]]:
+        if _is_local_llama_server(base_url):
+            return llama_scheduler.submit(base_url, session_id, call_model)
+        return call_model()
+
+    if priority is not None:
+        return await admission_control.run(base_url, priority, dispatch)
+    return await dispatch()
+
+
+async def _routed_model_call(
+    prepared: PreprocessedImage,
+    prompt: str,
+    session_id: Optional[str],
+    structured: bool = False,
+    system_prompt: Optional[str] = None,
+    priority: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Send a server-paid guess through `guess_router` and tag the answering provider.
+
+    Admission is taken per provider actually called, so a hedge waits on its own endpoint.
+    """
+    async def call_provider(endpoint: ProviderEndpoint) -> Dict[str, Any]:
+        api_key = endpoint.key or ("local" if _is_local_llama_server(endpoint.url) else "")
+        return await _dispatch_model_call(
+            prepared, prompt, endpoint.url, api_key, endpoint.model, session_id, structured, system_prompt,
+            priority=priority,
+        )
+
+    data, endpoint = await guess_router.call(call_provider)
+    return {**data, "upstream": endpoint.name}
+
+
+def _cascade_accepts(data: Dict[str, Any], target: Optional[str], latency_ms: float) -> bool:
+    """Record first-tier stats and decide whether its answer can be returned as-is."""
+    parsed = _extract_guesses(data)
+    matched = _is_guess_correct(parsed.get("best_guess"), target)
+    escalate, reason = should_escalate(matched, target, parsed.get("confidence"))
+    cascade_stats.record("local", latency_ms, accepted=not escalate)
+    if escalate:
+        cascade_stats.record_escalation(reason)
+        print(f"🪜 第一级模型未通过（{reason}），升级到远程模型")
+    return not escalate
+
+
+def _record_first_tier_error(exc: Exception, latency_ms: float) -> None:
+    cascade_stats.record("local", latency_ms, accepted=False, error=True)
+    cascade_stats.record_escalation("error")
+    print(f"🪜 第一级模型调用失败，升级到远程模型: {exc}")
+
+
+async def _cascade_model_call(
+    prepared: PreprocessedImage,
+    prompt: str,
+    target: Optional[str],
+    session_id: Optional[str],
+    structured: bool = False,
+    system_prompt: Optional[str] = None,
+    priority: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Ask the cheap first-tier model, escalating to the routed remote providers when needed."""
+    url, key, model = cascade_endpoint()
+    started = time.monotonic()
+    try:
+        data = await _dispatch_model_call(
+            prepared, f"{prompt}\n\n{CONFIDENCE_INSTRUCTION}", url, key, model, session_id, structured,
+            system_prompt, require_confidence=True, priority=priority,
+        )
+    except Exception as exc:
+        data = None
+        _record_first_tier_error(exc, (time.monotonic() - started) * 1000)
+    if data is not None and _cascade_accepts(data, target, (time.monotonic() - started) * 1000):
+        return {**data, "cascade_tier": "local"}
+
+    started = time.monotonic()
+    data = await _routed_model_call(prepared, prompt, session_id, structured, system_prompt, priority)
+    cascade_stats.record("remote", (time.monotonic() - started) * 1000, accepted=True)
+    return {**data, "cascade_tier": "remote"}
+
+
+def _guess_error(exc: Exception, target: Optional[str], provider: str) -> Dict[str, Any]:
+    result = {
+        "success": False,
+        "configured": True,
+        "best_guess": None,
+        "alternatives": [],
+        "error": str(exc),
+        "reason": None,
+        "matched": False,
+        "target": target,
+        "provider": provider,
+    }
+    if isinstance(exc, (CircuitOpenError, AdmissionRejected)):
+        result["retry_after"] = exc.retry_after
+    return result
+
+
+async def guess_drawing_async(
+    image: GuessImage,
+    clue: Optional[str] = None,
+    config: Optional[Dict[str, Optional[str]]] = None,
+    target: Optional[str] = None,
+    provider: str = "server",
+    language: Optional[str] = None,
+    session_id: Optional[str] = None,
+    priority: Optional[str] = None,
+) -> Dict[str, Any]:
+    """AI model calling interface based on provided config and provider.
+
+    - provider: "custom" for custom model, "server" for server-side AI
+
+    The upstream call goes through the pooled AsyncOpenAI client, so a slow model
+    only suspends this coroutine instead of blocking the event loop. Calls to a local
+    llama-server are queued through `llama_scheduler`, with `session_id` used for
+    fairness between players.
+
+    With a `priority` each upstream call is admitted through `admission_control` on the
+    endpoint it is sent to; a full queue raises `AdmissionRejected` so the route can answer 429.
+    """
+    params, failure = _prepare_guess(clue, config, target, provider, language)
+    if failure is not None:
+        return failure
+
+    # 解码、预处理与哈希是 CPU 计算，放到线程中执行
+    prepared, cache_context, image_hash = await asyncio.to_thread(_prepare_model_input, image, params, provider)
+    cached = guess_cache.get(cache_context, image_hash)
+    if cached is not None:
+        return _guess_success(cached, target, provider, cached=True, prepared=prepared)
+
+    try:
+        # 相同图片和参数的并发请求只调用一次上游
+        flight_key = make_flight_key(cache_context, params["api_key"], prepared.detail, prepared.image)
+        if provider == "server" and cascade_enabled():
+            # 级联模式下是否升级取决于目标词，目标词也参与合并键
+            flight_key = make_flight_key(flight_key, target)
+            factory = lambda: _cascade_model_call(prepared, params["prompt"], target, session_id,
+                                                  params["structured"], params["system_prompt"], priority)
+        elif provider == "server":
+            # 服务器端调用经过提供方路由：按延迟选择，慢时对冲到次优提供方
+            factory = lambda: _routed_model_call(prepared, params["prompt"], session_id,
+                                                 params["structured"], params["system_prompt"], priority)
+        else:
+            factory = lambda: _dispatch_model_call(prepared, params["prompt"], params["base_url"],
+                                                   params["api_key"], params["model_name"], session_id,
+                                                   params["structured"], params["system_prompt"],
+                                                   priority=priority)
+        # 准入在实际调用的端点上获取；只有真正调用上游的那个请求占用名额，合并的请求不排队
+        data, coalesced = await guess_flight.run(flight_key, factory)
+        guess_cache.put(cache_context, image_hash, data)
+        return _guess_success(data, target, provider, prepared=prepared, coalesced=coalesced)
+    except AdmissionRejected:
+        raise
+    except Exception as exc:
+        return _guess_error(exc, target, provider)
+
+
+async def stream_guess_drawing(
+    image: GuessImage,
+    clue: Optional[str] = None,
+    config: Optional[Dict[str, Optional[str]]] = None,
+    target: Optional[str] = None,
+    provider: str = "server",
+    language: Optional[str] = None,
+    priority: Optional[str] = None,
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """Streaming variant of `guess_drawing_async`.
+
+    Yields `(event, payload)` pairs: `best_guess`, `alternative` and `reason` as soon as
+    each field is complete in the token stream, then a final `result` carrying the same
+    payload `guess_drawing_async` would return. The response has already started, so an
+    admission rejection is reported in the `result` payload with `retry_after`.
+    """
+    params, failure = _prepare_guess(clue, config, target, provider, language)
+    if failure is not None:
+        yield "result", failure
+        return
+
+    prepared, cache_context, image_hash = await asyncio.to_thread(_prepare_model_input, image, params, provider)
+    cached = guess_cache.get(cache_context, image_hash)
+    if cached is not None:
+        result = _guess_success(cached, target, provider, cached=True, prepared=prepared)
+        if result["best_guess"]:
+            yield "best_guess", {"best_guess": result["best_guess"], "matched": result["matched"], "target": target}
+        for index, alternative in enumerate(result["alternatives"]):
+            yield "alternative", {"alternative": alternative, "index": index}
+        if result["reason"]:
+            yield "reason", {"reason": result["reason"]}
+        yield "result", result
+        return
+
+    parser = IncrementalGuessParser()
+    admission = (
+        admission_control.slot(params["base_url"], priority) if priority is not None else contextlib.nullcontext()
+    )
+    try:
+        async with admission:
+            async for delta in _stream_openai_model_async(prepared.image, detail=prepared.detail, **params):
+                for field_name, value in parser.feed(delta):
+                    if field_name == "best_guess":
+                        yield field_name, {
+                            "best_guess": value,
+                            "matched": _is_guess_correct(value, target),
+                            "target": target,
+                        }
+                    elif field_name == "alternative":
+                        yield field_name, {"alternative": value, "index": len(parser.alternatives) - 1}
+                    else:
+                        yield field_name, {"reason": value}
+        if not parser.text:
+            raise Exception("API返回空响应")
+        # 最终结果仍走完整解析流程，兼容非标准输出
+        data = {"result": parser.text}
+        guess_cache.put(cache_context, image_hash, data)
+        yield "result", _guess_success(data, target, provider, prepared=prepared)
+    except Exception as exc:
+        yield "result", _guess_error(exc, target, provider)
@@ -0,0 +1,230 @@
+"""
+猜词答案匹配
+NFKC 规范化（同时完成全角/半角折叠）+ 别名表 + Aho-Corasick 自动机，
+一次扫描同时检查最佳答案与全部备选答案，并返回命中的是哪一个候选
+"""
+import bisect
+import functools
+import unicodedata
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from .._config.answer_aliases import ANSWER_ALIAS_GROUPS, ANSWER_PREFIXES, ANSWER_SUFFIXES
+
+# 规范化后的文本只含单个空格作为空白，用换行分隔多个候选不会产生跨候选的匹配
+_SEPARATOR = "\n"
+
+
+def normalize_answer(text: Optional[str]) -> str:
+    """NFKC + casefold，标点视为空白，连续空白合并为一个空格"""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    text = "".join(ch if ch.isalnum() else " " for ch in text)
+    return " ".join(text.split())
+
+
+def _is_ascii_word_char(ch: str) -> bool:
+    return ch.isascii() and ch.isalnum()
+
+
+_PREFIXES = [normalize_answer(p) + (" " if p.endswith(" ") else "") for p in ANSWER_PREFIXES]
+_SUFFIXES = [normalize_answer(s) for s in ANSWER_SUFFIXES]
+
+
+def _strip_variants(text: str) -> Set[str]:
+    """去掉量词前缀 / 冠词和语气后缀后的各种写法"""
+    variants = {text}
+    for prefix in _PREFIXES:
+        if text.startswith(prefix):
+            variants.add(text[len(prefix):].strip())
+    for variant in list(variants):
+        for suffix in _SUFFIXES:
+            if variant.endswith(suffix) and len(variant) > len(suffix):
+                variants.add(variant[:-len(suffix)].strip())
+    return {variant for variant in variants if variant}
+
+
+def _build_alias_index() -> Dict[str, Tuple[str, ...]]:
+    index: Dict[str, Tuple[str, ...]] = {}
+    for group in ANSWER_ALIAS_GROUPS:
+        members = tuple(dict.fromkeys(normalize_answer(word) for word in group))
+        for member in members:
+            index[member] = members
+    return index
+
+
+_ALIAS_INDEX = _build_alias_index()
+
+
+def answer_aliases(target: str) -> Tuple[str, ...]:
+    """目标词及其全部别名（已规范化，目标词本身在第一位）"""
+    normalized = normalize_answer(target)
+    group = _ALIAS_INDEX.get(normalized, ())
+    return (normalized,) + tuple(alias for alias in group if alias != normalized)
+
+
+class _Automaton:
+    """Aho-Corasick 多模式匹配自动机"""
+
+    def __init__(self, patterns: Sequence[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+        for pattern_id, pattern in enumerate(patterns):
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = nxt
+            self._output[state].append(pattern_id)
+        self._build_fail_links()
+
+    def _build_fail_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(ch, 0)
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int]]:
+        """逐个产出 (匹配结束位置, 模式编号)，结束位置为开区间"""
+        state = 0
+        for position, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for pattern_id in self._output[state]:
+                yield position + 1, pattern_id
+
+
+@dataclass(frozen=True)
+class AnswerMatch:
+    target: str
+    candidate: str
+    index: int  # 0 为最佳答案，>0 为第几个备选答案
+    alias: str  # 实际命中的（规范化后的）目标词或别名
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class AnswerMatcher:
+    """
+    针对一组目标词预编译的匹配器
+
+    目标词与多字别名按“包含”匹配（例如目标“苹果”命中“一个红苹果”），英文按词边界匹配并允许复数；
+    单字别名（如“海”）只在整个候选去掉量词后完全相同时才算命中，避免“海豚”误命中“海洋”
+    """
+
+    def __init__(self, targets: Sequence[str]):
+        self.targets = tuple(dict.fromkeys(t for t in targets if t and normalize_answer(t)))
+        self._patterns: List[str] = []
+        self._pattern_targets: List[List[str]] = []
+        self._exact: Dict[str, List[Tuple[str, str]]] = {}
+        pattern_ids: Dict[str, int] = {}
+        for target in self.targets:
+            aliases = answer_aliases(target)
+            for position, alias in enumerate(aliases):
+                if position > 0 and len(alias) == 1:
+                    self._exact.setdefault(alias, []).append((target, alias))
+                    continue
+                if alias not in pattern_ids:
+                    pattern_ids[alias] = len(self._patterns)
+                    self._patterns.append(alias)
+                    self._pattern_targets.append([])
+                self._pattern_targets[pattern_ids[alias]].append(target)
+        self._automaton = _Automaton(self._patterns)
+
+    @staticmethod
+    def _on_word_boundary(text: str, start: int, end: int, pattern: str) -> bool:
+        """英文模式要求落在词边界上，结尾允许复数（cat -> cats, bus -> buses）"""
+        if _is_ascii_word_char(pattern[0]) and start > 0 and _is_ascii_word_char(text[start - 1]):
+            return False
+        if not _is_ascii_word_char(pattern[-1]):
+            return True
+        for tail in ("", "s", "es"):
+            if text.startswith(tail, end):
+                stop = end + len(tail)
+                if stop >= len(text) or not _is_ascii_word_char(text[stop]):
+                    return True
+        return False
+
+    def match(self, candidates: Sequence[Optional[str]], target: Optional[str] = None) -> Optional[AnswerMatch]:
+        """
+        一次扫描全部候选，返回排名最靠前的命中
+
+        Args:
+            candidates: [best_guess, *alternatives]
+            target: 只接受该目标词的命中；为 None 时接受任意目标词
+
+        Returns:
+            命中信息，未命中时返回 None
+        """
+        normalized = [normalize_answer(candidate) for candidate in candidates]
+        starts: List[int] = []
+        offset = 0
+        for text in normalized:
+            starts.append(offset)
+            offset += len(text) + len(_SEPARATOR)
+        haystack = _SEPARATOR.join(normalized)
+
+        best: Optional[Tuple[int, str, str]] = None
+        for end, pattern_id in self._automaton.iter_matches(haystack):
+            pattern = self._patterns[pattern_id]
+            start = end - len(pattern)
+            index = bisect.bisect_right(starts, start) - 1
+            local_text = normalized[index]
+            local_start = start - starts[index]
+            if not self._on_word_boundary(local_text, local_start, local_start + len(pattern), pattern):
+                continue
+            for pattern_target in self._pattern_targets[pattern_id]:
+                if target is None or pattern_target == target:
+                    best = (index, pattern_target, pattern)
+                    break
+            if best is not None:
+                # 匹配按结束位置依次产出，第一个有效命中就是排名最靠前的候选
+                break
+
+        if self._exact:
+            limit = best[0] if best is not None else len(normalized)
+            for index in range(limit):
+                hit = self._match_exact(normalized[index], target)
+                if hit is not None:
+                    best = (index, hit[0], hit[1])
+                    break
+
+        if best is None:
+            return None
+        index, matched_target, alias = best
+        return AnswerMatch(target=matched_target, candidate=candidates[index] or "", index=index, alias=alias)
+
+    def _match_exact(self, text: str, target: Optional[str]) -> Optional[Tuple[str, str]]:
+        for variant in _strip_variants(text):
+            for entry in self._exact.get(variant, ()):
+                if target is None or entry[0] == target:
+                    return entry
+        return None
+
+
+@functools.lru_cache(maxsize=512)
+def get_matcher(targets: Tuple[str, ...]) -> AnswerMatcher:
+    """按目标词集合缓存已编译的匹配器"""
+    return AnswerMatcher(targets)
+
+
+def match_answer(target: Optional[str], candidates: Sequence[Optional[str]]) -> Optional[AnswerMatch]:
+    """检查最佳答案与备选答案是否命中目标词"""
+    if not target or not any(candidates):
+        return None
+    return get_matcher((target,)).match(candidates, target)
+
@@ -0,0 +1,89 @@
+"""
+两级猜词级联
+先用廉价的本地小模型猜测，未命中目标或置信度不足时再升级到远程大模型
+"""
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+from ..config import config
+
+# 追加到第一级提示词末尾，要求小模型自报置信度
+CONFIDENCE_INSTRUCTION = (
+    '此外，请在 JSON 中额外加入 "confidence" 字段，取值 0 到 1 之间的小数，表示你对 best_guess 的把握程度。'
+)
+
+
+def cascade_enabled() -> bool:
+    return config.GUESS_CASCADE_ENABLED and bool(config.GUESS_CASCADE_URL)
+
+
+def cascade_endpoint() -> Tuple[str, str, Optional[str]]:
+    """第一级模型的 (url, api_key, model)；本地服务不需要 Key"""
+    return config.GUESS_CASCADE_URL, config.GUESS_CASCADE_KEY or "local", config.GUESS_CASCADE_MODEL
+
+
+def should_escalate(matched: bool, target: Optional[str], confidence: Optional[float]) -> Tuple[bool, str]:
+    """
+    判断第一级结果是否需要升级
+
+    有目标词时必须猜中才接受；没有目标词时按自报置信度判断
+
+    Returns:
+        (是否升级, 原因)
+    """
+    if target:
+        return (False, "matched") if matched else (True, "mismatch")
+    if confidence is None:
+        return True, "no_confidence"
+    if confidence < config.GUESS_CASCADE_MIN_CONFIDENCE:
+        return True, "low_confidence"
+    return False, "confident"
+
+
+@dataclass
+class _TierStats:
+    calls: int = 0
+    accepted: int = 0
+    errors: int = 0
+    total_latency_ms: float = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "accepted": self.accepted,
+            "errors": self.errors,
+            "hit_rate": round(self.accepted / self.calls, 4) if self.calls else 0.0,
+            "avg_latency_ms": round(self.total_latency_ms / self.calls, 2) if self.calls else 0.0,
+        }
+
+
+@dataclass
+class CascadeStats:
+    tiers: Dict[str, _TierStats] = field(default_factory=lambda: {"local": _TierStats(), "remote": _TierStats()})
+    escalations: Dict[str, int] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, tier: str, latency_ms: float, accepted: bool, error: bool = False) -> None:
+        with self._lock:
+            stats = self.tiers[tier]
+            stats.calls += 1
+            stats.total_latency_ms += latency_ms
+            stats.accepted += int(accepted)
+            stats.errors += int(error)
+
+    def record_escalation(self, reason: str) -> None:
+        with self._lock:
+            self.escalations[reason] = self.escalations.get(reason, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": cascade_enabled(),
+                "min_confidence": config.GUESS_CASCADE_MIN_CONFIDENCE,
+                "tiers": {name: tier.snapshot() for name, tier in self.tiers.items()},
+                "escalations": dict(self.escalations),
+            }
+
+
+cascade_stats = CascadeStats()
@@ -0,0 +1,195 @@
+"""
+OpenAI 兼容客户端连接池
+按 (base_url, api_key 哈希) 复用客户端，保持 keep-alive 连接，避免每次请求重新握手
+"""
+import hashlib
+import importlib.util
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from ..config import config
+
+PoolKey = Tuple[str, str]  # (base_url, api_key 哈希)
+
+
+def _hash_api_key(api_key: Optional[str]) -> str:
+    """API Key 只以哈希形式出现在键和统计信息中"""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+@dataclass
+class _PooledClient:
+    client: AsyncOpenAI
+    created_at: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+    uses: int = 0
+    # 正在使用该客户端的请求数；被淘汰的客户端等到归零后再关闭
+    in_flight: int = 0
+
+
+class ClientPool:
+    """有界 LRU 异步客户端池"""
+
+    def __init__(
+        self,
+        max_clients: int = 32,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        idle_ttl: float = 600.0,
+        http2: bool = False,
+    ):
+        self.max_clients = max(1, max_clients)
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.idle_ttl = idle_ttl
+        self.http2 = http2 and _http2_available()
+        if http2 and not self.http2:
+            print("⚠️ 已开启 OPENAI_HTTP2 但未安装 h2 (pip install httpx[http2])，回退到 HTTP/1.1")
+
+        self._clients: "OrderedDict[PoolKey, _PooledClient]" = OrderedDict()
+        # 已淘汰但仍有请求在用的客户端
+        self._retired: List[_PooledClient] = []
+        self._lock = threading.Lock()
+        self._created = 0
+        self._reused = 0
+        self._evicted = 0
+        self._closed = 0
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def _create(self, base_url: str, api_key: str) -> AsyncOpenAI:
+        http_client = DefaultAsyncHttpxClient(limits=self._limits(), http2=self.http2)
+        return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+
+    def _acquire(self, base_url: str, api_key: str) -> Tuple[_PooledClient, List[_PooledClient]]:
+        """取出（或创建）客户端并计入使用中；同时返回可以关闭的已淘汰客户端"""
+        key: PoolKey = ((base_url or "").rstrip("/"), _hash_api_key(api_key))
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None:
+                self._clients.move_to_end(key)
+                entry.last_used = time.monotonic()
+                entry.uses += 1
+                self._reused += 1
+            else:
+                entry = _PooledClient(client=self._create(base_url, api_key), uses=1)
+                self._clients[key] = entry
+                self._created += 1
+                self._evict_locked()
+            entry.in_flight += 1
+            return entry, self._take_idle_retired_locked()
+
+    def _release(self, entry: _PooledClient) -> List[_PooledClient]:
+        with self._lock:
+            entry.in_flight -= 1
+            return self._take_idle_retired_locked()
+
+    def _evict_locked(self) -> None:
+        """
+        先淘汰空闲超时的客户端，再按 LRU 淘汰到容量上限
+
+        被淘汰的客户端可能仍有请求在用，先移入 _retired，使用数归零后再关闭
+        """
+        now = time.monotonic()
+        retired = len(self._retired)
+        for key in [k for k, e in self._clients.items() if now - e.last_used > self.idle_ttl]:
+            self._retired.append(self._clients.pop(key))
+        while len(self._clients) > self.max_clients:
+            self._retired.append(self._clients.popitem(last=False)[1])
+        self._evicted += len(self._retired) - retired
+
+    def _take_idle_retired_locked(self) -> List[_PooledClient]:
+        idle = [entry for entry in self._retired if entry.in_flight <= 0]
+        if idle:
+            self._retired = [entry for entry in self._retired if entry.in_flight > 0]
+        return idle
+
+    async def _close(self, entries: List[_PooledClient]) -> None:
+        for entry in entries:
+            try:
+                await entry.client.close()
+            except Exception as e:
+                print(f"⚠️ 关闭 OpenAI 客户端失败: {e}")
+            self._closed += 1
+
+    @asynccontextmanager
+    async def client(self, base_url: str, api_key: str) -> AsyncIterator[AsyncOpenAI]:
+        """
+        获取（或创建）异步客户端，在 async with 块内使用
+
+        块结束时归还；客户端已被淘汰且没有其他请求在用时随即关闭连接
+        """
+        entry, idle = self._acquire(base_url, api_key)
+        await self._close(idle)
+        try:
+            yield entry.client
+        finally:
+            await self._close(self._release(entry))
+
+    async def aclose(self) -> None:
+        """应用关闭时关闭所有客户端（包括已淘汰的）"""
+        with self._lock:
+            entries = [*self._clients.values(), *self._retired]
+            self._clients.clear()
+            self._retired = []
+        await self._close(entries)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            clients = [
+                {
+                    "base_url": base_url,
+                    "key_hash": key_hash,
+                    "uses": entry.uses,
+                    "in_flight": entry.in_flight,
+                    "age_seconds": round(now - entry.created_at, 1),
+                    "idle_seconds": round(now - entry.last_used, 1),
+                }
+                for (base_url, key_hash), entry in self._clients.items()
+            ]
+            total_requests = self._created + self._reused
+            return {
+                "size": len(clients),
+                "max_clients": self.max_clients,
+                "created": self._created,
+                "reused": self._reused,
+                "evicted": self._evicted,
+                "retired_in_flight": len(self._retired),
+                "closed": self._closed,
+                "reuse_ratio": round(self._reused / total_requests, 4) if total_requests else 0.0,
+                "http2": self.http2,
+                "max_connections": self.max_connections,
+                "max_keepalive_connections": self.max_keepalive_connections,
+                "keepalive_expiry": self.keepalive_expiry,
+                "clients": clients,
+            }
+
+
+# 全局实例
+client_pool = ClientPool(
+    max_clients=config.OPENAI_POOL_MAX_CLIENTS,
+    max_connections=config.OPENAI_POOL_MAX_CONNECTIONS,
+    max_keepalive_connections=config.OPENAI_POOL_MAX_KEEPALIVE,
+    keepalive_expiry=config.OPENAI_POOL_KEEPALIVE_EXPIRY,
+    idle_ttl=config.OPENAI_POOL_IDLE_TTL_SECONDS,
+    http2=config.OPENAI_HTTP2,
+)
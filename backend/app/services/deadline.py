@@ -0,0 +1,111 @@
+"""
+请求截止时间
+每个请求携带一个截止时间（客户端 X-Request-Timeout 请求头或路由默认值），通过 contextvar 传递到
+上游调用超时与分解流程；超时或客户端断开时取消，线程中的计算在检查点处停止
+"""
+import contextvars
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from ..config import config
+
+# 路由 -> 默认截止时间（秒）
+ROUTE_DEADLINES: Dict[str, float] = {
+    "guess": config.DEADLINE_GUESS_SECONDS,
+    "sketch": config.DEADLINE_SKETCH_SECONDS,
+    "decompose": config.DEADLINE_DECOMPOSE_SECONDS,
+}
+
+DEADLINE_HEADER = "x-request-timeout"
+
+
+class DeadlineExceeded(Exception):
+    """截止时间已过或请求已被取消；不属于上游故障，不计入熔断"""
+
+    def __init__(self, stage: str, cancelled: bool = False):
+        self.stage = stage
+        self.cancelled = cancelled
+        reason = "请求已取消" if cancelled else "请求已超过截止时间"
+        super().__init__(f"{reason}（{stage}）")
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self._cancelled = threading.Event()
+
+    @classmethod
+    def for_route(cls, route: str, header_value: Optional[str] = None) -> "Deadline":
+        """按路由默认值创建；客户端给出的超时只能缩短，不能超过 DEADLINE_MAX_SECONDS"""
+        seconds = ROUTE_DEADLINES.get(route, ROUTE_DEADLINES["guess"])
+        if header_value:
+            try:
+                requested = float(header_value)
+                if requested > 0:
+                    seconds = requested
+            except ValueError:
+                pass
+        return cls(min(seconds, config.DEADLINE_MAX_SECONDS))
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self._cancelled.is_set() or time.monotonic() >= self.expires_at
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def check(self, stage: str) -> None:
+        if self._cancelled.is_set():
+            raise DeadlineExceeded(stage, cancelled=True)
+        if time.monotonic() >= self.expires_at:
+            raise DeadlineExceeded(stage)
+
+    def cap(self, timeout: float) -> float:
+        """上游超时不超过剩余时间"""
+        return min(timeout, self.remaining())
+
+
+current_deadline: "contextvars.ContextVar[Optional[Deadline]]" = contextvars.ContextVar(
+    "current_deadline", default=None
+)
+
+
+def check_deadline(stage: str) -> None:
+    """计算流程中的检查点；当前请求没有截止时间时不做任何事"""
+    deadline = current_deadline.get()
+    if deadline is not None:
+        deadline.check(stage)
+
+
+class DeadlineStats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.expired: Dict[str, int] = {}
+        self.disconnected: Dict[str, int] = {}
+
+    def record(self, route: str, expired: bool = False, disconnected: bool = False) -> None:
+        with self._lock:
+            self.requests += 1
+            if expired:
+                self.expired[route] = self.expired.get(route, 0) + 1
+            if disconnected:
+                self.disconnected[route] = self.disconnected.get(route, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "defaults": dict(ROUTE_DEADLINES),
+                "max_seconds": config.DEADLINE_MAX_SECONDS,
+                "requests": self.requests,
+                "expired": dict(self.expired),
+                "disconnected": dict(self.disconnected),
+            }
+
+
+deadline_stats = DeadlineStats()
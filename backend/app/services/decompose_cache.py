@@ -0,0 +1,209 @@
+"""
+简笔画分解结果缓存
+以解码后像素的哈希 + 分解参数为键（内容寻址），值为紧凑 JSON 序列化后的字节；
+内存层按总字节数 LRU 淘汰，可选的磁盘层在进程重启后仍然有效
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from ..config import config
+
+# 分解算法或结果格式变化时递增，旧版本写入磁盘的结果自然失效
+DECOMPOSE_CACHE_VERSION = 1
+
+
+def serialize_result(result: Dict[str, Any]) -> bytes:
+    return json.dumps(result, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class DecompositionCache:
+    """内存 LRU（字节预算）+ 可选磁盘层；磁盘层同样按字节预算淘汰最久未用的文件"""
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: int = 512 * 1024 * 1024,
+        enabled: bool = True,
+    ):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+
+        if self.enabled and self.disk_dir:
+            self._load_disk_index()
+
+    @staticmethod
+    def key_options(sort_method: str, options: Any) -> Dict[str, Any]:
+        """只保留影响该输出格式结果的选项，无关参数不同的请求共用同一条缓存"""
+        relevant = {"output_format": options.output_format}
+        if options.output_format in ("polyline", "svg"):
+            relevant["tolerance"] = options.tolerance
+        if options.output_format in ("delta", "grid"):
+            relevant["codec"] = options.codec
+            relevant["level"] = options.level
+        if sort_method == "split":
+            relevant["seed"] = options.seed
+        return relevant
+
+    @classmethod
+    def make_key(cls, image: np.ndarray, max_steps: int, sort_method: str, options: Any) -> Optional[str]:
+        """
+        像素与参数的哈希；分割模式未指定种子时顺序每次随机，不缓存（返回 None）
+        """
+        if sort_method == "split" and options.seed is None:
+            return None
+        params = json.dumps(
+            {"version": DECOMPOSE_CACHE_VERSION, "shape": image.shape, "dtype": str(image.dtype),
+             "max_steps": max_steps, "sort_method": sort_method, "options": cls.key_options(sort_method, options)},
+            sort_keys=True,
+        )
+        digest = hashlib.sha256(params.encode("utf-8"))
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _load_disk_index(self) -> None:
+        os.makedirs(self.disk_dir, exist_ok=True)
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith(".json"):
+                stat = os.stat(os.path.join(self.disk_dir, name))
+                files.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(files):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def _remember_locked(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_bytes:
+            _, oldest = self._memory.popitem(last=False)
+            self._memory_bytes -= len(oldest)
+            self.evictions += 1
+
+    def get(self, key: Optional[str]) -> Optional[bytes]:
+        if not self.enabled or key is None:
+            return None
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                self.bytes_saved += len(data)
+                return data
+            on_disk = key in self._disk
+        if on_disk:
+            try:
+                with open(self._path(key), "rb") as f:
+                    data = f.read()
+            except OSError as e:
+                print(f"⚠️ 读取分解缓存失败: {e}")
+                data = None
+            with self._lock:
+                if data is None:
+                    self._disk_bytes -= self._disk.pop(key, 0)
+                else:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self._remember_locked(key, data)
+                    self.disk_hits += 1
+                    self.bytes_saved += len(data)
+                    return data
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: Optional[str], data: bytes) -> None:
+        if not self.enabled or key is None:
+            return
+        with self._lock:
+            self._remember_locked(key, data)
+        if self.disk_dir and len(data) <= self.disk_max_bytes:
+            self._write_disk(key, data)
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            # 先写临时文件再替换，并发读取不会看到半个文件
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ 写入分解缓存失败: {e}")
+            return
+        stale = []
+        with self._lock:
+            self._disk_bytes -= self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            while self._disk_bytes > self.disk_max_bytes and len(self._disk) > 1:
+                oldest, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                self.evictions += 1
+                stale.append(oldest)
+        for oldest in stale:
+            try:
+                os.remove(self._path(oldest))
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "max_bytes": self.max_bytes,
+                "disk_dir": self.disk_dir,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "disk_max_bytes": self.disk_max_bytes if self.disk_dir else None,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+            }
+
+
+# 全局实例
+decompose_cache = DecompositionCache(
+    max_bytes=config.DECOMPOSE_CACHE_MAX_BYTES,
+    disk_dir=config.DECOMPOSE_CACHE_DIR,
+    disk_max_bytes=config.DECOMPOSE_CACHE_DISK_MAX_BYTES,
+    enabled=config.DECOMPOSE_CACHE_ENABLED,
+)
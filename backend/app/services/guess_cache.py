@@ -0,0 +1,171 @@
+"""
+猜词结果缓存
+以图片感知哈希 + 提示词/模型为键，近似的画作直接复用上一次的模型输出
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+
+from ..config import config
+
+CacheKey = Tuple[str, int]  # (上下文哈希, 图片感知哈希)
+
+
+def perceptual_hash(gray: np.ndarray, hash_size: int = 8) -> int:
+    """
+    计算 DCT 感知哈希（pHash）
+
+    Args:
+        gray: 灰度图数组
+        hash_size: 哈希边长，结果为 hash_size * hash_size 位
+
+    Returns:
+        整数形式的哈希值
+    """
+    size = hash_size * 4
+    small = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    dct = cv2.dct(small)[:hash_size, :hash_size]
+    # 直流分量不参与中位数计算，避免整体亮度主导结果
+    median = np.median(dct.flatten()[1:])
+    bits = (dct > median).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+@dataclass
+class _CacheEntry:
+    value: Dict[str, Any]
+    expires_at: float
+
+
+class GuessCache:
+    """LRU + TTL 缓存，支持按汉明距离查找近似图片"""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 600.0,
+        hamming_threshold: int = 3,
+        enabled: bool = True,
+    ):
+        self.enabled = enabled
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.hamming_threshold = max(0, hamming_threshold)
+
+        self._entries: "OrderedDict[CacheKey, _CacheEntry]" = OrderedDict()
+        self._by_context: Dict[str, Set[int]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def context_key(
+        prompt: str,
+        model_name: Optional[str],
+        base_url: Optional[str],
+        api_key: Optional[str] = None,
+    ) -> str:
+        """
+        提示词中已包含线索、语言和自定义提示，再加上模型与地址即可区分上下文；
+        自定义提供者再带上 API Key 的哈希，不同用户的 Key 不共用缓存结果
+        """
+        key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest() if api_key else ""
+        raw = "\x1f".join([base_url or "", model_name or "", prompt or "", key_hash])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _drop_locked(self, key: CacheKey) -> None:
+        self._entries.pop(key, None)
+        hashes = self._by_context.get(key[0])
+        if hashes is not None:
+            hashes.discard(key[1])
+            if not hashes:
+                del self._by_context[key[0]]
+
+    def _find_locked(self, context: str, image_hash: int) -> Optional[CacheKey]:
+        key = (context, image_hash)
+        if key in self._entries:
+            return key
+        if not self.hamming_threshold:
+            return None
+        best: Optional[CacheKey] = None
+        best_distance = self.hamming_threshold + 1
+        for candidate in self._by_context.get(context, ()):
+            distance = hamming_distance(candidate, image_hash)
+            if distance < best_distance:
+                best, best_distance = (context, candidate), distance
+        return best
+
+    def get(self, context: str, image_hash: Optional[int]) -> Optional[Dict[str, Any]]:
+        if not self.enabled or image_hash is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            key = self._find_locked(context, image_hash)
+            entry = self._entries.get(key) if key else None
+            if entry is not None and entry.expires_at <= now:
+                self._drop_locked(key)
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if key[1] != image_hash:
+                self.near_hits += 1
+            return entry.value
+
+    def put(self, context: str, image_hash: Optional[int], value: Dict[str, Any]) -> None:
+        if not self.enabled or image_hash is None:
+            return
+        key = (context, image_hash)
+        with self._lock:
+            self._entries[key] = _CacheEntry(value=value, expires_at=time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            self._by_context.setdefault(context, set()).add(image_hash)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop_locked(oldest)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_context.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hamming_threshold": self.hamming_threshold,
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# 全局实例
+guess_cache = GuessCache(
+    max_entries=config.GUESS_CACHE_MAX_ENTRIES,
+    ttl_seconds=config.GUESS_CACHE_TTL_SECONDS,
+    hamming_threshold=config.GUESS_CACHE_HAMMING_THRESHOLD,
+    enabled=config.GUESS_CACHE_ENABLED,
+)
@@ -0,0 +1,166 @@
+"""
+幂等键
+客户端用 Idempotency-Key 标识一次逻辑请求，首个成功结果保存一段时间，重试时直接重放，
+不会再次调用模型或重复扣费；原请求仍在执行时，重复请求等待它的结果
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from ..config import config
+
+# 原请求失败时通知等待者重新执行
+_RETRY = object()
+
+
+class IdempotencyConflict(Exception):
+    """同一个幂等键对应了不同的请求内容"""
+
+
+@dataclass
+class _Entry:
+    fingerprint: str
+    future: "asyncio.Future[Any]"
+    size: int = 0
+    expires_at: float = field(default=float("inf"))
+
+
+class IdempotencyStore:
+    """按 TTL、条目数和总字节数淘汰的结果存储；执行中的条目不会被淘汰"""
+
+    def __init__(self, ttl_seconds: float = 600.0, max_entries: int = 1000, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self.executed = 0
+        self.replayed = 0
+        self.waited = 0
+        self.conflicts = 0
+        self.evicted = 0
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _evict(self, now: float) -> None:
+        for key in [k for k, e in self._entries.items() if e.expires_at <= now]:
+            self._drop(key)
+            self.evicted += 1
+        completed = [k for k, e in self._entries.items() if e.future.done()]
+        while completed and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._drop(completed.pop(0))
+            self.evicted += 1
+
+    async def run(
+        self,
+        key: str,
+        fingerprint: str,
+        factory: Callable[[], Awaitable[Any]],
+        should_store: Callable[[Any], bool] = lambda result: True,
+    ) -> Tuple[Any, bool]:
+        """
+        执行或重放一次请求
+
+        Args:
+            key: 幂等键（调用方负责加上路由与用户范围）
+            fingerprint: 请求内容摘要，同一个键的内容不同时拒绝
+            factory: 实际执行请求的协程工厂
+            should_store: 结果是否值得保存（例如上游错误不保存，允许重试）
+
+        Returns:
+            (结果, 是否为重放)
+
+        Raises:
+            IdempotencyConflict: 同一个键对应了不同的请求内容
+        """
+        while True:
+            now = time.monotonic()
+            self._evict(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                return await self._execute(key, fingerprint, factory, should_store)
+            if entry.fingerprint != fingerprint:
+                self.conflicts += 1
+                raise IdempotencyConflict(f"Idempotency-Key 已用于不同的请求内容: {key}")
+            if not entry.future.done():
+                self.waited += 1
+                # shield：等待者断开时不取消原请求
+                result = await asyncio.shield(entry.future)
+            else:
+                result = entry.future.result()
+            if result is _RETRY:
+                continue
+            self.replayed += 1
+            self._entries.move_to_end(key)
+            return result, True
+
+    async def _execute(
+        self,
+        key: str,
+        fingerprint: str,
+        factory: Callable[[], Awaitable[Any]],
+        should_store: Callable[[Any], bool],
+    ) -> Tuple[Any, bool]:
+        entry = _Entry(fingerprint, asyncio.get_running_loop().create_future())
+        self._entries[key] = entry
+        self.executed += 1
+        # 原请求在独立任务中执行：调用者断开（例如移动端网络切换）时仍然执行完并保存结果，供重试重放
+        task = asyncio.ensure_future(self._complete(key, entry, factory, should_store))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task), False
+
+    async def _complete(
+        self,
+        key: str,
+        entry: _Entry,
+        factory: Callable[[], Awaitable[Any]],
+        should_store: Callable[[Any], bool],
+    ) -> Any:
+        try:
+            result = await factory()
+        except BaseException:
+            self._forget(key, entry)
+            raise
+        if not should_store(result):
+            self._forget(key, entry)
+            return result
+        entry.size = len(json.dumps(result, ensure_ascii=False, default=str))
+        entry.expires_at = time.monotonic() + self.ttl
+        self._bytes += entry.size
+        entry.future.set_result(result)
+        self._evict(time.monotonic())
+        return result
+
+    def _forget(self, key: str, entry: _Entry) -> None:
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+        if not entry.future.done():
+            entry.future.set_result(_RETRY)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ttl_seconds": self.ttl,
+            "entries": len(self._entries),
+            "pending": sum(1 for e in self._entries.values() if not e.future.done()),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "waited": self.waited,
+            "conflicts": self.conflicts,
+            "evicted": self.evicted,
+        }
+
+
+# 全局实例
+idempotency_store = IdempotencyStore(
+    ttl_seconds=config.IDEMPOTENCY_TTL_SECONDS,
+    max_entries=config.IDEMPOTENCY_MAX_ENTRIES,
+    max_bytes=config.IDEMPOTENCY_MAX_BYTES,
+)
@@ -0,0 +1,283 @@
+"""
+猜词图片预处理
+上传给视觉模型前裁掉画布空白、转灰度/二值化并按模型 patch 网格缩放，减少上传字节和视觉 token
+"""
+import base64
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from ..config import config
+from .._config.vision_models import DEFAULT_PROFILE, LOCAL_LLAMA_PROFILE, VISION_MODEL_PROFILES
+from .image_utils import BytesLike, decode_base64_image, decode_image_array, encode_data_url
+from .stroke_raster import StrokeDrawing, rasterize_for_model, stroke_hash
+
+# 灰度值低于该阈值视为笔迹
+INK_THRESHOLD = 250
+# 不超过该边长时使用 low detail
+LOW_DETAIL_MAX_SIDE = 512
+
+
+@dataclass
+class PreprocessedImage:
+    """预处理结果；gray 为处理后的灰度图，供缓存哈希复用，避免重复解码"""
+    image: str
+    detail: str
+    gray: Optional[np.ndarray]
+    # 均为图片本身的字节数，不含 base64 / data URL 的开销，前后可直接比较
+    original_bytes: int
+    processed_bytes: int
+    original_size: Tuple[int, int] = (0, 0)
+    processed_size: Tuple[int, int] = (0, 0)
+    crop: Optional[Tuple[int, int, int, int]] = None
+    elapsed_ms: float = 0.0
+    applied: bool = False
+    # 笔画输入时为规范化笔画的哈希，相同笔画必然得到相同图片
+    stroke_hash: Optional[str] = None
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "applied": self.applied,
+            "detail": self.detail,
+            "original_bytes": self.original_bytes,
+            "processed_bytes": self.processed_bytes,
+            "original_size": list(self.original_size),
+            "processed_size": list(self.processed_size),
+            "crop": list(self.crop) if self.crop else None,
+            "elapsed_ms": round(self.elapsed_ms, 2),
+            "stroke_hash": self.stroke_hash,
+        }
+
+
+@dataclass
+class PreprocessStats:
+    """累计的预处理效果统计"""
+    images: int = 0
+    original_bytes: int = 0
+    processed_bytes: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, prepared: PreprocessedImage) -> None:
+        with self._lock:
+            self.images += 1
+            self.original_bytes += prepared.original_bytes
+            self.processed_bytes += prepared.processed_bytes
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": config.GUESS_IMAGE_PREPROCESS,
+                "mode": config.GUESS_IMAGE_MODE,
+                "images": self.images,
+                "original_bytes": self.original_bytes,
+                "processed_bytes": self.processed_bytes,
+                "bytes_saved": self.original_bytes - self.processed_bytes,
+            }
+
+
+preprocess_stats = PreprocessStats()
+
+
+def get_model_profile(model_name: Optional[str], is_local: bool = False) -> Tuple[int, int]:
+    """
+    根据模型名称获取 (patch, max_side)
+
+    Args:
+        model_name: 模型名称
+        is_local: 是否为本地 llama-server
+
+    Returns:
+        (patch, max_side) 元组
+    """
+    name = (model_name or "").lower()
+    for keyword, profile in VISION_MODEL_PROFILES.items():
+        if keyword in name:
+            return profile
+    return LOCAL_LLAMA_PROFILE if is_local else DEFAULT_PROFILE
+
+
+def crop_to_ink(gray: np.ndarray, margin_ratio: float) -> Tuple[np.ndarray, Optional[Tuple[int, int, int, int]]]:
+    """
+    裁剪到笔迹包围盒并补白边，空白画布原样返回
+
+    Returns:
+        (裁剪后的图片, (x, y, w, h) 包围盒)
+    """
+    points = cv2.findNonZero((gray < INK_THRESHOLD).astype(np.uint8))
+    if points is None:
+        return gray, None
+    x, y, w, h = cv2.boundingRect(points)
+    margin = max(4, int(max(w, h) * margin_ratio))
+    cropped = cv2.copyMakeBorder(
+        gray[y:y + h, x:x + w], margin, margin, margin, margin, cv2.BORDER_CONSTANT, value=255
+    )
+    return cropped, (x, y, w, h)
+
+
+def resize_to_patch_grid(image: np.ndarray, patch: int, max_side: int) -> np.ndarray:
+    """
+    对齐到 patch 网格：超过 max_side 时等比缩小，再补白边使宽高均为 patch 的整数倍
+
+    小图不放大，补边不会引入插值产生的灰阶，PNG 体积更小
+    """
+    height, width = image.shape[:2]
+    if max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        width = max(1, int(width * scale))
+        height = max(1, int(height * scale))
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+    pad_height = (-height) % patch
+    pad_width = (-width) % patch
+    if pad_height or pad_width:
+        image = cv2.copyMakeBorder(
+            image,
+            pad_height // 2, pad_height - pad_height // 2,
+            pad_width // 2, pad_width - pad_width // 2,
+            cv2.BORDER_CONSTANT, value=(255, 255, 255),
+        )
+    return image
+
+
+def preprocess_guess_image(
+    image: Union[str, BytesLike],
+    model_name: Optional[str] = None,
+    is_local: bool = False,
+) -> PreprocessedImage:
+    """
+    解码一次并完成裁剪、灰度/二值化、按模型网格缩放与重新编码
+
+    Args:
+        image: 浏览器上传的 data URL，或二进制上传的原始图片数据
+        model_name: 目标模型名称，用于选择 patch 网格
+        is_local: 是否为本地 llama-server
+
+    Returns:
+        PreprocessedImage；无法解码或未启用预处理时 image 为原始 data URL
+    """
+    started = time.perf_counter()
+    image_data: Optional[BytesLike] = None
+    try:
+        image_data = decode_base64_image(image) if isinstance(image, str) else image
+        # 只解码一次：彩色模式保留原图，灰度图由它转换
+        decoded = decode_image_array(image_data, grayscale=config.GUESS_IMAGE_MODE != "color")
+    except Exception:
+        decoded = None
+    gray = decoded
+    if decoded is not None and decoded.ndim == 3:
+        gray = cv2.cvtColor(decoded, cv2.COLOR_BGR2GRAY)
+    original_bytes = len(image_data) if image_data is not None else len(image)
+
+    if gray is None or not config.GUESS_IMAGE_PREPROCESS:
+        size = (gray.shape[1], gray.shape[0]) if gray is not None else (0, 0)
+        return PreprocessedImage(
+            image=image if isinstance(image, str) else encode_data_url(image),
+            detail="high",
+            gray=gray,
+            original_bytes=original_bytes,
+            processed_bytes=original_bytes,
+            original_size=size,
+            processed_size=size,
+            elapsed_ms=(time.perf_counter() - started) * 1000,
+        )
+
+    original_size = (gray.shape[1], gray.shape[0])
+    cropped, bbox = crop_to_ink(gray, config.GUESS_IMAGE_MARGIN_RATIO)
+    patch, max_side = get_model_profile(model_name, is_local)
+    processed = resize_to_patch_grid(cropped, patch, max_side)
+
+    if config.GUESS_IMAGE_MODE == "color":
+        # 彩色模式：按灰度图的包围盒裁剪原图，保留颜色信息
+        color = decoded
+        if bbox is not None:
+            x, y, w, h = bbox
+            margin = (cropped.shape[0] - h) // 2
+            color = cv2.copyMakeBorder(
+                color[y:y + h, x:x + w], margin, margin, margin, margin,
+                cv2.BORDER_CONSTANT, value=(255, 255, 255)
+            )
+        # 与灰度图走同一套等比缩放与补边，直接拉伸到 processed 的尺寸会使非 patch 整数倍的画面变形
+        color = resize_to_patch_grid(color, patch, max_side)
+        _, buffer = cv2.imencode('.png', color, [cv2.IMWRITE_PNG_COMPRESSION, 9])
+        buffer = buffer.tobytes()
+    else:
+        processed, buffer = _encode_gray(processed)
+
+    encoded = "data:image/png;base64," + base64.b64encode(buffer).decode('utf-8')
+    processed_size = (processed.shape[1], processed.shape[0])
+    prepared = PreprocessedImage(
+        image=encoded,
+        detail="low" if max(processed_size) <= LOW_DETAIL_MAX_SIDE else "high",
+        gray=processed,
+        original_bytes=original_bytes,
+        processed_bytes=len(buffer),
+        original_size=original_size,
+        processed_size=processed_size,
+        crop=bbox,
+        elapsed_ms=(time.perf_counter() - started) * 1000,
+        applied=True,
+    )
+    preprocess_stats.record(prepared)
+    print(
+        f"🖼️ 图片预处理: {original_size[0]}x{original_size[1]} -> {processed_size[0]}x{processed_size[1]}, "
+        f"{prepared.original_bytes} -> {prepared.processed_bytes} 字节, detail={prepared.detail}, "
+        f"耗时 {prepared.elapsed_ms:.1f}ms"
+    )
+    return prepared
+
+
+def _encode_gray(processed: np.ndarray) -> Tuple[np.ndarray, bytes]:
+    if config.GUESS_IMAGE_MODE == "binary":
+        _, processed = cv2.threshold(processed, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        params = [cv2.IMWRITE_PNG_BILEVEL, 1, cv2.IMWRITE_PNG_COMPRESSION, 9]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, 9]
+    _, buffer = cv2.imencode('.png', processed, params)
+    return processed, buffer.tobytes()
+
+
+def preprocess_guess_strokes(
+    drawing: StrokeDrawing,
+    model_name: Optional[str] = None,
+    is_local: bool = False,
+) -> PreprocessedImage:
+    """
+    笔画输入：直接在模型的目标分辨率上光栅化并裁剪，不经过全尺寸位图
+
+    笔画本身没有颜色，color 模式按灰度处理；未启用预处理时同样按目标分辨率绘制
+    """
+    started = time.perf_counter()
+    patch, max_side = get_model_profile(model_name, is_local)
+    gray, bbox = rasterize_for_model(drawing.strokes, patch, max_side, config.GUESS_IMAGE_MARGIN_RATIO)
+    processed, buffer = _encode_gray(gray)
+
+    encoded = encode_data_url(buffer)
+    processed_size = (processed.shape[1], processed.shape[0])
+    crop = None
+    if bbox is not None:
+        x0, y0, x1, y1 = (int(round(v)) for v in bbox)
+        crop = (x0, y0, x1 - x0, y1 - y0)
+    prepared = PreprocessedImage(
+        image=encoded,
+        detail="low" if max(processed_size) <= LOW_DETAIL_MAX_SIDE else "high",
+        gray=processed,
+        original_bytes=drawing.payload_bytes(),
+        processed_bytes=len(buffer),
+        original_size=(drawing.width or 0, drawing.height or 0),
+        processed_size=processed_size,
+        crop=crop,
+        elapsed_ms=(time.perf_counter() - started) * 1000,
+        applied=True,
+        stroke_hash=stroke_hash(drawing.strokes),
+    )
+    preprocess_stats.record(prepared)
+    print(
+        f"🖊️ 笔画光栅化: {len(drawing.strokes)} 笔 -> {processed_size[0]}x{processed_size[1]}, "
+        f"{prepared.original_bytes} -> {prepared.processed_bytes} 字节, detail={prepared.detail}, "
+        f"耗时 {prepared.elapsed_ms:.1f}ms"
+    )
+    return prepared
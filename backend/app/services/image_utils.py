@@ -0,0 +1,121 @@
+"""
+图片解码工具
+统一处理 data URL / base64 图片与二进制上传的解码，供猜词、简笔画、画廊等服务共用
+"""
+import base64
+from collections.abc import AsyncIterator
+from typing import List, Optional, Union
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+import cv2
+import numpy as np
+
+
+def decode_base64_image(image: str) -> bytes:
+    """
+    解码 base64 图片，兼容带 data:image/...;base64, 前缀的 data URL
+
+    Args:
+        image: base64 字符串或 data URL
+
+    Returns:
+        图片二进制数据
+    """
+    if image.startswith('data:'):
+        image = image.split(',', 1)[1]
+    return base64.b64decode(image)
+
+
+class ImageTooLarge(ValueError):
+    """上传的图片超过大小限制"""
+
+    def __init__(self, limit: int):
+        super().__init__(f"图片超过大小限制（{limit} 字节）")
+        self.limit = limit
+
+
+async def read_image_stream(
+    chunks: AsyncIterator[bytes],
+    max_bytes: int,
+    declared_length: Optional[str] = None,
+) -> bytes:
+    """
+    读取二进制上传的请求体，超过 max_bytes 时立即中止
+
+    Args:
+        chunks: 请求体分块（如 starlette 的 request.stream()）
+        max_bytes: 允许的最大字节数
+        declared_length: Content-Length 请求头，声明值超限时不再读取
+
+    Returns:
+        完整的图片二进制数据
+    """
+    if declared_length and declared_length.isdigit() and int(declared_length) > max_bytes:
+        raise ImageTooLarge(max_bytes)
+    parts: List[bytes] = []
+    total = 0
+    async for chunk in chunks:
+        total += len(chunk)
+        if total > max_bytes:
+            raise ImageTooLarge(max_bytes)
+        parts.append(chunk)
+    return b"".join(parts)
+
+
+def image_buffer(image_data: BytesLike) -> np.ndarray:
+    """零拷贝地把二进制数据包装成 uint8 数组，直接交给 cv2.imdecode"""
+    return np.frombuffer(image_data, np.uint8)
+
+
+def sniff_image_mime(image_data: BytesLike) -> Optional[str]:
+    """按文件头识别常见图片格式，无法识别时返回 None"""
+    head = bytes(image_data[:12])
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return None
+
+
+def encode_data_url(image_data: BytesLike, mime: Optional[str] = None) -> str:
+    """二进制图片编码为 data URL（调用 OpenAI 兼容接口时需要）"""
+    mime = mime or sniff_image_mime(image_data) or "image/png"
+    return f"data:{mime};base64," + base64.b64encode(image_data).decode('ascii')
+
+
+def decode_image_array(image_data: BytesLike, grayscale: bool = False) -> Optional[np.ndarray]:
+    """
+    将图片二进制数据解码为数组，透明背景会合成到白底上
+
+    Args:
+        image_data: 图片二进制数据
+        grayscale: 是否返回灰度图
+
+    Returns:
+        BGR 或灰度图数组，无法解码时返回 None
+    """
+    image = cv2.imdecode(image_buffer(image_data), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        return None
+
+    if image.ndim == 3 and image.shape[2] == 4:
+        # 透明区域按白色处理（画板导出的 PNG 可能带 alpha 通道）
+        alpha = image[:, :, 3:4].astype(np.float32) / 255.0
+        color = image[:, :, :3].astype(np.float32)
+        image = (color * alpha + 255.0 * (1.0 - alpha)).astype(np.uint8)
+    if image.dtype != np.uint8:
+        image = cv2.convertScaleAbs(image, alpha=255.0 / max(float(image.max()), 1.0))
+
+    if grayscale:
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return image
+
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return image
@@ -0,0 +1,200 @@
+"""
+边画边猜
+WebSocket 会话推送画布快照或增量笔画；服务端防抖合并，画面变化不足时跳过调用，
+新一轮猜测开始时取消尚未返回的旧请求
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from ..config import config
+from .image_utils import decode_image_array
+from .stroke_raster import StrokeCanvas
+
+# 比较画面变化时使用的缩略图边长与像素差阈值
+THUMBNAIL_SIZE = 128
+PIXEL_DIFF_THRESHOLD = 24
+# 缩略图中最暗像素仍高于该值时视为空白画布
+BLANK_THRESHOLD = 250
+
+
+def frame_thumbnail(gray: np.ndarray) -> np.ndarray:
+    return cv2.resize(gray, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA)
+
+
+def frame_diff(previous: Optional[np.ndarray], current: np.ndarray) -> float:
+    """两帧缩略图中发生变化的像素比例，没有上一帧时为 1"""
+    if previous is None:
+        return 1.0
+    changed = np.count_nonzero(cv2.absdiff(previous, current) > PIXEL_DIFF_THRESHOLD)
+    return changed / current.size
+
+
+class LiveGuessStats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.active_sessions = 0
+        self.sessions = 0
+        self.frames = 0
+        self.guesses = 0
+        self.skipped = 0
+        self.cancelled = 0
+
+    def add(self, **counts: int) -> None:
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            triggered = self.guesses + self.skipped
+            return {
+                "active_sessions": self.active_sessions,
+                "sessions": self.sessions,
+                "frames": self.frames,
+                "guesses": self.guesses,
+                "skipped": self.skipped,
+                "cancelled": self.cancelled,
+                "skip_ratio": round(self.skipped / triggered, 4) if triggered else 0.0,
+            }
+
+
+live_guess_stats = LiveGuessStats()
+
+FrameSource = Union[bytes, np.ndarray]
+
+
+class LiveGuessSession:
+    """
+    单个 WebSocket 连接的猜测调度
+
+    Args:
+        guess: 对一帧图片（PNG/JPEG 二进制）发起猜测，返回 /ai/guess 的结果
+        send: 向客户端推送一条消息
+    """
+
+    def __init__(
+        self,
+        guess: Callable[[bytes], Awaitable[Dict[str, Any]]],
+        send: Callable[[Dict[str, Any]], Awaitable[None]],
+        debounce_ms: float = config.LIVE_GUESS_DEBOUNCE_MS,
+        min_diff: float = config.LIVE_GUESS_MIN_DIFF,
+    ):
+        self._guess = guess
+        self._send = send
+        self.debounce = max(0.0, debounce_ms) / 1000.0
+        self.min_diff = min_diff
+        self.canvas: Optional[StrokeCanvas] = None
+        self.frame = 0
+        self._source: Optional[FrameSource] = None
+        self._last_thumbnail: Optional[np.ndarray] = None
+        self._timer: Optional["asyncio.Task[None]"] = None
+        self._inflight: Optional["asyncio.Task[None]"] = None
+        self._inflight_frame = 0
+        self._send_lock = asyncio.Lock()
+        live_guess_stats.add(sessions=1, active_sessions=1)
+
+    async def send(self, payload: Dict[str, Any]) -> None:
+        async with self._send_lock:
+            try:
+                await self._send(payload)
+            except Exception as e:
+                # 连接已关闭，后续消息直接丢弃
+                print(f"⚠️ 边画边猜推送失败: {e}")
+
+    def push_snapshot(self, image: bytes) -> None:
+        """整幅画布快照（PNG/JPEG 二进制）"""
+        self._source = image
+        self._schedule()
+
+    def push_strokes(
+        self,
+        strokes: Iterable[Dict[str, Any]],
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        clear: bool = False,
+    ) -> None:
+        """增量笔画，累积绘制在服务端画布上"""
+        if self.canvas is None:
+            self.canvas = StrokeCanvas(width or 800, height or 600)
+        elif clear or (width and height and (width, height) != (self.canvas.width, self.canvas.height)):
+            self.canvas.clear(width, height)
+        self.canvas.draw(strokes)
+        # 只在真正发起猜测时才编码，这里保存当前画面的副本
+        self._source = self.canvas.image
+        self._schedule()
+
+    def clear(self) -> None:
+        if self.canvas is not None:
+            self.canvas.clear()
+        self._source = None
+        self._last_thumbnail = None
+        self._cancel_timer()
+        self._cancel_inflight()
+
+    def _schedule(self) -> None:
+        self.frame += 1
+        live_guess_stats.add(frames=1)
+        # 防抖：每来一帧都重新计时，停笔 debounce 之后才处理最新一帧
+        self._cancel_timer()
+        self._timer = asyncio.create_task(self._debounced(self.frame))
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None and not self._timer.done():
+            self._timer.cancel()
+
+    def _cancel_inflight(self) -> bool:
+        if self._inflight is not None and not self._inflight.done():
+            self._inflight.cancel()
+            live_guess_stats.add(cancelled=1)
+            return True
+        return False
+
+    @staticmethod
+    def _render(source: FrameSource) -> Tuple[Optional[bytes], Optional[np.ndarray]]:
+        if isinstance(source, np.ndarray):
+            _, buffer = cv2.imencode('.png', source, [cv2.IMWRITE_PNG_COMPRESSION, 3])
+            return buffer.tobytes(), source
+        return source, decode_image_array(source, grayscale=True)
+
+    async def _debounced(self, frame: int) -> None:
+        await asyncio.sleep(self.debounce)
+        source = self._source
+        if source is None:
+            return
+        if isinstance(source, np.ndarray):
+            source = source.copy()
+        image, gray = await asyncio.to_thread(self._render, source)
+        if gray is None:
+            await self.send({"type": "error", "frame": frame, "error": "无法解码图片"})
+            return
+
+        thumbnail = frame_thumbnail(gray)
+        if int(thumbnail.min()) > BLANK_THRESHOLD:
+            live_guess_stats.add(skipped=1)
+            await self.send({"type": "skipped", "frame": frame, "reason": "blank"})
+            return
+        diff = frame_diff(self._last_thumbnail, thumbnail)
+        if diff < self.min_diff:
+            live_guess_stats.add(skipped=1)
+            await self.send({"type": "skipped", "frame": frame, "reason": "unchanged", "diff": round(diff, 4)})
+            return
+
+        self._last_thumbnail = thumbnail
+        if self._cancel_inflight():
+            await self.send({"type": "cancelled", "frame": self._inflight_frame, "superseded_by": frame})
+        self._inflight_frame = frame
+        self._inflight = asyncio.create_task(self._run_guess(frame, image, diff))
+
+    async def _run_guess(self, frame: int, image: bytes, diff: float) -> None:
+        live_guess_stats.add(guesses=1)
+        result = await self._guess(image)
+        await self.send({**result, "type": "guess", "frame": frame, "diff": round(diff, 4)})
+
+    async def close(self) -> None:
+        self._cancel_timer()
+        self._cancel_inflight()
+        live_guess_stats.add(active_sessions=-1)
@@ -0,0 +1,99 @@
+"""
+提示词前缀缓存统计
+根据 llama-server 返回的 timings（prompt_n / prompt_ms / cache_n）或 OpenAI 的
+cached_tokens，估算每次请求因 KV 缓存复用而节省的 prompt 计算时间
+"""
+import threading
+import zlib
+from typing import Any, Dict, Optional
+
+
+def session_slot(session_id: Optional[str], slots: int) -> Optional[int]:
+    """把会话稳定地映射到一个 llama-server 槽位，同一玩家的连续请求落在同一份 KV 缓存上"""
+    if not session_id or slots <= 1:
+        return None
+    return zlib.crc32(session_id.encode("utf-8")) % slots
+
+
+def _field(value: Any, name: str) -> Any:
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return value.get(name)
+    return getattr(value, name, None)
+
+
+def prompt_eval_report(response: Any) -> Optional[Dict[str, Any]]:
+    """
+    从补全响应中提取 prompt 计算与缓存复用情况
+
+    Args:
+        response: ChatCompletion 或流式的最后一个 chunk
+
+    Returns:
+        {"cached_tokens", "evaluated_tokens", "prompt_ms", "saved_ms"}，没有相关字段时返回 None
+    """
+    timings = _field(response, "timings")
+    if timings:
+        evaluated = int(_field(timings, "prompt_n") or 0)
+        cached = int(_field(timings, "cache_n") or 0)
+        prompt_ms = float(_field(timings, "prompt_ms") or 0.0)
+        # 按本次实际计算的每 token 耗时估算被复用部分的耗时
+        per_token_ms = prompt_ms / evaluated if evaluated else 0.0
+        return {
+            "cached_tokens": cached,
+            "evaluated_tokens": evaluated,
+            "prompt_ms": round(prompt_ms, 2),
+            "saved_ms": round(cached * per_token_ms, 2),
+        }
+
+    usage = _field(response, "usage")
+    cached = _field(_field(usage, "prompt_tokens_details"), "cached_tokens")
+    if cached is None:
+        return None
+    prompt_tokens = int(_field(usage, "prompt_tokens") or 0)
+    return {
+        "cached_tokens": int(cached),
+        "evaluated_tokens": max(0, prompt_tokens - int(cached)),
+        "prompt_ms": None,
+        "saved_ms": None,
+    }
+
+
+class PromptCacheStats:
+    """累计各请求的前缀缓存复用情况"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.cache_hits = 0
+        self.cached_tokens = 0
+        self.evaluated_tokens = 0
+        self.saved_ms = 0.0
+
+    def record(self, report: Optional[Dict[str, Any]]) -> None:
+        if report is None:
+            return
+        with self._lock:
+            self.requests += 1
+            self.cache_hits += int(report["cached_tokens"] > 0)
+            self.cached_tokens += report["cached_tokens"]
+            self.evaluated_tokens += report["evaluated_tokens"]
+            self.saved_ms += report["saved_ms"] or 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total_tokens = self.cached_tokens + self.evaluated_tokens
+            return {
+                "requests": self.requests,
+                "cache_hits": self.cache_hits,
+                "cached_tokens": self.cached_tokens,
+                "evaluated_tokens": self.evaluated_tokens,
+                "token_reuse_ratio": round(self.cached_tokens / total_tokens, 4) if total_tokens else 0.0,
+                "saved_ms": round(self.saved_ms, 2),
+                "avg_saved_ms": round(self.saved_ms / self.requests, 2) if self.requests else 0.0,
+            }
+
+
+# 全局实例
+prompt_cache_stats = PromptCacheStats()
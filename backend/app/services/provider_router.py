@@ -0,0 +1,225 @@
+"""
+多模型提供方路由
+按 EWMA 延迟和错误率为提供方排序，首选方在其 p95 延迟内未返回时向次优提供方发送对冲请求
+"""
+import asyncio
+import json
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from ..config import config
+
+T = TypeVar("T")
+
+# p95 至少需要的样本数，不足时使用配置的默认对冲延迟
+MIN_SAMPLES_FOR_P95 = 20
+# 错误率对排序得分的附加惩罚（毫秒），保证连续失败的提供方排在后面
+ERROR_PENALTY_MS = 10000.0
+
+
+@dataclass
+class ProviderEndpoint:
+    name: str
+    url: str
+    key: Optional[str]
+    model: Optional[str]
+
+
+@dataclass
+class ProviderStats:
+    alpha: float
+    ewma_latency_ms: Optional[float] = None
+    ewma_error_rate: float = 0.0
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=200))
+    calls: int = 0
+    errors: int = 0
+    hedges_sent: int = 0
+    hedges_won: int = 0
+
+    def record_success(self, latency_ms: float) -> None:
+        self.calls += 1
+        self.latencies.append(latency_ms)
+        if self.ewma_latency_ms is None:
+            self.ewma_latency_ms = latency_ms
+        else:
+            self.ewma_latency_ms += self.alpha * (latency_ms - self.ewma_latency_ms)
+        self.ewma_error_rate *= 1 - self.alpha
+
+    def record_censored(self, elapsed_ms: float) -> None:
+        """被对冲取消的请求只知道耗时下限，只更新 EWMA，使慢提供方在排序中下移"""
+        if self.ewma_latency_ms is None or elapsed_ms > self.ewma_latency_ms:
+            self.ewma_latency_ms = (
+                elapsed_ms if self.ewma_latency_ms is None
+                else self.ewma_latency_ms + self.alpha * (elapsed_ms - self.ewma_latency_ms)
+            )
+
+    def record_error(self) -> None:
+        self.calls += 1
+        self.errors += 1
+        self.ewma_error_rate += self.alpha * (1 - self.ewma_error_rate)
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < MIN_SAMPLES_FOR_P95:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def score(self) -> float:
+        """越小越好；尚无延迟样本的提供方按 0 计，优先被探测"""
+        latency = self.ewma_latency_ms or 0.0
+        return latency * (1 + 4 * self.ewma_error_rate) + self.ewma_error_rate * ERROR_PENALTY_MS
+
+
+class ProviderRouter:
+    """延迟感知路由，支持对冲请求与失败转移"""
+
+    def __init__(
+        self,
+        providers: List[ProviderEndpoint],
+        alpha: float = 0.2,
+        hedge_enabled: bool = True,
+        default_hedge_delay_ms: float = 3000.0,
+        min_hedge_delay_ms: float = 200.0,
+    ):
+        self.providers = providers
+        self.alpha = alpha
+        self.hedge_enabled = hedge_enabled
+        self.default_hedge_delay_ms = default_hedge_delay_ms
+        self.min_hedge_delay_ms = min_hedge_delay_ms
+        self._stats: Dict[str, ProviderStats] = {p.name: ProviderStats(alpha=alpha) for p in providers}
+
+    def ranked(self) -> List[ProviderEndpoint]:
+        return sorted(self.providers, key=lambda p: self._stats[p.name].score())
+
+    def hedge_delay(self, provider: ProviderEndpoint) -> float:
+        p95 = self._stats[provider.name].p95()
+        delay_ms = p95 if p95 is not None else self.default_hedge_delay_ms
+        return max(self.min_hedge_delay_ms, delay_ms) / 1000.0
+
+    async def _timed(
+        self,
+        provider: ProviderEndpoint,
+        call: Callable[[ProviderEndpoint], Awaitable[T]],
+    ) -> Tuple[T, ProviderEndpoint]:
+        started = time.monotonic()
+        try:
+            result = await call(provider)
+        except asyncio.CancelledError:
+            # 对冲失败方被取消，不计入错误率
+            self._stats[provider.name].record_censored((time.monotonic() - started) * 1000)
+            raise
+        except Exception:
+            self._stats[provider.name].record_error()
+            raise
+        self._stats[provider.name].record_success((time.monotonic() - started) * 1000)
+        return result, provider
+
+    async def call(self, call: Callable[[ProviderEndpoint], Awaitable[T]]) -> Tuple[T, ProviderEndpoint]:
+        """
+        按排序调用提供方
+
+        首选方超过其 p95 仍未返回时向下一个提供方发送对冲请求，先成功的结果胜出，另一方被取消；
+        某个提供方失败时立即转向下一个。
+
+        Returns:
+            (结果, 实际返回结果的提供方)
+        """
+        candidates = self.ranked()
+        pending: Dict["asyncio.Task[Tuple[T, ProviderEndpoint]]", ProviderEndpoint] = {}
+        last_error: Optional[BaseException] = None
+
+        def launch() -> Optional[ProviderEndpoint]:
+            if not candidates:
+                return None
+            provider = candidates.pop(0)
+            pending[asyncio.ensure_future(self._timed(provider, call))] = provider
+            return provider
+
+        primary = launch()
+        try:
+            while pending:
+                can_hedge = self.hedge_enabled and candidates and len(pending) == 1
+                timeout = self.hedge_delay(primary) if can_hedge else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # 首选方在 p95 内未返回，发送对冲请求
+                    self._stats[primary.name].hedges_sent += 1
+                    hedge = launch()
+                    print(f"🔀 {primary.name} 超过 {timeout * 1000:.0f}ms 未返回，对冲到 {hedge.name}")
+                    continue
+
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is None:
+                        if provider is not primary:
+                            self._stats[provider.name].hedges_won += 1
+                        return task.result()
+                    last_error = task.exception()
+                    print(f"⚠️ 提供方 {provider.name} 调用失败: {last_error}")
+
+                if pending:
+                    primary = next(iter(pending.values()))
+                else:
+                    # 失败转移到下一个提供方
+                    primary = launch() or primary
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise last_error or Exception("没有可用的模型提供方")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hedge_enabled": self.hedge_enabled,
+            "providers": {
+                provider.name: {
+                    "url": provider.url,
+                    "model": provider.model,
+                    "ewma_latency_ms": round(s.ewma_latency_ms, 2) if s.ewma_latency_ms is not None else None,
+                    "ewma_error_rate": round(s.ewma_error_rate, 4),
+                    "p95_ms": round(s.p95(), 2) if s.p95() is not None else None,
+                    "hedge_delay_ms": round(self.hedge_delay(provider) * 1000, 2),
+                    "calls": s.calls,
+                    "errors": s.errors,
+                    "hedges_sent": s.hedges_sent,
+                    "hedges_won": s.hedges_won,
+                }
+                for provider in self.providers
+                for s in (self._stats[provider.name],)
+            },
+        }
+
+
+def _load_providers() -> List[ProviderEndpoint]:
+    """服务器默认模型 + GUESS_PROVIDERS 中配置的额外提供方"""
+    providers = [ProviderEndpoint("default", config.MODEL_URL, config.MODEL_KEY, config.MODEL_NAME)]
+    if not config.GUESS_PROVIDERS:
+        return providers
+    try:
+        extra = json.loads(config.GUESS_PROVIDERS)
+    except json.JSONDecodeError as e:
+        print(f"⚠️ GUESS_PROVIDERS 不是合法的 JSON，已忽略: {e}")
+        return providers
+    for index, item in enumerate(extra):
+        if not isinstance(item, dict) or not item.get("url"):
+            continue
+        providers.append(ProviderEndpoint(
+            name=item.get("name") or f"provider-{index + 1}",
+            url=item["url"],
+            key=item.get("key"),
+            model=item.get("model"),
+        ))
+    return providers
+
+
+# 全局实例，用于服务器端付费的猜词调用
+guess_router = ProviderRouter(
+    _load_providers(),
+    alpha=config.GUESS_ROUTER_EWMA_ALPHA,
+    hedge_enabled=config.GUESS_HEDGE_ENABLED,
+    default_hedge_delay_ms=config.GUESS_HEDGE_DELAY_MS,
+    min_hedge_delay_ms=config.GUESS_HEDGE_MIN_DELAY_MS,
+)
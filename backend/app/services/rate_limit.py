@@ -0,0 +1,111 @@
+"""
+令牌桶限流
+每个 (策略, 维度, 键) 一个桶，按访问时间惰性补充令牌，检查为 O(1)；
+长时间空闲的桶已经补满，直接淘汰不影响结果
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from ..config import config
+from .._config.rate_limits import RATE_LIMIT_POLICIES
+
+BucketKey = Tuple[str, str, str]
+
+
+class RateLimited(Exception):
+    """令牌不足，retry_after 为下一个令牌补充到位所需的秒数"""
+
+    def __init__(self, policy: str, scope: str, retry_after: float):
+        self.policy = policy
+        self.scope = scope
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"请求过于频繁，请 {self.retry_after} 秒后重试")
+
+
+class TokenBucketLimiter:
+    def __init__(self, policies: Dict[str, Dict[str, Tuple[float, int]]], max_keys: int = 100000,
+                 idle_seconds: float = 600.0):
+        self.policies = policies
+        self.max_keys = max(1, max_keys)
+        self.idle_seconds = idle_seconds
+        # 键 -> [剩余令牌, 上次更新时间]，按最近访问排序，便于从头部淘汰
+        self._buckets: "OrderedDict[BucketKey, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited: Dict[str, int] = {}
+        self.evicted = 0
+
+    def _take(self, key: BucketKey, rate: float, burst: int, now: float) -> float:
+        """取一个令牌，成功返回 0，否则返回需要等待的秒数（不扣减）"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(burst), now]
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(float(burst), bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return 0.0
+        return (1.0 - bucket[0]) / rate if rate > 0 else float(self.idle_seconds)
+
+    def _evict(self, now: float) -> None:
+        while self._buckets:
+            key, (_, last) = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.max_keys and now - last < self.idle_seconds:
+                break
+            del self._buckets[key]
+            self.evicted += 1
+
+    def check(self, policy: str, session_id: Optional[str], client_ip: Optional[str]) -> None:
+        """
+        为一次请求扣减令牌，会话桶与 IP 桶都必须有令牌
+
+        Raises:
+            RateLimited: 任一桶令牌不足
+        """
+        rules = self.policies.get(policy)
+        if not rules:
+            return
+        scopes = [("ip", client_ip or "unknown")]
+        if session_id:
+            scopes.insert(0, ("session", session_id))
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            taken = []
+            for scope, value in scopes:
+                rate, burst = rules[scope]
+                key = (policy, scope, value)
+                wait = self._take(key, rate, burst, now)
+                if wait:
+                    # 已扣减的桶退回令牌，被拒绝的请求不消耗额度
+                    for previous in taken:
+                        self._buckets[previous][0] += 1.0
+                    self.limited[policy] = self.limited.get(policy, 0) + 1
+                    raise RateLimited(policy, scope, wait)
+                taken.append(key)
+            self.allowed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": config.RATE_LIMIT_ENABLED,
+                "buckets": len(self._buckets),
+                "allowed": self.allowed,
+                "limited": dict(self.limited),
+                "evicted": self.evicted,
+                "policies": {name: {scope: list(rule) for scope, rule in rules.items()}
+                             for name, rules in self.policies.items()},
+            }
+
+
+# 全局实例
+rate_limiter = TokenBucketLimiter(
+    RATE_LIMIT_POLICIES,
+    max_keys=config.RATE_LIMIT_MAX_KEYS,
+    idle_seconds=config.RATE_LIMIT_IDLE_SECONDS,
+)
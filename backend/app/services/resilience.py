@@ -0,0 +1,212 @@
+"""
+上游模型调用的熔断与自适应超时
+每个上游端点的每种调用（猜词 / 文生图）一个熔断器（closed / open / half_open），
+超时时间由同一端点、同一种调用观测到的延迟分位数推导
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, Optional, Tuple
+
+import openai
+
+from ..config import config
+from .deadline import DeadlineExceeded, current_deadline
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 计算分位数至少需要的样本数，不足时使用路由配置的超时上限
+MIN_SAMPLES_FOR_TIMEOUT = 20
+
+# 路由 -> (最小超时, 最大超时)，单位秒
+ROUTE_TIMEOUTS: Dict[str, Tuple[float, float]] = {
+    "guess": (config.UPSTREAM_TIMEOUT_MIN_SECONDS, config.UPSTREAM_TIMEOUT_GUESS_SECONDS),
+    "sketch": (config.UPSTREAM_TIMEOUT_MIN_SECONDS, config.UPSTREAM_TIMEOUT_SKETCH_SECONDS),
+}
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被快速拒绝"""
+
+    def __init__(self, endpoint: str, retry_after: float):
+        self.endpoint = endpoint
+        self.retry_after = max(1, int(retry_after + 0.999))
+        super().__init__(f"上游模型暂时不可用（熔断中），请 {self.retry_after} 秒后重试")
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """超时、连接错误、限流和 5xx 计为上游故障；鉴权、参数等客户端错误不影响熔断"""
+    if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code >= 500
+    return isinstance(exc, TimeoutError)
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        endpoint: str,
+        route: str = "guess",
+        failure_threshold: int = 5,
+        recovery_seconds: float = 30.0,
+        timeout_multiplier: float = 3.0,
+    ):
+        self.endpoint = endpoint
+        self.route = route
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_seconds = recovery_seconds
+        self.timeout_multiplier = timeout_multiplier
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self.successes = 0
+        self.failures = 0
+        self._probe_in_flight = False
+        self._latencies: Deque[float] = deque(maxlen=200)
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """调用上游前检查；打开状态下直接抛出 CircuitOpenError"""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.recovery_seconds - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.endpoint, remaining)
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.endpoint, 1)
+                # 半开状态只放行一个探测请求
+                self._probe_in_flight = True
+
+    def record_success(self, latency_seconds: Optional[float] = None) -> None:
+        with self._lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+            if latency_seconds is not None:
+                self._latencies.append(latency_seconds)
+            if self.state != CLOSED:
+                print(f"✅ 熔断器恢复: {self.endpoint} [{self.route}]")
+            self.state = CLOSED
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.trips += 1
+                    print(f"⛔ 熔断器打开: {self.endpoint} [{self.route}]（连续失败 {self.consecutive_failures} 次）")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """调用既不算成功也不算故障（如客户端错误）时释放半开探测名额"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < MIN_SAMPLES_FOR_TIMEOUT:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def timeout_for(self) -> float:
+        """超时 = p99 * 倍数，限制在路由配置的 [最小, 最大] 范围内；样本不足时取最大值"""
+        min_timeout, max_timeout = ROUTE_TIMEOUTS.get(self.route, ROUTE_TIMEOUTS["guess"])
+        p99 = self.percentile(0.99)
+        if p99 is None:
+            return max_timeout
+        return min(max_timeout, max(min_timeout, p99 * self.timeout_multiplier))
+
+    def stats(self) -> Dict[str, Any]:
+        p50 = self.percentile(0.5)
+        p99 = self.percentile(0.99)
+        return {
+            "state": self.state,
+            "trips": self.trips,
+            "consecutive_failures": self.consecutive_failures,
+            "successes": self.successes,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "p50_seconds": round(p50, 3) if p50 is not None else None,
+            "p99_seconds": round(p99, 3) if p99 is not None else None,
+            "timeout_seconds": round(self.timeout_for(), 2),
+        }
+
+
+class BreakerRegistry:
+    """按 (端点, 路由) 区分熔断器：同一主机上的猜词与文生图延迟相差很大，故障也互不影响"""
+
+    def __init__(self):
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, base_url: str, route: str) -> CircuitBreaker:
+        endpoint = (base_url or "").rstrip("/")
+        with self._lock:
+            breaker = self._breakers.get((endpoint, route))
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    endpoint,
+                    route,
+                    failure_threshold=config.CIRCUIT_FAILURE_THRESHOLD,
+                    recovery_seconds=config.CIRCUIT_RECOVERY_SECONDS,
+                    timeout_multiplier=config.UPSTREAM_TIMEOUT_MULTIPLIER,
+                )
+                self._breakers[(endpoint, route)] = breaker
+            return breaker
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        result: Dict[str, Dict[str, Any]] = {}
+        for (endpoint, route), breaker in breakers.items():
+            result.setdefault(endpoint, {})[route] = breaker.stats()
+        return result
+
+
+# 全局实例
+upstream_breakers = BreakerRegistry()
+
+
+@contextmanager
+def guarded_call(base_url: str, route: str) -> Iterator[float]:
+    """
+    用熔断器保护一次上游调用，产出本次调用应使用的超时时间（秒）
+
+    熔断打开时直接抛出 CircuitOpenError；调用结束后记录延迟或故障。
+    当前请求有截止时间时，超时不超过剩余时间，因截止时间到达而失败的调用不计入熔断
+    """
+    deadline = current_deadline.get()
+    if deadline is not None:
+        deadline.check(route)
+    breaker = upstream_breakers.get(base_url, route)
+    breaker.before_call()
+    started = time.monotonic()
+    timeout = breaker.timeout_for()
+    try:
+        yield deadline.cap(timeout) if deadline is not None else timeout
+    except BaseException as exc:
+        if isinstance(exc, Exception) and deadline is not None and deadline.expired:
+            breaker.release()
+            raise DeadlineExceeded(route) from exc
+        if isinstance(exc, Exception) and is_upstream_failure(exc):
+            breaker.record_failure()
+        else:
+            breaker.release()
+        raise
+    breaker.record_success(time.monotonic() - started)
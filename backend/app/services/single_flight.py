@@ -0,0 +1,96 @@
+"""
+请求合并（single-flight）
+相同内容和参数的并发请求共享同一次上游调用
+"""
+import asyncio
+import contextvars
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Tuple, TypeVar
+
+from ..config import config
+from .deadline import Deadline, current_deadline
+
+T = TypeVar("T")
+
+
+def make_flight_key(*parts: Any) -> str:
+    """把请求内容与参数序列化后取 sha256 作为合并键"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """同一个键同时只有一个上游调用在执行，其余调用者等待并共享结果"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight: Dict[str, "asyncio.Future[Any]"] = {}
+        self._waiters: Dict[str, int] = {}
+        self._deadlines: Dict[str, Deadline] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        执行或加入一次调用
+
+        Args:
+            key: 合并键
+            factory: 创建上游调用协程的函数，仅由第一个调用者执行
+
+        Returns:
+            (结果, 是否复用了其他请求的调用)
+        """
+        task = self._in_flight.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            # 共享调用不继承发起者的截止时间：各调用者的截止时间只约束自己的等待，
+            # 共享调用只在所有调用者都离开时取消（线程中的计算在下一个检查点停止）
+            deadline = Deadline(config.DEADLINE_MAX_SECONDS)
+            context = contextvars.copy_context()
+            context.run(current_deadline.set, deadline)
+            task = asyncio.get_running_loop().create_task(factory(), context=context)
+            self._in_flight[key] = task
+            self._deadlines[key] = deadline
+            task.add_done_callback(lambda _: self._forget(key, task))
+        # shield：某个调用者断开时不取消其他调用者共享的上游请求
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            remaining = self._waiters.get(key, 1) - 1
+            if remaining:
+                self._waiters[key] = remaining
+            else:
+                self._waiters.pop(key, None)
+                if not task.done():
+                    # 所有调用者都已取消，结果不再有人需要，取消上游请求
+                    self._deadlines[key].cancel()
+                    task.cancel()
+                    self.abandoned += 1
+        return result, shared
+
+    def _forget(self, key: str, task: "asyncio.Future[Any]") -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+            self._deadlines.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.leaders + self.coalesced
+        return {
+            "in_flight": len(self._in_flight),
+            "upstream_calls": self.leaders,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+            "coalesced_ratio": round(self.coalesced / total, 4) if total else 0.0,
+        }
+
+
+# 全局实例
+guess_flight = SingleFlight("guess")
+sketch_flight = SingleFlight("sketch")
@@ -2,30 +2,112 @@
 简笔画生成和分解服务
 整合文本生成图片和笔画分解功能
 """
+import asyncio
 import base64
+import json
 import cv2
 import numpy as np
-from typing import List, Dict, Optional
-from openai import OpenAI
+from dataclasses import dataclass
+from typing import Iterator, List, Dict, Optional, Tuple, Union
 import os
 from app.config import config
+from app.services.client_pool import client_pool
+from app.services.decompose_cache import decompose_cache, serialize_result
+from app.services.deadline import check_deadline
+from app.services.image_utils import BytesLike, decode_base64_image, image_buffer
+from app.services.resilience import guarded_call
 from app._config.grid_dimensions import GRID_DIMENSIONS_MAP
 
+# 笔画线宽，与 create_progressive_images 中 drawContours 的 thickness 一致
+STROKE_THICKNESS = 2
+
+# png: 每一步一张完整 PNG（默认，兼容旧版前端）
+# polyline / svg: 每一步为简化后的折线坐标或 SVG path，由客户端自行绘制
+# delta: 每一步只给出本步改动区域的裁剪图及其偏移，由客户端叠加到画布上
+# grid: 仅用于分割模式（sort_method='split'），返回一张原图 + 网格 + 揭示顺序，由客户端依次揭示
+OUTPUT_FORMATS = ("png", "polyline", "svg", "delta", "grid")
+# 分割模式没有轮廓，只支持逐步 PNG 与 grid
+SPLIT_OUTPUT_FORMATS = ("png", "grid")
+
+# 增量图块的编码：png 为 1 位 PNG（画布只有黑白两色，无损），webp 为无损 WebP
+STEP_CODECS = {"png": "image/png", "webp": "image/webp"}
+
+
+@dataclass(frozen=True)
+class DecomposeOptions:
+    """分解结果的输出形式"""
+    output_format: str = "png"
+    # approxPolyDP 的容差（像素），越大折线越简化
+    tolerance: float = 1.0
+    # 增量图块的编码与 PNG 压缩级别（0-9）；无损 WebP 没有可调的级别
+    codec: str = "png"
+    level: int = 6
+    # 分割模式揭示顺序的随机种子；为空时每次随机
+    seed: Optional[int] = None
+
+
+def encode_image(image: np.ndarray, codec: str = "png", level: int = 6, bilevel: bool = False) -> str:
+    """
+    把图片编码为 data URL
+
+    Args:
+        image: 图片（灰度或彩色）
+        codec: 'png' 或 'webp'（无损）
+        level: PNG 压缩级别
+        bilevel: 图片只有黑白两色时输出 1 位 PNG
+    """
+    if codec == "webp":
+        # 质量大于 100 时 OpenCV 使用无损压缩
+        ok, buffer = cv2.imencode('.webp', image, [cv2.IMWRITE_WEBP_QUALITY, 101])
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, level]
+        if bilevel:
+            params += [cv2.IMWRITE_PNG_BILEVEL, 1]
+        ok, buffer = cv2.imencode('.png', image, params)
+    if not ok:
+        raise ValueError(f"图片编码失败: {codec}")
+    return f"data:{STEP_CODECS[codec]};base64,{base64.b64encode(buffer).decode('utf-8')}"
+
+
+def check_output_format(sort_method: str, output_format: str) -> None:
+    """输出格式与排序方法不匹配时抛出 ValueError"""
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"不支持的输出格式: {output_format}")
+    if sort_method == "split" and output_format not in SPLIT_OUTPUT_FORMATS:
+        raise ValueError(f"分割模式不支持输出格式 {output_format}，请使用 png 或 grid")
+    if sort_method != "split" and output_format == "grid":
+        raise ValueError("grid 输出格式仅适用于分割模式（sort_method='split'）")
+
 
 class SketchService:
     """简笔画服务类"""
     
-    def generate_image(self, prompt: str, config: Optional[Dict[str, str]] = None) -> bytes:
+    async def generate_image_async(self, prompt: str, config: Optional[Dict[str, str]] = None) -> bytes:
         """
-        根据文本提示生成图片
-        
+        根据文本提示生成图片：使用异步客户端，调用者取消时上游请求随之断开
+
         Args:
             prompt: 文本提示
             config: 可选的配置字典，包含 'url', 'key', 'model'
-            
+
         Returns:
             图片二进制数据
         """
+        url, key, model = self._image_config(config)
+
+        async with client_pool.client(url, key) as client:
+            with guarded_call(url, "sketch") as timeout:
+                images_base64 = await client.images.generate(
+                    prompt=prompt,
+                    model=model,
+                    response_format="b64_json",
+                    timeout=timeout,
+                )
+
+        return base64.b64decode(images_base64.data[0].b64_json)
+
+    @staticmethod
+    def _image_config(config: Optional[Dict[str, str]]) -> tuple[str, str, str]:
         if not config:
             raise ValueError(
                 "Image generation config is required. "
@@ -44,19 +126,7 @@ class SketchService:
                 "Invalid image generation config. "
                 "Please ensure 'url', 'key', and 'model' are all configured."
             )
-        
-        # 创建客户端
-        client = OpenAI(api_key=key, base_url=url)
-        
-        images_base64 = client.images.generate(
-            prompt=prompt, 
-            model=model, 
-            response_format="b64_json"
-        )
-        
-        # 获取第一张图片
-        image_data = base64.b64decode(images_base64.data[0].b64_json)
-        return image_data
+        return url, key, model
     
     def convert_to_sketch(self, image_array: np.ndarray) -> np.ndarray:
         """
@@ -203,74 +273,157 @@ class SketchService:
         
         return best_pair
     
-    def create_split_grid(self, image: np.ndarray, rows: int = 5, cols: int = 4) -> List[np.ndarray]:
-        # 处理不同通道数的图片
-        if len(image.shape) == 3:
-            height, width, _ = image.shape
-        else:
-            height, width = image.shape
-        
+    @staticmethod
+    def split_grid_boxes(height: int, width: int, rows: int = 5, cols: int = 4) -> List[Tuple[int, int, int, int]]:
+        """
+        按行优先顺序返回每个网格块的 (x, y, w, h)，最后一行/列包含除不尽的余量
+        """
         block_height = height // rows
         block_width = width // cols
-        
-        blocks = []
-        
-        # 创建所有网格块
+        boxes = []
         for i in range(rows):
             for j in range(cols):
                 y_start = i * block_height
                 y_end = (i + 1) * block_height if i < rows - 1 else height
                 x_start = j * block_width
                 x_end = (j + 1) * block_width if j < cols - 1 else width
-                
-                # 提取当前块
-                block = image[y_start:y_end, x_start:x_end].copy()
-                blocks.append(block)
-        
-        return blocks
+                boxes.append((x_start, y_start, x_end - x_start, y_end - y_start))
+        return boxes
+
+    @staticmethod
+    def split_order(total_blocks: int, seed: Optional[int] = None) -> np.ndarray:
+        """网格块的揭示顺序；给定种子时结果可复现"""
+        if seed is None:
+            return np.random.permutation(total_blocks)
+        return np.random.RandomState(seed).permutation(total_blocks)
+
+    def create_split_grid(self, image: np.ndarray, rows: int = 5, cols: int = 4) -> List[np.ndarray]:
+        # 返回原图上的视图而不是副本：原图本身已经包含所有块
+        height, width = image.shape[:2]
+        return [image[y:y + h, x:x + w] for x, y, w, h in self.split_grid_boxes(height, width, rows, cols)]
     
     def create_progressive_images(
         self, 
         sketch: np.ndarray, 
-        contour_groups: List[List[np.ndarray]]
-    ) -> List[str]:
+        contour_groups: List[List[np.ndarray]],
+        delta: bool = False,
+        codec: str = "png",
+        level: int = 6
+    ) -> List[Union[str, Dict]]:
+        """创建渐进式笔画图片，参数见 iter_progressive_images"""
+        return list(self.iter_progressive_images(sketch, contour_groups, delta, codec, level))
+
+    def iter_progressive_images(
+        self,
+        sketch: np.ndarray,
+        contour_groups: List[List[np.ndarray]],
+        delta: bool = False,
+        codec: str = "png",
+        level: int = 6
+    ) -> Iterator[Union[str, Dict]]:
         """
-        创建渐进式笔画图片
+        逐步生成渐进式笔画图片，每绘制完一组轮廓产出一步
         
         Args:
             sketch: 原始简笔画
             contour_groups: 分组的轮廓列表
+            delta: 为 True 时每一步只编码本组轮廓包围盒内的累积画布，
+                   返回 {"x", "y", "w", "h", "image"}，编码量与改动区域成正比
+            codec: 增量图块的编码（'png' 或 'webp'）
+            level: PNG 压缩级别
             
-        Returns:
-            base64编码的图片列表
+        Yields:
+            base64编码的图片，或增量图块
         """
         height, width = sketch.shape
         canvas = np.ones((height, width), dtype=np.uint8) * 255
         
-        progressive_images = []
-        
         for group in contour_groups:
+            check_deadline("sketch_steps")
             # 在画布上绘制当前组的所有笔画
             for contour in group:
-                cv2.drawContours(canvas, [contour], -1, (0, 0, 0), thickness=2)
+                cv2.drawContours(canvas, [contour], -1, (0, 0, 0), thickness=STROKE_THICKNESS)
+
+            if delta:
+                # 轮廓包围盒向外扩展线宽，覆盖粗线落在轮廓点之外的像素；
+                # 裁剪的是累积画布，与之前步骤重叠的笔画也保留在图块中
+                points = np.concatenate(group).reshape(-1, 2)
+                x0, y0 = np.maximum(points.min(axis=0) - STROKE_THICKNESS, 0)
+                x1, y1 = np.minimum(points.max(axis=0) + STROKE_THICKNESS + 1, (width, height))
+                yield {
+                    "x": int(x0),
+                    "y": int(y0),
+                    "w": int(x1 - x0),
+                    "h": int(y1 - y0),
+                    "image": encode_image(canvas[y0:y1, x0:x1], codec, level, bilevel=True),
+                }
+                continue
             
             # 将当前状态编码为base64
             _, buffer = cv2.imencode('.png', canvas.copy())
             image_base64 = base64.b64encode(buffer).decode('utf-8')
-            progressive_images.append(f"data:image/png;base64,{image_base64}")
-        
-        return progressive_images
+            yield f"data:image/png;base64,{image_base64}"
+
+    def iter_vector_steps(
+        self,
+        contour_groups: List[List[np.ndarray]],
+        tolerance: float = 1.0,
+        output_format: str = "polyline"
+    ) -> Iterator[Dict]:
+        """
+        逐步把轮廓简化为闭合折线，不再逐步编码图片
+
+        Args:
+            contour_groups: 分组的轮廓列表
+            tolerance: approxPolyDP 容差（像素）
+            output_format: 'polyline' 输出扁平坐标 [x0, y0, x1, y1, ...]，'svg' 输出 path 数据
+
+        Yields:
+            每一步一个字典：{"polylines": [...]} 或 {"path": "M..Z"}
+        """
+        for group in contour_groups:
+            check_deadline("sketch_steps")
+            polylines = [
+                cv2.approxPolyDP(contour, tolerance, True).reshape(-1, 2) if tolerance > 0 else contour.reshape(-1, 2)
+                for contour in group
+            ]
+            if output_format == "svg":
+                path = "".join(
+                    "M" + "L".join(f"{x} {y}" for x, y in polyline.tolist()) + "Z" for polyline in polylines
+                )
+                yield {"path": path}
+            else:
+                yield {"polylines": [polyline.ravel().tolist() for polyline in polylines]}
     
-    def create_progressive_split_images(self, image: np.ndarray, blocks: List[np.ndarray], rows: int = 5, cols: int = 4) -> List[str]:
+    def create_progressive_split_images(
+        self,
+        image: np.ndarray,
+        blocks: List[np.ndarray],
+        rows: int = 5,
+        cols: int = 4,
+        seed: Optional[int] = None
+    ) -> List[str]:
+        """创建基于网格分割的渐进式图片，参数见 iter_progressive_split_images"""
+        return list(self.iter_progressive_split_images(image, blocks, rows, cols, seed))
+
+    def iter_progressive_split_images(
+        self,
+        image: np.ndarray,
+        blocks: List[np.ndarray],
+        rows: int = 5,
+        cols: int = 4,
+        seed: Optional[int] = None
+    ) -> Iterator[str]:
         """
-        创建基于网格分割的渐进式图片
+        逐步生成基于网格分割的渐进式图片
         
         Args:
             image: 原始图片（可以是彩色或灰度）
             blocks: 随机顺序的图片块列表
+            seed: 揭示顺序的随机种子
             
-        Returns:
-            base64编码的图片列表
+        Yields:
+            base64编码的图片
         """
         # 处理不同通道数的图片
         if len(image.shape) == 3:
@@ -284,69 +437,58 @@ class SketchService:
         else:
             canvas = np.ones((height, width), dtype=image.dtype) * 255
         
-        progressive_images = []
-        block_height = height // rows
-        block_width = width // cols
+        boxes = self.split_grid_boxes(height, width, rows, cols)
         # 生成图片id的随机序列
-        random_indices = np.random.permutation(len(blocks))
+        random_indices = self.split_order(len(blocks), seed)
         
         for step_index in range(len(blocks)):
+            check_deadline("sketch_steps")
             # 获取当前步骤要显示的块索引
             block_index = random_indices[step_index]
-            block = blocks[block_index]
-            row = block_index // cols
-            col = block_index % cols
-            
-            y_start = row * block_height
-            y_end = (row + 1) * block_height if row < rows - 1 else height
-            x_start = col * block_width
-            x_end = (col + 1) * block_width if col < cols - 1 else width
+            x, y, w, h = boxes[block_index]
             
             # 将块复制到画布的对应位置
-            canvas[y_start:y_end, x_start:x_end] = block
+            canvas[y:y + h, x:x + w] = blocks[block_index]
             
             # 将当前状态编码为base64
             _, buffer = cv2.imencode('.png', canvas.copy())
             image_base64 = base64.b64encode(buffer).decode('utf-8')
-            progressive_images.append(f"data:image/png;base64,{image_base64}")
-        
-        return progressive_images
+            yield f"data:image/png;base64,{image_base64}"
     
-    def generate_and_decompose(
-        self, 
-        prompt: str, 
+    async def generate_and_decompose_async(
+        self,
+        prompt: str,
         max_steps: int = 20,
         sort_method: str = "position",
-        config: Optional[Dict[str, str]] = None
+        config: Optional[Dict[str, str]] = None,
+        options: Optional[DecomposeOptions] = None
     ) -> Dict:
         """
-        生成图片并分解为简笔画步骤
-        
+        生成图片并分解为简笔画步骤：生成阶段可以随请求取消，分解阶段放到线程中执行，
+        在各步骤之间检查截止时间；新生成的图片不使用分解缓存
+
         Args:
             prompt: 文本提示
             max_steps: 最大步数
             sort_method: 排序方法 ('area', 'position', 或 'split')
             config: 可选的配置字典，包含 'url', 'key', 'model'
-            
+            options: 输出形式，默认每一步一张 PNG
+
         Returns:
             包含完整简笔画和步骤列表的字典
         """
-        # 1. 生成图片
-        image_data = self.generate_image(prompt, config)
-        
-        # 2. 读取图片
-        image_array = cv2.imdecode(
-            np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR
+        image_data = await self.generate_image_async(prompt, config)
+        check_deadline("decompose")
+        return await asyncio.to_thread(
+            self.decompose_image_bytes, image_data, max_steps, sort_method, options, cache=False
         )
-        
-        # 3. 分解图片
-        return self._decompose_image_array(image_array, max_steps, sort_method)
     
     def decompose_existing_image(
         self,
         image_base64: str,
         max_steps: int = 20,
-        sort_method: str = "position"
+        sort_method: str = "position",
+        options: Optional[DecomposeOptions] = None
     ) -> Dict:
         """
         分解已有的图片为简笔画步骤
@@ -355,77 +497,217 @@ class SketchService:
             image_base64: base64编码的图片
             max_steps: 最大步数
             sort_method: 排序方法 ('area', 'position', 或 'split')
+            options: 输出形式，默认每一步一张 PNG
             
         Returns:
             包含完整简笔画和步骤列表的字典
         """
         # 1. 解码base64图片
-        if image_base64.startswith('data:image'):
-            image_base64 = image_base64.split(',')[1]
-        
-        image_data = base64.b64decode(image_base64)
-        
-        # 2. 读取图片
-        image_array = cv2.imdecode(
-            np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR
-        )
-        
-        # 3. 分解图片
-        return self._decompose_image_array(image_array, max_steps, sort_method)
+        image_data = decode_base64_image(image_base64)
+
+        # 2. 读取并分解图片
+        return self.decompose_image_bytes(image_data, max_steps, sort_method, options)
+
+    def decompose_image_bytes(
+        self,
+        image_data: BytesLike,
+        max_steps: int = 20,
+        sort_method: str = "position",
+        options: Optional[DecomposeOptions] = None,
+        cache: bool = True
+    ) -> Dict:
+        """
+        分解二进制图片为简笔画步骤，数据直接交给 cv2 解码，不经过 base64
+
+        Args:
+            image_data: 图片二进制数据
+            max_steps: 最大步数
+            sort_method: 排序方法 ('area', 'position', 或 'split')
+            options: 输出形式，默认每一步一张 PNG
+            cache: 是否使用分解缓存
+
+        Returns:
+            包含完整简笔画和步骤列表的字典
+        """
+        return self._decompose_image_array(self.decode_image(image_data), max_steps, sort_method, options, cache)
+
+    @staticmethod
+    def decode_image(image_data: BytesLike) -> np.ndarray:
+        image_array = cv2.imdecode(image_buffer(image_data), cv2.IMREAD_COLOR)
+        if image_array is None:
+            raise ValueError("无法解码图片")
+        return image_array
 
     def _decompose_image_array(
         self,
         image_array: np.ndarray,
         max_steps: int = 20,
-        sort_method: str = "position"
+        sort_method: str = "position",
+        options: Optional[DecomposeOptions] = None,
+        cache: bool = True
     ) -> Dict:
         """
-        分解图片数组为简笔画步骤（内部方法）
+        分解图片数组为简笔画步骤（内部方法），收集 iter_decomposition 的全部输出
         
         Args:
             image_array: 图片数组
             max_steps: 最大步数
             sort_method: 排序方法
+            options: 输出形式，默认每一步一张 PNG
+            cache: 是否使用分解缓存
             
         Returns:
             包含分解结果的字典
         """
+        events = self.iter_decomposition(image_array, max_steps, sort_method, options, cache)
+        _, meta = next(events)
+        steps = [step for _, step in events]
+        return self._assemble_result(meta, steps)
+
+    @staticmethod
+    def _assemble_result(meta: Dict, steps: List) -> Dict:
+        return {"final_sketch": meta["final_sketch"], "steps": steps,
+                **{key: value for key, value in meta.items() if key != "final_sketch"}}
+
+    def iter_decomposition(
+        self,
+        image_array: np.ndarray,
+        max_steps: int = 20,
+        sort_method: str = "position",
+        options: Optional[DecomposeOptions] = None,
+        cache: bool = True
+    ) -> Iterator[Tuple[str, Dict]]:
+        """
+        逐步分解图片：先产出 ("meta", {final_sketch, total_steps, original_contours, ...})，
+        再每渲染完一步产出一次 ("step", 步骤)，流式接口据此边渲染边发送
+
+        相同像素与参数的结果从分解缓存中读取；完整产出后以紧凑 JSON 写入缓存
+
+        Args:
+            image_array: 图片数组
+            max_steps: 最大步数
+            sort_method: 排序方法
+            options: 输出形式，默认每一步一张 PNG
+            cache: 是否使用分解缓存；刚生成的图片不会再次出现，生成路径传 False
+        """
+        options = options or DecomposeOptions()
+        cache_key = None
+        if cache and decompose_cache.enabled:
+            cache_key = decompose_cache.make_key(image_array, max_steps, sort_method, options)
+        cached = decompose_cache.get(cache_key)
+        if cached is not None:
+            result = json.loads(cached)
+            steps = result.pop("steps")
+            print(f"🗂️ 分解缓存命中: {len(steps)} 步, {len(cached)} 字节")
+            yield "meta", result
+            for step in steps:
+                yield "step", step
+            return
+
+        events = self._iter_decomposition(image_array, max_steps, sort_method, options)
+        if cache_key is None:
+            yield from events
+            return
+        _, meta = next(events)
+        yield "meta", meta
+        steps = []
+        for _, step in events:
+            steps.append(step)
+            yield "step", step
+        # 只缓存完整的结果：中途取消或超时时生成器不会执行到这里
+        decompose_cache.put(cache_key, serialize_result(self._assemble_result(meta, steps)))
+
+    def _iter_decomposition(
+        self,
+        image_array: np.ndarray,
+        max_steps: int,
+        sort_method: str,
+        options: DecomposeOptions
+    ) -> Iterator[Tuple[str, Dict]]:
+        check_output_format(sort_method, options.output_format)
+        if options.codec not in STEP_CODECS:
+            raise ValueError(f"不支持的图块编码: {options.codec}")
+        check_deadline("decompose")
         # 根据排序方法处理
-        if sort_method == "split":
+        if sort_method == "split" and options.output_format == "grid":
+            # 只编码一次原图，客户端按 order 依次揭示网格块，不再逐步编码整张画布
+            rows, cols = self.find_best_grid_dimensions(max_steps)
+            height, width = image_array.shape[:2]
+            boxes = self.split_grid_boxes(height, width, rows, cols)
+            order = self.split_order(len(boxes), options.seed).tolist()
+            yield "meta", {
+                "final_sketch": encode_image(image_array, options.codec, options.level),
+                "total_steps": len(boxes),
+                "original_contours": len(boxes),
+                "format": "grid",
+                "width": width,
+                "height": height,
+                "grid": {"rows": rows, "cols": cols},
+                "order": order,
+            }
+            for index in order:
+                x, y, w, h = boxes[index]
+                yield "step", {"tile": index, "x": x, "y": y, "w": w, "h": h}
+        elif sort_method == "split":
             # 根据max_steps计算最佳的行列数
             rows, cols = self.find_best_grid_dimensions(max_steps)
             # 分割成网格
             blocks = self.create_split_grid(image_array, rows, cols)
-            # 创建渐进式图片
-            progressive_images = self.create_progressive_split_images(image_array, blocks, rows, cols)
-            original_contours = len(blocks)  # 网格块数
 
             _, buffer = cv2.imencode('.png', image_array)
             final_sketch_base64 = base64.b64encode(buffer).decode('utf-8')
+            yield "meta", {
+                "final_sketch": f"data:image/png;base64,{final_sketch_base64}",
+                "total_steps": len(blocks),
+                "original_contours": len(blocks),  # 网格块数
+            }
+            # 创建渐进式图片
+            for image in self.iter_progressive_split_images(image_array, blocks, rows, cols, options.seed):
+                yield "step", image
         else:
             # 转换为简笔画
             sketch = self.convert_to_sketch(image_array)
 
             # 提取轮廓
+            check_deadline("decompose")
             contours = self.extract_contours(sketch, sort_method)
             
             # 合并轮廓以限制步数
             contour_groups = self.merge_contours(contours, max_steps)
+            height, width = sketch.shape
             
-            # 创建渐进式图片
-            progressive_images = self.create_progressive_images(sketch, contour_groups)
-            original_contours = len(contours)
+            if options.output_format in ("polyline", "svg"):
+                # 矢量输出：客户端按折线逐步绘制，无需逐步编码图片
+                steps = self.iter_vector_steps(contour_groups, options.tolerance, options.output_format)
+                extra = {
+                    "format": options.output_format,
+                    "width": width,
+                    "height": height,
+                    "stroke_width": STROKE_THICKNESS,
+                    "closed": True,
+                }
+            elif options.output_format == "delta":
+                # 增量图块：客户端从白色画布开始，按步把图块贴到 (x, y)
+                steps = self.iter_progressive_images(
+                    sketch, contour_groups, delta=True, codec=options.codec, level=options.level
+                )
+                extra = {"format": "delta", "width": width, "height": height, "codec": options.codec}
+            else:
+                # 创建渐进式图片
+                steps = self.iter_progressive_images(sketch, contour_groups)
+                extra = {}
 
             # 获取完整简笔画的base64
             _, buffer = cv2.imencode('.png', sketch)
             final_sketch_base64 = base64.b64encode(buffer).decode('utf-8')
-
-        return {
-            "final_sketch": f"data:image/png;base64,{final_sketch_base64}",
-            "steps": progressive_images,
-            "total_steps": len(progressive_images),
-            "original_contours": original_contours
-        }
+            yield "meta", {
+                "final_sketch": f"data:image/png;base64,{final_sketch_base64}",
+                "total_steps": len(contour_groups),
+                "original_contours": len(contours),
+                **extra
+            }
+            for step in steps:
+                yield "step", step
 
 # 全局实例
 sketch_service = SketchService()
@@ -0,0 +1,164 @@
+"""
+笔画光栅化
+把画板的矢量笔画（点序列 + 线宽）绘制成灰度位图：白底黑线，与画板导出的 PNG 一致
+"""
+import hashlib
+import json
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# polylines 的定点小数位数，保留亚像素精度
+_SHIFT = 4
+_SCALE = 1 << _SHIFT
+
+INK = 0
+BACKGROUND = 255
+
+
+def _stroke_points(stroke: Dict[str, Any]) -> np.ndarray:
+    # 点序列既可以是 [[x, y], ...]，也可以是扁平的 [x0, y0, x1, y1, ...]
+    return np.asarray(stroke.get("points") or [], dtype=np.float32).reshape(-1, 2)
+
+
+def draw_stroke(
+    canvas: np.ndarray,
+    stroke: Dict[str, Any],
+    scale: float = 1.0,
+    offset: Tuple[float, float] = (0.0, 0.0),
+) -> None:
+    """
+    在灰度画布上绘制一笔
+
+    Args:
+        canvas: 灰度画布（原地修改）
+        stroke: {"points": [[x, y], ...], "width": 线宽, "erase": 是否为橡皮擦}
+        scale: 坐标与线宽的缩放比例
+        offset: 缩放后再叠加的平移量
+    """
+    points = _stroke_points(stroke)
+    if not len(points):
+        return
+    color = BACKGROUND if stroke.get("erase") else INK
+    thickness = max(1, int(round(float(stroke.get("width") or 1) * scale)))
+    fixed = np.round((points * scale + np.asarray(offset, dtype=np.float32)) * _SCALE).astype(np.int32)
+    if len(fixed) == 1:
+        cv2.circle(canvas, tuple(int(v) for v in fixed[0]), max(1, thickness // 2) * _SCALE, color, -1,
+                   cv2.LINE_AA, _SHIFT)
+        return
+    cv2.polylines(canvas, [fixed.reshape(-1, 1, 2)], False, color, thickness, cv2.LINE_AA, _SHIFT)
+
+
+class StrokeCanvas:
+    """按增量笔画累积绘制的灰度画布"""
+
+    def __init__(self, width: int, height: int):
+        self.width = max(1, int(width))
+        self.height = max(1, int(height))
+        self.image = np.full((self.height, self.width), BACKGROUND, dtype=np.uint8)
+        self.strokes = 0
+
+    def draw(self, strokes: Iterable[Dict[str, Any]]) -> None:
+        for stroke in strokes:
+            draw_stroke(self.image, stroke)
+            self.strokes += 1
+
+    def clear(self, width: Optional[int] = None, height: Optional[int] = None) -> None:
+        self.__init__(width or self.width, height or self.height)
+
+    def encode_png(self, image: Optional[np.ndarray] = None) -> bytes:
+        return encode_png(self.image if image is None else image)
+
+
+def encode_png(image: np.ndarray) -> bytes:
+    _, buffer = cv2.imencode('.png', image, [cv2.IMWRITE_PNG_COMPRESSION, 3])
+    return buffer.tobytes()
+
+
+@dataclass
+class StrokeDrawing:
+    """一幅以矢量笔画描述的画，width/height 为前端画板尺寸（可选）"""
+    strokes: List[Dict[str, Any]]
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+    def payload_bytes(self) -> int:
+        return len(json.dumps(self.strokes, separators=(",", ":")))
+
+
+def stroke_hash(strokes: Sequence[Dict[str, Any]]) -> str:
+    """规范化笔画（坐标保留 1 位小数）后的哈希，与点序列的书写形式无关"""
+    digest = hashlib.sha1()
+    for stroke in strokes:
+        points = np.round(_stroke_points(stroke), 1)
+        header = (float(stroke.get("width") or 1), bool(stroke.get("erase")), len(points))
+        digest.update(repr(header).encode())
+        digest.update(points.astype("<f4").tobytes())
+    return digest.hexdigest()
+
+
+def strokes_bbox(strokes: Sequence[Dict[str, Any]]) -> Optional[Tuple[float, float, float, float]]:
+    """非橡皮擦笔画的包围盒 (x0, y0, x1, y1)，计入线宽；没有笔迹时返回 None"""
+    boxes = []
+    for stroke in strokes:
+        points = _stroke_points(stroke)
+        if stroke.get("erase") or not len(points):
+            continue
+        half = float(stroke.get("width") or 1) / 2
+        boxes.append((*(points.min(axis=0) - half), *(points.max(axis=0) + half)))
+    if not boxes:
+        return None
+    box = np.asarray(boxes)
+    return float(box[:, 0].min()), float(box[:, 1].min()), float(box[:, 2].max()), float(box[:, 3].max())
+
+
+def render_drawing(drawing: StrokeDrawing, max_side: int) -> np.ndarray:
+    """按画板原始尺寸完整绘制（画廊保存用）；未提供尺寸时用笔迹包围盒，边长不超过 max_side"""
+    width, height = drawing.width, drawing.height
+    if not width or not height:
+        bbox = strokes_bbox(drawing.strokes)
+        width = int(math.ceil(bbox[2])) + 1 if bbox else 1
+        height = int(math.ceil(bbox[3])) + 1 if bbox else 1
+    canvas = StrokeCanvas(min(width, max_side), min(height, max_side))
+    canvas.draw(drawing.strokes)
+    return canvas.image
+
+
+def render_png(drawing: StrokeDrawing, max_side: int) -> bytes:
+    return encode_png(render_drawing(drawing, max_side))
+
+
+def rasterize_for_model(
+    strokes: Sequence[Dict[str, Any]],
+    patch: int,
+    max_side: int,
+    margin_ratio: float,
+) -> Tuple[np.ndarray, Optional[Tuple[float, float, float, float]]]:
+    """
+    直接在模型的目标分辨率上绘制笔迹：裁到包围盒、四周留白、最长边不超过 max_side，
+    再补白到 patch 的整数倍，省去先绘制大图再缩放的过程
+
+    Returns:
+        (灰度图, 笔迹包围盒)，没有笔迹时返回一个 patch 大小的空白图
+    """
+    bbox = strokes_bbox(strokes)
+    if bbox is None:
+        return np.full((patch, patch), BACKGROUND, dtype=np.uint8), None
+    x0, y0, x1, y1 = bbox
+    margin = max(x1 - x0, y1 - y0) * margin_ratio
+    width, height = (x1 - x0) + 2 * margin, (y1 - y0) + 2 * margin
+    # 与位图预处理一致：只缩小不放大
+    scale = min(1.0, max_side / max(width, height))
+    out_w = max(patch, int(math.ceil(width * scale / patch)) * patch)
+    out_h = max(patch, int(math.ceil(height * scale / patch)) * patch)
+    offset = (
+        (out_w - width * scale) / 2 + (margin - x0) * scale,
+        (out_h - height * scale) / 2 + (margin - y0) * scale,
+    )
+    canvas = np.full((out_h, out_w), BACKGROUND, dtype=np.uint8)
+    for stroke in strokes:
+        draw_stroke(canvas, stroke, scale, offset)
+    return canvas, bbox
@@ -0,0 +1,138 @@
+"""
+猜词结构化输出
+远程提供方使用 response_format JSON Schema，本地 llama-server 使用 GBNF 语法约束，
+模型只能生成最小的 JSON 对象，解析时一次 json.loads 即可
+"""
+import json
+import threading
+from typing import Any, Dict, Optional, Set
+
+from ..config import config
+
+# 结构化模式下替换原有的“代码块”格式说明，输出更短
+STRUCTURED_FORMAT_INSTRUCTIONS = (
+    '请仅输出一个 JSON 对象，不要使用代码块：'
+    '{"best_guess": "最可能的词语或短语", "alternatives": ["备选答案1", "备选答案2"], "reason": "不超过20字的解释"}。'
+    "alternatives 最多 4 个，按可能性从高到低排列，如无可填空数组。"
+)
+
+GUESS_JSON_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "best_guess": {"type": "string"},
+        "alternatives": {"type": "array", "items": {"type": "string"}, "maxItems": 4},
+        "reason": {"type": "string"},
+        # 仅级联第一级会要求模型给出，见 CONFIDENCE_JSON_SCHEMA
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+    },
+    "required": ["best_guess", "alternatives", "reason"],
+    "additionalProperties": False,
+}
+
+# 与 GUESS_JSON_SCHEMA 等价的 llama.cpp 语法，限制字段顺序、候选数量与字符串长度
+GUESS_GBNF = r'''
+root       ::= "{" ws "\"best_guess\":" ws word "," ws "\"alternatives\":" ws alts "," ws "\"reason\":" ws reason confidence? ws "}"
+alts       ::= "[" ws ( word ( "," ws word ){0,3} )? ws "]"
+confidence ::= "," ws "\"confidence\":" ws ( "1" ( ".0" )? | "0" ( "." [0-9]{1,3} )? )
+word       ::= "\"" char{0,32} "\""
+reason     ::= "\"" char{0,64} "\""
+char       ::= [^"\\\x00-\x1F] | "\\" ["\\/bfnrt]
+ws         ::= [ \t\n]{0,2}
+'''.strip()
+
+# 级联第一级：没有目标词时按置信度决定是否升级，confidence 必须出现，否则每次都会升级
+CONFIDENCE_JSON_SCHEMA: Dict[str, Any] = {
+    **GUESS_JSON_SCHEMA,
+    "required": [*GUESS_JSON_SCHEMA["required"], "confidence"],
+}
+CONFIDENCE_GBNF = GUESS_GBNF.replace("reason confidence?", "reason confidence")
+
+# 结构化输出结束后不应再有任何文字
+STOP_SEQUENCES = ["```", "\n\n\n"]
+
+
+class _ProviderSupport:
+    """记录不支持 response_format / grammar 的上游，之后对它们只保留 max_tokens 和 stop"""
+
+    def __init__(self) -> None:
+        self._unsupported: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def supports(self, base_url: str) -> bool:
+        with self._lock:
+            return (base_url or "").rstrip("/") not in self._unsupported
+
+    def mark_unsupported(self, base_url: str) -> None:
+        with self._lock:
+            self._unsupported.add((base_url or "").rstrip("/"))
+        print(f"⚠️ 上游不支持结构化输出，已回退到普通模式: {base_url}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"unsupported": sorted(self._unsupported)}
+
+
+provider_support = _ProviderSupport()
+
+
+def structured_enabled(provider: str, is_local: bool) -> bool:
+    """服务器端提供方与本地 llama-server 启用结构化输出；自定义远程端点能力未知，保持原样"""
+    return config.GUESS_STRUCTURED_OUTPUT and (provider == "server" or is_local)
+
+
+def structured_request_kwargs(base_url: str, is_local: bool, require_confidence: bool = False) -> Dict[str, Any]:
+    """
+    构造 chat.completions.create 的额外参数
+
+    Args:
+        base_url: 上游地址
+        is_local: 是否为本地 llama-server
+        require_confidence: 级联第一级调用，要求输出 confidence 字段
+
+    Returns:
+        max_tokens、stop，以及约束输出格式的 response_format 或 extra_body.grammar
+    """
+    kwargs: Dict[str, Any] = {
+        "max_tokens": config.GUESS_MAX_TOKENS,
+        "stop": STOP_SEQUENCES,
+    }
+    if not provider_support.supports(base_url):
+        return kwargs
+    if is_local:
+        kwargs["extra_body"] = {"grammar": CONFIDENCE_GBNF if require_confidence else GUESS_GBNF}
+    else:
+        schema = CONFIDENCE_JSON_SCHEMA if require_confidence else GUESS_JSON_SCHEMA
+        kwargs["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "drawing_guess", "schema": schema, "strict": False},
+        }
+    return kwargs
+
+
+def has_format_constraint(kwargs: Dict[str, Any]) -> bool:
+    return "response_format" in kwargs or "grammar" in kwargs.get("extra_body", {})
+
+
+def names_format_constraint(exc: Exception) -> bool:
+    """400 错误信息是否明确指向格式约束参数"""
+    message = str(exc).lower()
+    return any(name in message for name in ("response_format", "grammar", "json_schema"))
+
+
+def without_format_constraint(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """去掉格式约束，保留 extra_body 中的其他字段（如 cache_prompt）"""
+    stripped = {key: value for key, value in kwargs.items() if key != "response_format"}
+    if "extra_body" in stripped:
+        stripped["extra_body"] = {k: v for k, v in stripped["extra_body"].items() if k != "grammar"}
+    return stripped
+
+
+def parse_structured(text: Any) -> Optional[Dict[str, Any]]:
+    """结构化输出直接 json.loads；失败时返回 None，由调用方走兼容解析"""
+    if not isinstance(text, str):
+        return None
+    try:
+        payload = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return payload if isinstance(payload, dict) else None
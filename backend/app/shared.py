@@ -1,6 +1,20 @@
+import asyncio
+import hashlib
+import json
 from datetime import datetime, timedelta
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
 from .database import SessionLocal, User, UserSession, hash_password
+from .models.schemas import Stroke
 from .config import config
+from .services.admission import AdmissionRejected
+from .services.deadline import DEADLINE_HEADER, Deadline, DeadlineExceeded, current_deadline, deadline_stats
+from .services.idempotency import IdempotencyConflict, idempotency_store
+from .services.image_utils import ImageTooLarge, read_image_stream
+from .services.rate_limit import RateLimited, rate_limiter
+from .services.resilience import CircuitOpenError
+from .services.stroke_raster import StrokeDrawing
 
 # Gallery configuration
 GALLERY_DIR = config.GALLERY_DIR
@@ -63,6 +77,31 @@ def get_user_by_session(session_id: str):
         db.close()
 
 
+def deduct_user_call(session_id: str):
+    """扣除会话对应用户的一个调用点数，返回剩余点数；找不到用户或失败时返回 None"""
+    db = SessionLocal()
+    try:
+        # 在当前数据库会话中重新获取用户对象
+        session_record = db.query(UserSession).filter(UserSession.session_id == session_id).first()
+        if not session_record:
+            print(f"❌ 无法找到会话记录")
+            return None
+        user_in_db = db.query(User).filter(User.id == session_record.user_id).first()
+        if not user_in_db:
+            print(f"❌ 无法找到用户记录")
+            return None
+        user_in_db.calls_remaining -= 1
+        db.commit()
+        print(f"🔹 用户 {user_in_db.username} 服务器调用成功，剩余点数: {user_in_db.calls_remaining}")
+        return user_in_db.calls_remaining
+    except Exception as e:
+        db.rollback()
+        print(f"❌ 扣除点数失败: {e}")
+        return None
+    finally:
+        db.close()
+
+
 def update_session_activity(session_id: str) -> None:
     db = SessionLocal()
     try:
@@ -109,3 +148,301 @@ def get_user_info(session_id: str):
             "last_login": user.last_login
         }
     return None
+
+
+async def read_upload(request: Request) -> bytes:
+    """读取二进制上传（application/octet-stream）的请求体，超过 IMAGE_UPLOAD_MAX_BYTES 时返回 413"""
+    try:
+        return await read_image_stream(
+            request.stream(), config.IMAGE_UPLOAD_MAX_BYTES, request.headers.get("content-length")
+        )
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
+def stroke_drawing(strokes: list, width: int | None = None, height: int | None = None) -> StrokeDrawing:
+    """把请求中的笔画转换为 StrokeDrawing，格式错误时返回 422，点数或画板尺寸超限时返回 413"""
+    try:
+        # 边画边猜的消息是原始 JSON，同样按 Stroke 校验点序列形状与线宽
+        strokes = [(stroke if isinstance(stroke, Stroke) else Stroke.model_validate(stroke)).model_dump()
+                   for stroke in strokes]
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid strokes: {e.errors(include_url=False)}")
+    # 扁平点序列每个点占两个数
+    points = sum(
+        len(s["points"]) // (1 if isinstance(s["points"][0], list) else 2) for s in strokes if s.get("points")
+    )
+    if points > config.STROKE_MAX_POINTS:
+        raise HTTPException(status_code=413, detail=f"Too many stroke points: {points} > {config.STROKE_MAX_POINTS}")
+    if max(width or 0, height or 0) > config.STROKE_MAX_CANVAS_SIDE:
+        raise HTTPException(status_code=413, detail=f"Canvas too large: max side {config.STROKE_MAX_CANVAS_SIDE}")
+    return StrokeDrawing(strokes, width, height)
+
+
+def client_ip(request: Request) -> str | None:
+    """
+    客户端 IP；在反向代理后时取 X-Forwarded-For 中由可信代理追加的地址（从右数第
+    RATE_LIMIT_TRUSTED_PROXIES 个），左侧的条目由客户端任意填写，不能用于限流
+    """
+    if config.RATE_LIMIT_TRUST_FORWARDED:
+        hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        trusted = max(1, config.RATE_LIMIT_TRUSTED_PROXIES)
+        if len(hops) >= trusted:
+            return hops[-trusted]
+    return request.client.host if request.client else None
+
+
+async def request_session_id(request: Request) -> str | None:
+    """按请求头、查询参数、JSON 请求体的顺序查找 session_id；二进制上传不读取请求体"""
+    session_id = (
+        request.headers.get("session-id")
+        or request.headers.get("x-session-id")
+        or request.query_params.get("session_id")
+    )
+    if session_id or "application/json" not in request.headers.get("content-type", ""):
+        return session_id
+    try:
+        # FastAPI 会缓存已解析的请求体，这里读取不会影响路由参数
+        body = await request.json()
+    except Exception:
+        return None
+    return body.get("session_id") if isinstance(body, dict) else None
+
+
+def rate_limit(policy: str):
+    """
+    按会话和客户端 IP 限流的路由依赖，用法：dependencies=[Depends(rate_limit("guess"))]
+
+    令牌不足时返回 429 并带上 Retry-After
+    """
+    async def dependency(request: Request) -> None:
+        if not config.RATE_LIMIT_ENABLED:
+            return
+        try:
+            rate_limiter.check(policy, await request_session_id(request), client_ip(request))
+        except RateLimited as e:
+            print(f"🚦 限流: {policy}/{e.scope}, {e.retry_after} 秒后重试")
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    return dependency
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    # 请求体已读完，之后 receive() 只会在客户端断开时返回 http.disconnect
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def run_with_deadline(request: Request, route: str, factory, cancel_on_disconnect: bool = True):
+    """
+    在请求截止时间内执行 factory()，客户端断开或截止时间到达时取消
+
+    截止时间来自 X-Request-Timeout 请求头或路由默认值，通过 contextvar 传给上游调用与分解流程。
+    必须在读完请求体之后调用。超时返回 504，客户端已断开返回 499；
+    cancel_on_disconnect 为 False 时（带幂等键的请求）断开后继续执行到截止时间，结果留给重试重放
+    """
+    deadline = Deadline.for_route(route, request.headers.get(DEADLINE_HEADER))
+    token = current_deadline.set(deadline)
+    try:
+        # 任务创建时复制当前上下文，截止时间随之传入
+        task = asyncio.ensure_future(factory())
+    finally:
+        current_deadline.reset(token)
+    waiters = {task}
+    disconnect = None
+    if cancel_on_disconnect:
+        disconnect = asyncio.ensure_future(_wait_for_disconnect(request))
+        waiters.add(disconnect)
+    try:
+        done, _ = await asyncio.wait(waiters, timeout=deadline.remaining(), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        if disconnect is not None:
+            disconnect.cancel()
+
+    if task in done:
+        try:
+            result = task.result()
+        except DeadlineExceeded as e:
+            deadline_stats.record(route, expired=True)
+            raise HTTPException(status_code=504, detail=str(e))
+        deadline_stats.record(route)
+        return result
+
+    # 通知线程中的计算在下一个检查点停止，并取消异步调用链
+    deadline.cancel()
+    task.cancel()
+    if disconnect is not None and disconnect in done:
+        deadline_stats.record(route, disconnected=True)
+        print(f"🔌 客户端已断开，取消 {route} 请求")
+        raise HTTPException(status_code=499, detail="Client closed request")
+    deadline_stats.record(route, expired=True)
+    print(f"⏱️ {route} 请求超过截止时间 {deadline.seconds:g} 秒，已取消")
+    raise HTTPException(status_code=504, detail=f"Request exceeded deadline of {deadline.seconds:g}s")
+
+
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+_STREAM_END = object()
+
+
+def _next_with_deadline(iterator, deadline: Deadline):
+    # 每次 next() 都在新的线程上下文中执行，截止时间需要在线程内设置
+    token = current_deadline.set(deadline)
+    try:
+        return next(iterator, _STREAM_END)
+    finally:
+        current_deadline.reset(token)
+
+
+async def iterate_in_thread(iterator, deadline: Deadline):
+    """
+    在线程中逐项推进同步生成器（例如 CPU 密集的分解流程），每产出一项就交回事件循环发送；
+    超过截止时间抛出 DeadlineExceeded，线程中的计算在下一个检查点停止
+    """
+    while True:
+        try:
+            item = await asyncio.wait_for(
+                asyncio.to_thread(_next_with_deadline, iterator, deadline), timeout=deadline.remaining()
+            )
+        except asyncio.TimeoutError:
+            deadline.cancel()
+            raise DeadlineExceeded("stream") from None
+        if item is _STREAM_END:
+            return
+        yield item
+
+
+async def iterate_within_deadline(iterator, deadline: Deadline, stage: str):
+    """
+    逐项推进异步生成器（例如上游的流式输出），每一项都在截止时间内完成，截止时间通过 contextvar
+    传给上游调用；超时抛出 DeadlineExceeded。迭代被取消（客户端断开）或超时时关闭生成器，释放其占用的资源
+    """
+    try:
+        while True:
+            try:
+                item = await run_within_deadline(deadline, stage, iterator.__anext__)
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        await iterator.aclose()
+
+
+async def run_within_deadline(deadline: Deadline, stage: str, factory):
+    """在给定截止时间内执行 factory()，截止时间通过 contextvar 传给上游调用；超时抛出 DeadlineExceeded"""
+    token = current_deadline.set(deadline)
+    try:
+        task = asyncio.ensure_future(factory())
+    finally:
+        current_deadline.reset(token)
+    try:
+        return await asyncio.wait_for(task, timeout=deadline.remaining())
+    except asyncio.TimeoutError:
+        deadline.cancel()
+        raise DeadlineExceeded(stage) from None
+
+
+def _stream_event(stream_format: str, event: str, payload) -> str:
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    return json.dumps({"event": event, "data": payload}, ensure_ascii=False) + "\n"
+
+
+def _stream_error(exc: Exception, error_prefix: str) -> dict:
+    if isinstance(exc, DeadlineExceeded):
+        return {"status": 504, "detail": str(exc)}
+    if isinstance(exc, HTTPException):
+        return {"status": exc.status_code, "detail": exc.detail}
+    if isinstance(exc, AdmissionRejected):
+        return {"status": 429, "detail": str(exc), "retry_after": exc.retry_after}
+    if isinstance(exc, CircuitOpenError):
+        return {"status": 503, "detail": str(exc), "retry_after": exc.retry_after}
+    return {"status": 500, "detail": f"{error_prefix}: {str(exc)}"}
+
+
+def stream_response(request: Request, route: str, stream_format: str, events, error_prefix: str) -> StreamingResponse:
+    """
+    以 NDJSON（每行 {"event", "data"}）或 SSE 发送 events(deadline) 产出的 (事件名, 数据)
+
+    截止时间来自 X-Request-Timeout 请求头或路由默认值；响应头发出后出错时发送 error 事件
+    （status/detail，可能带 retry_after），正常结束时发送 done 事件。客户端断开时取消生成器
+    """
+    deadline = Deadline.for_route(route, request.headers.get(DEADLINE_HEADER))
+
+    async def body():
+        expired = disconnected = False
+        iterator = events(deadline).__aiter__()
+        step = None
+        # 等待下一个事件时（例如上游尚未返回）响应没有写出，只有监听 receive() 才能及时发现断开
+        disconnect = asyncio.ensure_future(_wait_for_disconnect(request))
+        try:
+            while True:
+                step = asyncio.ensure_future(iterator.__anext__())
+                await asyncio.wait({step, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+                if not step.done():
+                    disconnected = True
+                    print(f"🔌 客户端已断开，取消 {route} 流式请求")
+                    return
+                try:
+                    event, payload = step.result()
+                except StopAsyncIteration:
+                    break
+                yield _stream_event(stream_format, event, payload)
+            yield _stream_event(stream_format, "done", {})
+        except asyncio.CancelledError:
+            disconnected = True
+            print(f"🔌 客户端已断开，取消 {route} 流式请求")
+            raise
+        except Exception as e:
+            error = _stream_error(e, error_prefix)
+            expired = error["status"] == 504
+            yield _stream_event(stream_format, "error", error)
+        finally:
+            disconnect.cancel()
+            if step is not None and not step.done():
+                # 取消尚未产出的下一步（上游调用、线程中的分解），再关闭生成器
+                step.cancel()
+                await asyncio.gather(step, return_exceptions=True)
+            await iterator.aclose()
+            # 通知线程中仍在进行的计算停止
+            deadline.cancel()
+            deadline_stats.record(route, expired=expired, disconnected=disconnected)
+
+    return StreamingResponse(
+        body(),
+        media_type=STREAM_MEDIA_TYPES[stream_format],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+
+
+def has_idempotency_key(request: Request) -> bool:
+    return bool(request.headers.get(IDEMPOTENCY_HEADER))
+
+
+async def idempotent(request: Request, scope: str, payload: bytes | str, factory, should_store=lambda result: True):
+    """
+    带 Idempotency-Key 请求头时保存首个成功结果并在重试时重放（响应头 Idempotent-Replayed: true）
+
+    键按路由和调用者（会话或 IP）隔离；同一个键对应不同请求内容时返回 422。没有请求头时直接执行
+    """
+    idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not idempotency_key:
+        return await factory()
+    if len(idempotency_key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key too long")
+
+    principal = await request_session_id(request) or client_ip(request) or "anonymous"
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    fingerprint = hashlib.sha256(payload).hexdigest()
+    try:
+        result, replayed = await idempotency_store.run(
+            f"{scope}:{principal}:{idempotency_key}", fingerprint, factory, should_store
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if replayed:
+        print(f"🔁 幂等重放: {scope} {idempotency_key}")
+        return JSONResponse(content=result, headers={"Idempotent-Replayed": "true"})
+    return result
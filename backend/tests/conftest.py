@@ -0,0 +1,18 @@
+"""
+测试公共配置
+导入 app 之前先指定临时 SQLite 数据库并关闭限流，测试不依赖外部服务
+
+在 backend 目录下运行: python -m pytest -q
+"""
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault(
+    "DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='drawsomething-test-'), 'test.db')}"
+)
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
@@ -0,0 +1,51 @@
+from app.services.answer_matcher import AnswerMatcher, match_answer, normalize_answer
+
+
+def test_normalize_folds_width_case_and_punctuation():
+    assert normalize_answer("  ＡＰＰＬＥ！ ") == "apple"
+    assert normalize_answer("Ping-Pong") == "ping pong"
+
+
+def test_contains_match_on_best_guess():
+    match = match_answer("苹果", ["一个红苹果", "梨"])
+
+    assert match.index == 0
+    assert match.alias == "苹果"
+    assert match.candidate == "一个红苹果"
+
+
+def test_alias_match_on_alternative():
+    match = match_answer("苹果", ["梨", "An Apple"])
+
+    assert (match.target, match.index, match.alias) == ("苹果", 1, "apple")
+
+
+def test_english_word_boundary_and_plural():
+    assert match_answer("猫", ["cats"]).alias == "cat"
+    assert match_answer("猫", ["category"]) is None
+    assert match_answer("汽车", ["two red cars"]).alias == "car"
+
+
+def test_single_character_alias_requires_exact_match():
+    assert match_answer("海洋", ["海"]).alias == "海"
+    assert match_answer("海洋", ["一个海"]).alias == "海"
+    assert match_answer("海洋", ["海豚"]) is None
+
+
+def test_earliest_candidate_wins():
+    match = match_answer("海洋", ["海豚", "海", "大海"])
+
+    assert match.index == 1
+
+
+def test_no_match_or_empty_input():
+    assert match_answer("苹果", ["香蕉", "梨"]) is None
+    assert match_answer("", ["苹果"]) is None
+    assert match_answer("苹果", [None, ""]) is None
+
+
+def test_matcher_with_several_targets_filters_by_target():
+    matcher = AnswerMatcher(["苹果", "香蕉"])
+
+    assert matcher.match(["banana"]).target == "香蕉"
+    assert matcher.match(["banana"], target="苹果") is None
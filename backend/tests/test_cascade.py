@@ -0,0 +1,21 @@
+import pytest
+
+from app.config import config
+from app.services.cascade import should_escalate
+
+
+@pytest.fixture(autouse=True)
+def min_confidence(monkeypatch):
+    monkeypatch.setattr(config, "GUESS_CASCADE_MIN_CONFIDENCE", 0.7)
+
+
+def test_target_decides_by_match():
+    assert should_escalate(True, "苹果", 0.1) == (False, "matched")
+    assert should_escalate(False, "苹果", 0.99) == (True, "mismatch")
+
+
+def test_without_target_uses_confidence():
+    assert should_escalate(False, None, None) == (True, "no_confidence")
+    assert should_escalate(False, None, 0.5) == (True, "low_confidence")
+    assert should_escalate(False, None, 0.7) == (False, "confident")
+    assert should_escalate(False, "", 0.9) == (False, "confident")
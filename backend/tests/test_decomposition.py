@@ -0,0 +1,82 @@
+import base64
+
+import cv2
+import numpy as np
+import pytest
+
+from app.services.sketch_service import DecomposeOptions, sketch_service
+
+
+def _decode(data_url: str) -> np.ndarray:
+    data = base64.b64decode(data_url.split(",", 1)[1])
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+
+
+def _drawing() -> np.ndarray:
+    image = np.full((240, 320, 3), 255, dtype=np.uint8)
+    cv2.circle(image, (90, 110), 50, (0, 0, 0), 3)
+    cv2.rectangle(image, (180, 40), (290, 150), (0, 0, 0), 3)
+    cv2.line(image, (20, 220), (300, 200), (0, 0, 0), 3)
+    return image
+
+
+def _decompose(image, sort_method, output_format, max_steps=6, **options):
+    events = list(sketch_service.iter_decomposition(
+        image, max_steps, sort_method, DecomposeOptions(output_format=output_format, **options), cache=False
+    ))
+    assert events[0][0] == "meta"
+    return events[0][1], [step for _, step in events[1:]]
+
+
+@pytest.mark.parametrize("codec", ["png", "webp"])
+def test_delta_tiles_rebuild_every_png_step(codec):
+    image = _drawing()
+    _, png_steps = _decompose(image, "position", "png")
+    meta, delta_steps = _decompose(image, "position", "delta", codec=codec)
+
+    assert meta["format"] == "delta"
+    assert len(delta_steps) == len(png_steps) == meta["total_steps"]
+    canvas = np.full((meta["height"], meta["width"]), 255, dtype=np.uint8)
+    for tile, png_step in zip(delta_steps, png_steps):
+        patch = _decode(tile["image"])
+        if patch.ndim == 3:
+            patch = cv2.cvtColor(patch, cv2.COLOR_BGR2GRAY)
+        assert patch.shape == (tile["h"], tile["w"])
+        canvas[tile["y"]:tile["y"] + tile["h"], tile["x"]:tile["x"] + tile["w"]] = patch
+        np.testing.assert_array_equal(canvas, _decode(png_step))
+
+
+def test_grid_reveal_rebuilds_image():
+    image = _drawing()
+    meta, steps = _decompose(image, "split", "grid", max_steps=12, seed=7)
+    final = _decode(meta["final_sketch"])
+    rows, cols = meta["grid"]["rows"], meta["grid"]["cols"]
+
+    assert meta["format"] == "grid"
+    assert (meta["height"], meta["width"]) == image.shape[:2]
+    assert sorted(meta["order"]) == list(range(rows * cols)) == list(range(meta["total_steps"]))
+    assert [step["tile"] for step in steps] == meta["order"]
+    np.testing.assert_array_equal(final, image)
+
+    revealed = np.zeros(image.shape[:2], dtype=int)
+    canvas = np.full_like(final, 255)
+    for step in steps:
+        x, y, w, h = step["x"], step["y"], step["w"], step["h"]
+        canvas[y:y + h, x:x + w] = final[y:y + h, x:x + w]
+        revealed[y:y + h, x:x + w] += 1
+    assert (revealed == 1).all()
+    np.testing.assert_array_equal(canvas, image)
+
+
+def test_grid_order_is_reproducible_with_seed():
+    image = _drawing()
+    first, _ = _decompose(image, "split", "grid", max_steps=12, seed=3)
+    second, _ = _decompose(image, "split", "grid", max_steps=12, seed=3)
+
+    assert first["order"] == second["order"]
+
+
+@pytest.mark.parametrize("sort_method, output_format", [("split", "delta"), ("position", "grid")])
+def test_mismatched_output_format_is_rejected(sort_method, output_format):
+    with pytest.raises(ValueError):
+        _decompose(_drawing(), sort_method, output_format)
@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+
+from app.services.guess_cache import GuessCache, hamming_distance, perceptual_hash
+
+
+def test_exact_hit():
+    cache = GuessCache(hamming_threshold=0)
+    cache.put("ctx", 0b1010, {"best_guess": "苹果"})
+
+    assert cache.get("ctx", 0b1010) == {"best_guess": "苹果"}
+    assert cache.get("ctx", 0b1011) is None
+    assert (cache.hits, cache.near_hits, cache.misses) == (1, 0, 1)
+
+
+def test_near_hit_within_threshold():
+    cache = GuessCache(hamming_threshold=2)
+    cache.put("ctx", 0b0000, {"best_guess": "苹果"})
+
+    assert cache.get("ctx", 0b0011) == {"best_guess": "苹果"}
+    assert cache.get("ctx", 0b0111) is None
+    assert cache.near_hits == 1
+
+
+def test_near_hit_picks_closest_hash():
+    cache = GuessCache(hamming_threshold=3)
+    cache.put("ctx", 0b0000, {"best_guess": "远"})
+    cache.put("ctx", 0b1110, {"best_guess": "近"})
+
+    assert cache.get("ctx", 0b1111)["best_guess"] == "近"
+
+
+def test_near_hit_does_not_cross_context():
+    cache = GuessCache(hamming_threshold=3)
+    cache.put("a", 0b0000, {"best_guess": "苹果"})
+
+    assert cache.get("b", 0b0001) is None
+
+
+def test_context_key_separates_api_keys():
+    base = ("prompt", "model", "https://api.example.com/v1")
+
+    assert GuessCache.context_key(*base, "key-a") != GuessCache.context_key(*base, "key-b")
+    assert GuessCache.context_key(*base, "key-a") == GuessCache.context_key(*base, "key-a")
+
+
+def test_lru_eviction():
+    cache = GuessCache(max_entries=2, hamming_threshold=0)
+    cache.put("ctx", 1, {"n": 1})
+    cache.put("ctx", 2, {"n": 2})
+    cache.get("ctx", 1)
+    cache.put("ctx", 4, {"n": 4})
+
+    assert cache.get("ctx", 2) is None
+    assert cache.get("ctx", 1) == {"n": 1}
+    assert cache.evictions == 1
+
+
+def test_perceptual_hash_tolerates_small_edits():
+    image = np.full((256, 256), 255, dtype=np.uint8)
+    cv2.circle(image, (100, 120), 60, 0, 4)
+    cv2.line(image, (20, 230), (230, 30), 0, 4)
+    edited = image.copy()
+    cv2.circle(edited, (190, 200), 2, 0, -1)
+    other = np.full((256, 256), 255, dtype=np.uint8)
+    cv2.rectangle(other, (40, 40), (220, 160), 0, 4)
+
+    assert hamming_distance(perceptual_hash(image), perceptual_hash(edited)) <= 3
+    assert hamming_distance(perceptual_hash(image), perceptual_hash(other)) > 3
@@ -0,0 +1,77 @@
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.routes import ai as ai_routes
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    async def fake_run_guess(req, image, request=None):
+        calls.append(req.clue)
+        return {"success": True, "best_guess": "苹果", "call": len(calls)}
+
+    monkeypatch.setattr(ai_routes, "_run_guess", fake_run_guess)
+    return calls
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def _guess(client, key, clue="水果"):
+    return client.post(
+        "/api/ai/guess",
+        json={"image": "data:image/png;base64,AAAA", "clue": clue},
+        headers={"Idempotency-Key": key},
+    )
+
+
+def test_retry_replays_first_result(client, calls):
+    key = uuid.uuid4().hex
+    first = _guess(client, key)
+    second = _guess(client, key)
+
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json()
+    assert second.headers.get("Idempotent-Replayed") == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert calls == ["水果"]
+
+
+def test_same_key_with_different_body_conflicts(client, calls):
+    key = uuid.uuid4().hex
+    assert _guess(client, key).status_code == 200
+
+    response = _guess(client, key, clue="动物")
+
+    assert response.status_code == 422
+    assert calls == ["水果"]
+
+
+def test_failed_result_is_not_stored(client, monkeypatch):
+    results = iter([{"success": False, "error": "upstream"}, {"success": True, "best_guess": "苹果"}])
+
+    async def flaky_run_guess(req, image, request=None):
+        return next(results)
+
+    monkeypatch.setattr(ai_routes, "_run_guess", flaky_run_guess)
+    key = uuid.uuid4().hex
+
+    assert _guess(client, key).json()["success"] is False
+    retry = _guess(client, key)
+    assert retry.json()["success"] is True
+    assert "Idempotent-Replayed" not in retry.headers
+
+
+def test_without_key_every_request_runs(client, calls):
+    for _ in range(2):
+        client.post("/api/ai/guess", json={"image": "data:image/png;base64,AAAA", "clue": "水果"})
+
+    assert len(calls) == 2
@@ -0,0 +1,84 @@
+import pytest
+
+from app.services import rate_limit
+from app.services.rate_limit import RateLimited, TokenBucketLimiter
+
+POLICIES = {"guess": {"session": (1.0, 2), "ip": (1.0, 3)}}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    return clock
+
+
+def test_burst_then_limited(clock):
+    limiter = TokenBucketLimiter(POLICIES)
+    limiter.check("guess", "s1", "1.2.3.4")
+    limiter.check("guess", "s1", "1.2.3.4")
+
+    with pytest.raises(RateLimited) as exc:
+        limiter.check("guess", "s1", "1.2.3.4")
+
+    assert exc.value.scope == "session"
+    assert exc.value.retry_after == 1
+    assert limiter.allowed == 2
+    assert limiter.limited == {"guess": 1}
+
+
+def test_tokens_refill_over_time(clock):
+    limiter = TokenBucketLimiter(POLICIES)
+    limiter.check("guess", "s1", "1.2.3.4")
+    limiter.check("guess", "s1", "1.2.3.4")
+
+    clock.now += 1.0
+    limiter.check("guess", "s1", "1.2.3.4")
+
+
+def test_ip_bucket_shared_across_sessions(clock):
+    limiter = TokenBucketLimiter(POLICIES)
+    limiter.check("guess", "s1", "1.2.3.4")
+    limiter.check("guess", "s2", "1.2.3.4")
+    limiter.check("guess", None, "1.2.3.4")
+
+    with pytest.raises(RateLimited) as exc:
+        limiter.check("guess", "s3", "1.2.3.4")
+
+    assert exc.value.scope == "ip"
+
+
+def test_rejected_request_refunds_session_token(clock):
+    limiter = TokenBucketLimiter(POLICIES)
+    for session in ("a", "b", "c"):
+        limiter.check("guess", session, "1.2.3.4")
+
+    with pytest.raises(RateLimited):
+        limiter.check("guess", "a", "1.2.3.4")
+    # 被 IP 桶拒绝的请求不消耗会话桶的令牌
+    limiter.check("guess", "a", "5.6.7.8")
+
+
+def test_unknown_policy_is_not_limited(clock):
+    limiter = TokenBucketLimiter(POLICIES)
+    for _ in range(10):
+        limiter.check("other", "s1", "1.2.3.4")
+
+
+def test_idle_buckets_are_evicted(clock):
+    limiter = TokenBucketLimiter(POLICIES, max_keys=2, idle_seconds=60)
+    limiter.check("guess", "s1", "1.2.3.4")
+
+    clock.now += 61
+    limiter.check("guess", None, "5.6.7.8")
+
+    assert limiter.stats()["buckets"] == 1
+    assert limiter.evicted == 2
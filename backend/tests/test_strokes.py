@@ -0,0 +1,62 @@
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+
+from app.config import config
+from app.main import app
+from app.models.schemas import Stroke
+from app.shared import stroke_drawing
+
+
+def test_stroke_accepts_pairs_and_flat_points():
+    assert Stroke(points=[[0, 0], [10, 5]]).points == [[0, 0], [10, 5]]
+    assert Stroke(points=[0, 0, 10, 5]).points == [0, 0, 10, 5]
+    assert Stroke(points=[]).width == 4
+
+
+@pytest.mark.parametrize("points", [[[0, 0, 1]], [[0]], [0, 0, 10]])
+def test_stroke_rejects_malformed_points(points):
+    with pytest.raises(ValidationError):
+        Stroke(points=points)
+
+
+@pytest.mark.parametrize("width", [0, -1, config.STROKE_MAX_WIDTH + 1])
+def test_stroke_rejects_width_out_of_range(width):
+    with pytest.raises(ValidationError):
+        Stroke(points=[0, 0], width=width)
+
+
+def test_stroke_drawing_validates_raw_json():
+    with pytest.raises(HTTPException) as exc:
+        stroke_drawing([{"points": [0, 0, 1]}])
+
+    assert exc.value.status_code == 422
+
+
+def test_stroke_drawing_limits_points(monkeypatch):
+    monkeypatch.setattr(config, "STROKE_MAX_POINTS", 3)
+    stroke_drawing([{"points": [[0, 0], [1, 1]]}, {"points": [2, 2]}])
+
+    with pytest.raises(HTTPException) as exc:
+        stroke_drawing([{"points": [[0, 0], [1, 1]]}, {"points": [2, 2, 3, 3]}])
+
+    assert exc.value.status_code == 413
+
+
+def test_stroke_drawing_limits_canvas(monkeypatch):
+    monkeypatch.setattr(config, "STROKE_MAX_CANVAS_SIDE", 512)
+    stroke_drawing([{"points": [0, 0]}], 512, 256)
+
+    with pytest.raises(HTTPException) as exc:
+        stroke_drawing([{"points": [0, 0]}], 256, 513)
+
+    assert exc.value.status_code == 413
+
+
+@pytest.mark.parametrize("strokes", [[], [{"points": []}], [{"points": [[5, 5], [50, 50]], "erase": True}]])
+def test_guess_rejects_strokes_without_ink(strokes):
+    with TestClient(app) as client:
+        response = client.post("/api/ai/guess", json={"strokes": strokes, "canvas_width": 100, "canvas_height": 100})
+
+    assert response.status_code == 400